@@ -0,0 +1,51 @@
+# gunicorn.conf.py
+"""
+Конфигурация gunicorn для ML API.
+
+Запуск (из любой директории):
+    gunicorn -c api/gunicorn.conf.py
+
+Приложение загружается в главном процессе (preload_app), после чего все
+объекты замораживаются (gc.freeze), и только затем запускаются воркеры.
+Массивы упакованного леса рабочей модели отображаются из файлов артефакта
+только для чтения (см. AdMetricsPredictor.load_model), поэтому воркеры,
+загрузившие одну версию модели, разделяют ее страницы в кэше ОС - и при
+запуске, и после подхвата новой версии. Модели sklearn для лесов читаются
+с диска только для дообучения; модели других бэкендов (бустинг, Ridge)
+загружаются в каждый воркер.
+
+Переменные окружения:
+    ML_API_BIND      - адрес (по умолчанию 0.0.0.0:5000)
+    ML_API_WORKERS   - число процессов (по умолчанию - число ядер)
+    ML_API_THREADS   - число потоков в каждом процессе (по умолчанию 4)
+    ML_API_TIMEOUT   - таймаут запроса в секундах (по умолчанию 300;
+                       синхронное обучение может идти долго)
+
+Состояние, которое меняется во время работы, общее для всех воркеров:
+- модель, обученная через /api/train в одном воркере, подхватывается
+  остальными по артефакту на диске (см. refresh_model в ml_api.py), а модели
+  магазинов в реестре перезагружаются при смене версии их артефактов;
+- наборы данных (dataset_store) изменяются под файловой блокировкой и
+  перечитываются, если их изменил другой воркер;
+- состояние задач асинхронного обучения хранится в data/training_jobs,
+  поэтому статус, прогресс и отмена доступны из любого воркера.
+"""
+import gc
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'wsgi:app'
+
+bind = os.environ.get('ML_API_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('ML_API_WORKERS') or os.cpu_count() or 1)
+threads = int(os.environ.get('ML_API_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.environ.get('ML_API_TIMEOUT', '300'))
+preload_app = True
+
+
+def when_ready(server):
+    # Приложение и модель уже загружены: переносим все объекты в постоянное
+    # поколение, чтобы сборка мусора в воркерах не записывала в их страницы
+    gc.freeze()
+    server.log.info(f"ML API: {workers} воркеров x {threads} потоков, объектов заморожено: {gc.get_freeze_count()}")
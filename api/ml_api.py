@@ -1,5 +1,5 @@
 # app.py
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, current_app, jsonify, request, stream_with_context
 from flask_cors import CORS
 import joblib
 import pandas as pd
@@ -9,8 +9,8 @@ import sys
 import os
 import json
 import logging
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import threading
+import time
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -26,437 +26,930 @@ if python_dir not in sys.path:
 
 # Импортируем необходимый класс
 try:
-    from ml_model import AdMetricsPredictor
+    from ml_model import (AdMetricsPredictor, PORTFOLIO_KEY, PORTFOLIO_CHUNK_SIZE,
+                          TRAIN_MODES, TrainingCancelled, get_artifact_stamp, open_history_storage,
+                          read_model_metadata)
+    from dataset_store import DatasetStore, DatasetNotFoundError
+    from feature_cache import FeatureCache
+    from training_jobs import TrainingJobManager
+    from model_registry import ModelRegistry, ModelNotFoundError
+    from prediction_cache import PredictionCache, make_prediction_key
+    from prediction_service import PredictionService
+    from streaming_ingest import ingest_stream, IngestError
+    from training_charts import TrainingChartsCache
+    from recommendations import RecommendationEngine, history_signals, forecast_signals
     logger.info("Модуль ml_model успешно импортирован!")
 except ImportError as e:
     logger.error(f"Ошибка импорта ml_model: {e}")
     raise
 
-app = Flask(__name__)
-CORS(app)  # Разрешаем CORS для фронтенда
+# Маршруты API; приложение с ними собирает create_app
+bp = Blueprint('ml_api', __name__)
 
-# Глобальные переменные для модели
-predictor = AdMetricsPredictor()
-model_trained = False
-last_trained = None
-# Используем абсолютный путь относительно директории api или корня проекта
-model_save_path = os.path.abspath(os.path.join(current_dir, '..', 'data', 'model_weights', 'ad_metrics_model.pkl'))
+# Ключ состояния сервиса в app.extensions
+STATE_KEY = 'ml_api'
+# Типы тела /api/train, которые принимаются потоково (см. streaming_ingest)
+STREAMING_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
 
-# Убедимся, что директория для сохранения модели существует
-os.makedirs(os.path.dirname(model_save_path), exist_ok=True)
+def load_config():
+    """
+    Настройки сервиса из переменных окружения. Ключи совпадают с именами
+    переменных, поэтому любую настройку можно переопределить в create_app(config).
+    
+    Returns:
+        dict: Настройки для app.config.
+    """
+    return {
+        # Директория данных сервиса (модели, наборы данных); по умолчанию data/ в корне проекта
+        'ML_DATA_DIR': os.environ.get('ML_DATA_DIR') or os.path.join(current_dir, '..', 'data'),
+        # История дашборда (historical_data.json и хранилище '<имя>.store' рядом с ним,
+        # см. open_history_storage); отдается через /api/history
+        'ML_HISTORY_PATH': os.environ.get('ML_HISTORY_PATH') or os.path.join(current_dir, 'data', 'historical_data.json'),
+        # Режим параллельного обучения, движок, бэкенд моделей, валидация и способ предсказания
+        # (см. AdMetricsPredictor.__init__)
+        'ML_PREDICTOR_OPTIONS': {
+            'execution': os.environ.get('ML_TRAIN_EXECUTION', 'sequential'),
+            'n_workers': int(os.environ['ML_TRAIN_WORKERS']) if os.environ.get('ML_TRAIN_WORKERS') else None,
+            'tree_jobs': int(os.environ['ML_TRAIN_TREE_JOBS']) if os.environ.get('ML_TRAIN_TREE_JOBS') else None,
+            'engine': os.environ.get('ML_MODEL_ENGINE', 'separate'),
+            'backend': os.environ.get('ML_MODEL_BACKEND', 'random_forest'),
+            'validation': os.environ.get('ML_TRAIN_VALIDATION', 'random'),
+            'inference': os.environ.get('ML_INFERENCE_ENGINE', 'sklearn')
+        },
+        # Режим /api/train по умолчанию: full, incremental или auto (см. AdMetricsPredictor.train)
+        'ML_TRAIN_MODE': os.environ.get('ML_TRAIN_MODE', 'full'),
+        # Сжатие моделей sklearn в артефакте (0 - без сжатия); упакованный лес, по которому
+        # вычисляются предсказания, не сжимается и загружается через memory map
+        'ML_MODEL_COMPRESS': int(os.environ.get('ML_MODEL_COMPRESS', '0')),
+        # Ограничения реестра моделей магазинов
+        'ML_REGISTRY_MAX_MODELS': int(os.environ.get('ML_REGISTRY_MAX_MODELS', '32')),
+        'ML_REGISTRY_MAX_MB': int(os.environ.get('ML_REGISTRY_MAX_MB', '2048')),
+        # Кэш предсказаний
+        'ML_PREDICTION_CACHE_SIZE': int(os.environ.get('ML_PREDICTION_CACHE_SIZE', '1024')),
+        'ML_PREDICTION_CACHE_TTL': float(os.environ.get('ML_PREDICTION_CACHE_TTL', '300')),
+        # Пул потоков и пакетирование сервиса предсказаний
+        'ML_PREDICT_THREADS': int(os.environ['ML_PREDICT_THREADS']) if os.environ.get('ML_PREDICT_THREADS') else None,
+        'ML_PREDICT_BATCH_WINDOW_MS': float(os.environ.get('ML_PREDICT_BATCH_WINDOW_MS', '2')),
+        'ML_PREDICT_TIMEOUT': float(os.environ.get('ML_PREDICT_TIMEOUT', '60')),
+        # Ограничение числа кампаний в одном запросе /api/recommendations/portfolio и /api/predict/batch
+        'ML_PORTFOLIO_MAX_CAMPAIGNS': int(os.environ.get('ML_PORTFOLIO_MAX_CAMPAIGNS', '10000')),
+        # Число наборов данных, записи которых держатся в памяти
+        'ML_DATASET_CACHE_SIZE': int(os.environ.get('ML_DATASET_CACHE_SIZE', '64')),
+        # Как часто проверять, не сохранил ли другой процесс сервиса новую модель (секунды)
+        'ML_MODEL_REFRESH_INTERVAL': float(os.environ.get('ML_MODEL_REFRESH_INTERVAL', '2')),
+        # Ограничение числа записей в потоковом запросе на обучение (0 - без ограничения)
+        'ML_STREAM_MAX_ROWS': int(os.environ.get('ML_STREAM_MAX_ROWS', '0')),
+    }
+
+class MLApiState:
+    """
+    Состояние одного экземпляра приложения: рабочая модель, кэши, реестр
+    моделей магазинов, очередь задач обучения и хранилища данных.
+    Создается в create_app, поэтому каждое приложение (воркер, тест)
+    получает собственные объекты.
+    """
+    
+    def __init__(self, config):
+        """
+        Args:
+            config (Mapping): Настройки приложения (см. load_config).
+        """
+        # Рабочая модель
+        self.predictor_options = dict(config['ML_PREDICTOR_OPTIONS'])
+        self.predictor = AdMetricsPredictor(**self.predictor_options)
+        self.model_trained = False
+        self.last_trained = None
+        self.default_train_mode = config['ML_TRAIN_MODE']
+        # Блокировка для атомарной подмены модели после обучения
+        self.model_lock = threading.Lock()
+        self.data_dir = os.path.abspath(config['ML_DATA_DIR'])
+        # Очередь фоновых задач обучения; состояние задач доступно всем процессам сервиса
+        self.training_jobs = TrainingJobManager(jobs_dir=os.path.join(self.data_dir, 'training_jobs'))
+        self.model_save_path = os.path.join(self.data_dir, 'model_weights', 'ad_metrics_model')
+        # Файл модели старого формата (один joblib-файл), загружается, если нового артефакта еще нет
+        self.legacy_model_path = f'{self.model_save_path}.pkl'
+        self.model_compress = config['ML_MODEL_COMPRESS']
+        # Убедимся, что директория для сохранения модели существует
+        os.makedirs(os.path.dirname(self.model_save_path), exist_ok=True)
+
+        # Реестр моделей отдельных магазинов/кампаний с LRU-вытеснением
+        self.model_registry = ModelRegistry(
+            os.path.join(os.path.dirname(self.model_save_path), 'tenants'),
+            max_models=config['ML_REGISTRY_MAX_MODELS'],
+            max_bytes=config['ML_REGISTRY_MAX_MB'] * 1024 ** 2,
+            predictor_options=self.predictor_options
+        )
+        # Кэш предсказаний, общий для /api/predict и /api/recommendations
+        self.prediction_cache = PredictionCache(
+            max_entries=config['ML_PREDICTION_CACHE_SIZE'],
+            ttl_seconds=config['ML_PREDICTION_CACHE_TTL']
+        )
+        # Предсказания в пуле потоков с объединением одинаковых запросов и пакетированием по модели
+        self.prediction_service = PredictionService(
+            max_workers=config['ML_PREDICT_THREADS'],
+            batch_window=config['ML_PREDICT_BATCH_WINDOW_MS'] / 1000,
+            timeout=config['ML_PREDICT_TIMEOUT']
+        )
+        # Правила рекомендаций, откомпилированные один раз при запуске
+        self.recommendation_engine = RecommendationEngine()
+        self.portfolio_max_campaigns = config['ML_PORTFOLIO_MAX_CAMPAIGNS']
+
+        # Серверное хранилище исторических данных по ID кампании/магазина
+        self.dataset_store = DatasetStore(os.path.join(self.data_dir, 'datasets'),
+                                          max_cached=config['ML_DATASET_CACHE_SIZE'])
+        # Кэш признаков для наборов данных из хранилища
+        self.feature_cache = FeatureCache()
+        self.history_path = os.path.abspath(config['ML_HISTORY_PATH'])
+        # Графики обучения текущей модели, построенные один раз после обучения
+        self.training_charts = TrainingChartsCache(
+            os.path.join(os.path.dirname(self.model_save_path), 'training_charts.json'))
+
+        self.model_refresh_interval = config['ML_MODEL_REFRESH_INTERVAL']
+        # Отметка файла CURRENT артефакта, соответствующая загруженной модели
+        self.model_artifact_stamp = None
+        self.model_checked_at = 0.0
+        self.model_refresh_lock = threading.Lock()
+        self.stream_max_rows = config['ML_STREAM_MAX_ROWS'] or None
+
+    def resolve_historical_data(self, data):
+        """
+        Получение исторических данных из тела запроса.
+        Если передан dataset_id, история берется из серверного хранилища,
+        а признаки - из инкрементального кэша; иначе используется поле historical_data.
+
+        Returns:
+            tuple: (historical_data, model_input, dataset_id), где model_input -
+                DataFrame с признаками для набора данных из хранилища или
+                сам historical_data для переданной в запросе истории.
+        """
+        dataset_id = data.get('dataset_id')
+        if dataset_id:
+            rows, info = self.dataset_store.snapshot(dataset_id)
+            if not rows:
+                return rows, rows, dataset_id
+            return rows, self.feature_cache.get(dataset_id, rows, epoch=info['epoch']), dataset_id
+        historical_data = data.get('historical_data', [])
+        return historical_data, historical_data, None
+
+    def resolve_predictor(self, data):
+        """
+        Модель для запроса: при переданном shop_id - модель магазина из реестра,
+        иначе общая модель.
+
+        Returns:
+            tuple: (predictor или None, если модель не обучена, shop_id)
+        """
+        shop_id = data.get('shop_id')
+        if shop_id:
+            try:
+                return self.model_registry.get(shop_id), shop_id
+            except ModelNotFoundError:
+                return None, shop_id
+        return (self.predictor if self.model_trained else None), None
+
+    def resolve_portfolio(self, data):
+        """
+        Истории кампаний портфеля из тела запроса: поле campaigns
+        ({campaign_id: historical_data}) и/или dataset_ids (наборы из хранилища).
 
-@app.route('/api/health', methods=['GET'])
+        Returns:
+            dict: {campaign_id: model_input} (см. resolve_historical_data).
+        """
+        campaigns = dict(data.get('campaigns') or {})
+        for dataset_id in data.get('dataset_ids') or []:
+            campaigns[dataset_id] = self.resolve_historical_data({'dataset_id': dataset_id})[1]
+        return campaigns
+
+    def artifact_stamp(self):
+        """Отметка (inode, mtime) файла CURRENT артефакта модели или None, если модели нет."""
+        return get_artifact_stamp(self.model_save_path)
+
+    def load_saved_model(self):
+        """
+        Загрузка сохраненной модели и подмена рабочей.
+
+        Упакованный лес артефакта отображается в память, а модели sklearn не
+        читаются (см. AdMetricsPredictor.load_model): загрузка занимает
+        миллисекунды, а процессы, загрузившие одну версию, разделяют ее
+        страницы в кэше ОС.
+
+        Returns:
+            bool: Была ли загружена модель.
+        """
+        stamp = self.artifact_stamp()
+        startup_model_path = self.model_save_path if stamp is not None else self.legacy_model_path
+        if not os.path.exists(startup_model_path):
+            logger.info(f"Файл модели {self.model_save_path} не найден. Будет использована новая модель.")
+            return False
+        try:
+            loaded = AdMetricsPredictor(**self.predictor_options)
+            loaded.load_model(startup_model_path)
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить модель из {startup_model_path}: {e}")
+            return False
+        with self.model_lock:
+            self.predictor = loaded
+            self.prediction_cache.clear()
+            self.model_trained = True
+            self.last_trained = (loaded.training_stats.get('train_date')
+                                 or datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self.model_artifact_stamp = stamp
+        logger.info(f"Загружена ранее обученная модель из {startup_model_path}.")
+        return True
+
+    def refresh_model(self):
+        """
+        Подхват модели, обученной и сохраненной другим процессом сервиса.
+        При нескольких воркерах обучение подменяет модель только в своем
+        процессе, остальные замечают новую версию артефакта по файлу CURRENT.
+        """
+        now = time.monotonic()
+        if (now - self.model_checked_at < self.model_refresh_interval
+                or not self.model_refresh_lock.acquire(blocking=False)):
+            return
+        try:
+            self.model_checked_at = now
+            stamp = self.artifact_stamp()
+            if stamp is None or stamp == self.model_artifact_stamp:
+                return
+            try:
+                saved_version = read_model_metadata(self.model_save_path).get('model_version')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать метаданные модели: {e}")
+                return
+            if self.model_trained and saved_version == self.predictor.model_version:
+                # Модель сохранена этим же процессом
+                self.model_artifact_stamp = stamp
+                return
+            logger.info(f"Обнаружена новая версия модели {saved_version}, загрузка...")
+            self.load_saved_model()
+        finally:
+            self.model_refresh_lock.release()
+
+    def active_predictor(self):
+        """Общая модель или None, если она еще не обучена."""
+        with self.model_lock:
+            return self.predictor if self.model_trained else None
+
+    def prediction_key(self, active_predictor, historical_data, days_ahead):
+        """Ключ кэша предсказаний: хвост истории, горизонт и версия модели."""
+        return make_prediction_key(historical_data, days_ahead, active_predictor.model_version or id(active_predictor))
+
+    def cached_predictions(self, active_predictor, historical_data, model_input, days_ahead, key=None):
+        """
+        Предсказания через общий кэш. Ключ включает хвост истории,
+        горизонт и версию модели, поэтому новая модель не получит старые ответы.
+        Промахи вычисляются сервисом предсказаний, который объединяет
+        одновременные одинаковые запросы и пакетирует запросы к одной модели.
+        """
+        if key is None:
+            key = self.prediction_key(active_predictor, historical_data, days_ahead)
+        predictions = self.prediction_cache.get(key)
+        if predictions is None:
+            predictions = self.prediction_service.predict(key, active_predictor, model_input, days_ahead)
+            self.prediction_cache.put(key, predictions)
+        return predictions
+
+    def cached_recommendations(self, active_predictor, historical_data, model_input, days_ahead):
+        """
+        Рекомендации через общий кэш под ключом предсказания: рекомендации
+        зависят от тех же хвоста истории, горизонта и версии модели, поэтому
+        при попадании не строятся ни признаки истории, ни предсказания.
+        Рекомендации без предсказаний (предсказать не удалось) не кэшируются.
+        """
+        key = self.prediction_key(active_predictor, historical_data, days_ahead)
+        recommendations_key = f'recommendations|{key}'
+        recommendations = self.prediction_cache.get(recommendations_key)
+        if recommendations is not None:
+            return recommendations
+        try:
+            predictions = self.cached_predictions(active_predictor, historical_data, model_input, days_ahead, key=key)
+        except Exception as pred_error:
+            logger.warning(f"Не удалось получить предсказания для рекомендаций: {pred_error}")
+            predictions = None # Рекомендации строятся только по истории
+        features = active_predictor.build_features(model_input)
+        recommendations = self.recommendation_engine.recommend(features, predictions or [], days_ahead)
+        if predictions is not None:
+            self.prediction_cache.put(recommendations_key, recommendations)
+        return recommendations
+
+    def train_and_install(self, model_input, data_points, progress_callback=None, cancel_event=None, shop_id=None,
+                          mode='full'):
+        """
+        Обучение нового экземпляра предиктора и атомарная подмена рабочей модели.
+        Пока идет обучение, запросы обслуживаются прежней моделью.
+        При переданном shop_id модель регистрируется в реестре магазинов.
+
+        В режимах 'incremental' и 'auto' дообучается копия текущей модели
+        (общей или модели магазина), если она уже обучена.
+
+        Returns:
+            dict: Результат обучения для ответа API.
+        """
+        base = None
+        if mode != 'full':
+            if shop_id:
+                try:
+                    base = self.model_registry.get(shop_id)
+                except ModelNotFoundError:
+                    base = None
+            else:
+                # Дообучается последняя сохраненная модель, даже если ее обучил другой процесс
+                if self.artifact_stamp() not in (None, self.model_artifact_stamp):
+                    self.load_saved_model()
+                base = self.active_predictor()
+        new_predictor = base.clone() if base is not None else AdMetricsPredictor(**self.predictor_options)
+        new_predictor.train(model_input, progress_callback=progress_callback, cancel_event=cancel_event, mode=mode)
+        if cancel_event is not None and cancel_event.is_set():
+            # Отмена пришла во время обучения последней модели: не сохраняем и не подменяем
+            raise TrainingCancelled("Обучение отменено.")
+        update = new_predictor.training_stats['update']
+        if shop_id:
+            self.model_registry.put(shop_id, new_predictor, compress=self.model_compress)
+            self.prediction_cache.clear()
+            logger.info(f"Модель магазина '{shop_id}' успешно обучена.")
+            return {
+                'status': 'success',
+                'message': 'Модель успешно обучена',
+                'last_trained': new_predictor.training_stats['train_date'],
+                'data_points': data_points,
+                'training_mode': update['mode'],
+                'update': update,
+                'shop_id': shop_id
+            }
+        # Сохраняем модель
+        installed = new_predictor
+        try:
+            new_predictor.save_model(self.model_save_path, compress=self.model_compress)
+            logger.info(f"Модель успешно сохранена в {self.model_save_path}.")
+            # Рабочей становится модель из артефакта: ее упакованный лес отображен
+            # в память и разделяется с процессами, которые загрузили эту же версию
+            loaded = AdMetricsPredictor(**self.predictor_options)
+            loaded.load_model(self.model_save_path)
+            if loaded.model_version == new_predictor.model_version:
+                installed = loaded
+        except Exception as save_error:
+            logger.error(f"Ошибка при сохранении модели: {save_error}")
+            # Не возвращаем ошибку клиенту, так как обучение прошло успешно
+        with self.model_lock:
+            self.predictor = installed
+            self.prediction_cache.clear()
+            self.model_trained = True
+            self.last_trained = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            trained_at = self.last_trained
+            self.model_artifact_stamp = self.artifact_stamp()
+        try:
+            self.training_charts.update(new_predictor.model_version, new_predictor.training_stats)
+        except Exception as charts_error:
+            # Графики будут построены при первом запросе /api/training-charts
+            logger.error(f"Ошибка при построении графиков обучения: {charts_error}")
+        logger.info("Модель успешно обучена.")
+        return {
+            'status': 'success',
+            'message': 'Модель успешно обучена',
+            'last_trained': trained_at,
+            'data_points': data_points,
+            'training_mode': update['mode'],
+            'update': update
+        }
+
+def get_state():
+    """Состояние текущего приложения (см. MLApiState)."""
+    return current_app.extensions[STATE_KEY]
+
+def create_app(config=None):
+    """
+    Создание приложения ML API со своим состоянием: рабочей моделью,
+    кэшами, реестром моделей, очередью задач обучения и хранилищами.
+    Используется api/wsgi.py, сервером разработки и тестами.
+
+    Args:
+        config (dict, optional): Настройки, переопределяющие значения из
+            переменных окружения (см. load_config), например ML_DATA_DIR.
+            
+    Returns:
+        Flask: Приложение с загруженной моделью.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(load_config())
+    if config:
+        app.config.update(config)
+    CORS(app)  # Разрешаем CORS для фронтенда
+    app.register_blueprint(bp)
+    state = MLApiState(app.config)
+    app.extensions[STATE_KEY] = state
+    state.load_saved_model()
+    return app
+
+@bp.before_app_request
+def refresh_model():
+    """Подхват модели, сохраненной другим процессом сервиса (см. MLApiState.refresh_model)."""
+    get_state().refresh_model()
+
+@bp.route('/api/health', methods=['GET'])
 def health_check():
     """Проверка состояния API"""
+    state = get_state()
     return jsonify({
         'status': 'ok',
-        'model_loaded': model_trained,
-        'last_trained': last_trained
+        'model_loaded': state.model_trained,
+        'last_trained': state.last_trained
     })
 
-@app.route('/api/train', methods=['POST'])
+@bp.route('/api/train', methods=['POST'])
 def train_model():
-    """API endpoint для обучения модели"""
-    global model_trained, last_trained, predictor
+    """
+    API endpoint для обучения модели.
+    С параметром async (в теле запроса или в query string) обучение ставится
+    в фоновую очередь и сразу возвращается идентификатор задачи.
+    Параметр mode (full, incremental или auto; по умолчанию ML_TRAIN_MODE)
+    выбирает полное обучение или дообучение текущей модели.
+    
+    Тело с типом application/x-ndjson или запрос с ?stream=1 принимается
+    потоково: JSON-массив записей или JSON Lines разбирается по одной записи
+    прямо в колонки, а shop_id и async передаются в query string.
+    """
+    state = get_state()
     try:
+        if is_streaming_request():
+            return train_from_stream(state)
+
         data = request.json
         if not data:
              logger.warning("Запрос на обучение: Тело запроса пустое или не в формате JSON.")
              return jsonify({'error': 'Тело запроса должно быть в формате JSON'}), 400
 
-        historical_data = data.get('historical_data', [])
+        historical_data, model_input, dataset_id = state.resolve_historical_data(data)
         if not historical_data:
             logger.warning("Запрос на обучение: Не предоставлены исторические данные.")
             return jsonify({'error': 'Не предоставлены исторические данные'}), 400
 
-        logger.info(f"Начало обучения модели с {len(historical_data)} точками данных...")
-        # Здесь будет реальное обучение модели
-        predictor.train(historical_data)
-        model_trained = True
-        last_trained = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        # Сохраняем модель
-        try:
-            predictor.save_model(model_save_path)
-            logger.info(f"Модель успешно сохранена в {model_save_path}.")
-        except Exception as save_error:
-            logger.error(f"Ошибка при сохранении модели: {save_error}")
-            # Не возвращаем ошибку клиенту, так как обучение прошло успешно
-        logger.info("Модель успешно обучена.")
-        return jsonify({
-            'status': 'success',
-            'message': 'Модель успешно обучена',
-            'last_trained': last_trained,
-            'data_points': len(historical_data)
-        })
+        mode = data.get('mode', request.args.get('mode', state.default_train_mode))
+        if mode not in TRAIN_MODES:
+            return jsonify({'error': f"Неизвестный режим обучения '{mode}'. Доступны: {', '.join(TRAIN_MODES)}"}), 400
+
+        run_async = data.get('async', request.args.get('async', '').lower() in ('1', 'true'))
+        return start_training(state, model_input, len(historical_data), data.get('shop_id'), run_async,
+                              {'dataset_id': dataset_id}, mode)
+    except DatasetNotFoundError as e:
+        logger.warning(f"Набор данных {e} не найден.")
+        return jsonify({'error': f'Набор данных {e} не найден'}), 404
+    except ValueError as e:
+        logger.warning(f"Запрос на обучение: некорректные параметры: {e}")
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка при обучении модели: {e}", exc_info=True)
         return jsonify({'error': f'Ошибка при обучении модели: {str(e)}'}), 500
 
-@app.route('/api/predict', methods=['POST'])
+def is_streaming_request():
+    """Нужно ли принимать тело /api/train потоково."""
+    return (request.mimetype in STREAMING_MIMETYPES
+            or request.args.get('stream', '').lower() in ('1', 'true'))
+
+def train_from_stream(state):
+    """Обучение на данных, принятых потоково из тела запроса."""
+    mode = request.args.get('mode', state.default_train_mode)
+    if mode not in TRAIN_MODES:
+        return jsonify({'error': f"Неизвестный режим обучения '{mode}'. Доступны: {', '.join(TRAIN_MODES)}"}), 400
+    try:
+        ingested = ingest_stream(request.stream, content_length=request.content_length,
+                                 max_rows=state.stream_max_rows)
+    except IngestError as e:
+        logger.warning(f"Запрос на обучение: не удалось разобрать поток данных: {e}")
+        return jsonify({'error': f'Некорректные данные: {e}'}), 400
+    if not ingested.rows:
+        logger.warning("Запрос на обучение: в потоке нет корректных записей.")
+        return jsonify({'error': 'Не предоставлены исторические данные', **ingested.to_dict()}), 400
+    run_async = request.args.get('async', '').lower() in ('1', 'true')
+    return start_training(state, ingested.columns, ingested.rows, request.args.get('shop_id'), run_async,
+                          {'dataset_id': None, 'ingest': ingested.to_dict()}, mode)
+
+def start_training(state, model_input, data_points, shop_id, run_async, extra, mode='full'):
+    """
+    Синхронное обучение или постановка задачи обучения в очередь.
+    
+    Args:
+        state (MLApiState): Состояние приложения.
+        model_input: Данные для AdMetricsPredictor.train.
+        data_points (int): Число исторических записей.
+        shop_id (str | None): Магазин, для которого обучается модель.
+        run_async (bool): Обучать ли в фоновой задаче.
+        extra (dict): Дополнительные поля результата (dataset_id, статистика приема).
+        mode (str): Режим обучения (см. AdMetricsPredictor.train).
+    """
+    if run_async:
+        job = state.training_jobs.submit(
+            lambda progress_callback, cancel_event: dict(
+                state.train_and_install(model_input, data_points, progress_callback, cancel_event, shop_id, mode),
+                **extra
+            ),
+            description={'data_points': data_points, 'shop_id': shop_id, 'mode': mode, **extra}
+        )
+        return jsonify({
+            'status': job.status,
+            'job_id': job.job_id,
+            'status_url': f'/api/train/jobs/{job.job_id}',
+            'progress_url': f'/api/train/jobs/{job.job_id}/progress',
+            **extra
+        }), 202
+
+    logger.info(f"Начало обучения модели с {data_points} точками данных...")
+    result = state.train_and_install(model_input, data_points, shop_id=shop_id, mode=mode)
+    result.update(extra)
+    return jsonify(result)
+
+@bp.route('/api/train/jobs', methods=['GET'])
+def list_training_jobs():
+    """API endpoint для получения списка задач обучения"""
+    return jsonify({'jobs': get_state().training_jobs.list()})
+
+@bp.route('/api/train/jobs/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """API endpoint для получения статуса задачи обучения"""
+    job = get_state().training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Задача обучения '{job_id}' не найдена"}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/api/train/jobs/<job_id>/progress', methods=['GET'])
+def get_training_job_progress(job_id):
+    """API endpoint для получения прогресса задачи обучения по метрикам"""
+    job = get_state().training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Задача обучения '{job_id}' не найдена"}), 404
+    return jsonify(job.progress_dict())
+
+@bp.route('/api/train/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_training_job(job_id):
+    """API endpoint для отмены задачи обучения"""
+    job = get_state().training_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f"Задача обучения '{job_id}' не найдена"}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/api/predict', methods=['POST'])
 def predict_metrics():
     """API endpoint для предсказания метрик"""
-    global model_trained, predictor
-    if not model_trained:
-        logger.warning("Запрос на предсказание: Модель не обучена.")
-        return jsonify({'error': 'Модель не обучена'}), 400
+    state = get_state()
     try:
         data = request.json
         if not data:
              logger.warning("Запрос на предсказание: Тело запроса пустое или не в формате JSON.")
              return jsonify({'error': 'Тело запроса должно быть в формате JSON'}), 400
 
-        historical_data = data.get('historical_data', [])
+        active_predictor, shop_id = state.resolve_predictor(data)
+        if active_predictor is None:
+            logger.warning("Запрос на предсказание: Модель не обучена.")
+            return jsonify({'error': 'Модель не обучена'}), 400
+
+        historical_data, model_input, dataset_id = state.resolve_historical_data(data)
         days_ahead = data.get('days_ahead', 7)
         if not historical_data:
             logger.warning("Запрос на предсказание: Не предоставлены исторические данные.")
             return jsonify({'error': 'Не предоставлены исторические данные'}), 400
         logger.info(f"Генерация предсказаний на {days_ahead} дней...")
         # Используем реальную модель для предсказаний
-        predictions = predictor.predict_next_days(historical_data, days_ahead)
+        predictions = state.cached_predictions(active_predictor, historical_data, model_input, days_ahead)
         logger.info(f"Сгенерировано {len(predictions)} предсказаний.")
         return jsonify({
             'predictions': predictions,
-            'days_ahead': days_ahead
+            'days_ahead': days_ahead,
+            'dataset_id': dataset_id,
+            'shop_id': shop_id
         })
+    except DatasetNotFoundError as e:
+        logger.warning(f"Набор данных {e} не найден.")
+        return jsonify({'error': f'Набор данных {e} не найден'}), 404
+    except ValueError as e:
+        logger.warning(f"Запрос на предсказание: некорректные параметры: {e}")
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка при генерации предсказаний: {e}", exc_info=True)
         return jsonify({'error': f'Ошибка при генерации предсказаний: {str(e)}'}), 500
 
-@app.route('/api/recommendations', methods=['POST'])
+@bp.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    API endpoint для пакетного предсказания метрик многих кампаний.
+    
+    Тело запроса: campaigns ({campaign_id: historical_data}) и/или dataset_ids,
+    days_ahead, shop_id, chunk_size (число кампаний в одном вызове модели).
+    Ответ - NDJSON, строки отправляются по мере обработки пакетов кампаний:
+    {"campaign_id": ..., "predictions": [...]} или {"campaign_id": ..., "error": ...}
+    для каждой кампании и последняя строка {"summary": {...}}.
+    """
+    state = get_state()
+    try:
+        data = request.json
+        if not data:
+            logger.warning("Пакетный запрос на предсказание: Тело запроса пустое или не в формате JSON.")
+            return jsonify({'error': 'Тело запроса должно быть в формате JSON'}), 400
+        active_predictor, shop_id = state.resolve_predictor(data)
+        if active_predictor is None:
+            logger.warning("Пакетный запрос на предсказание: Модель не обучена.")
+            return jsonify({'error': 'Модель не обучена'}), 400
+        campaigns = state.resolve_portfolio(data)
+        if not campaigns:
+            return jsonify({'error': 'Не предоставлены кампании (campaigns или dataset_ids)'}), 400
+        if len(campaigns) > state.portfolio_max_campaigns:
+            return jsonify({'error': f'Превышено максимальное число кампаний: {state.portfolio_max_campaigns}'}), 400
+        days_ahead = int(data.get('days_ahead', 7))
+        chunk_size = max(int(data.get('chunk_size', PORTFOLIO_CHUNK_SIZE)), 1)
+    except DatasetNotFoundError as e:
+        logger.warning(f"Набор данных {e} не найден.")
+        return jsonify({'error': f'Набор данных {e} не найден'}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Некорректные параметры запроса: {e}'}), 400
+    
+    def generate():
+        start = time.perf_counter()
+        processed = errors = 0
+        lines = []
+        try:
+            for campaign_id, predictions, error in active_predictor.iter_portfolio_predictions(
+                    campaigns, days_ahead, chunk_size):
+                processed += 1
+                if error is None:
+                    line = {'campaign_id': campaign_id, 'predictions': predictions}
+                else:
+                    errors += 1
+                    line = {'campaign_id': campaign_id, 'error': error}
+                lines.append(json.dumps(line, ensure_ascii=False))
+                # Отправляем строки пакетами, а не по одной
+                if len(lines) >= chunk_size:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+        except Exception as e:
+            # Статус ответа уже отправлен, поэтому ошибка передается строкой потока
+            logger.error(f"Ошибка при пакетной генерации предсказаний: {e}", exc_info=True)
+            lines.append(json.dumps({'error': f'Ошибка при генерации предсказаний: {str(e)}'}, ensure_ascii=False))
+        elapsed = time.perf_counter() - start
+        logger.info(f"Пакетные предсказания для {processed} кампаний сгенерированы за {elapsed:.2f} с "
+                    f"(ошибок: {errors}).")
+        lines.append(json.dumps({'summary': {
+            'campaigns': len(campaigns),
+            'processed': processed,
+            'errors': errors,
+            'days_ahead': days_ahead,
+            'shop_id': shop_id,
+            'elapsed_s': round(elapsed, 3)
+        }}, ensure_ascii=False))
+        yield '\n'.join(lines) + '\n'
+    
+    logger.info(f"Пакетное предсказание для {len(campaigns)} кампаний на {days_ahead} дней...")
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@bp.route('/api/recommendations', methods=['POST'])
 def get_recommendations():
     """API endpoint для получения рекомендаций"""
-    global model_trained, predictor
-    if not model_trained:
-        logger.warning("Запрос на рекомендации: Модель не обучена.")
-        return jsonify({'error': 'Модель не обучена'}), 400
+    state = get_state()
     try:
         data = request.json
         if not data:
              logger.warning("Запрос на рекомендации: Тело запроса пустое или не в формате JSON.")
              return jsonify({'error': 'Тело запроса должно быть в формате JSON'}), 400
 
-        historical_data = data.get('historical_data', [])
+        active_predictor, shop_id = state.resolve_predictor(data)
+        if active_predictor is None:
+            logger.warning("Запрос на рекомендации: Модель не обучена.")
+            return jsonify({'error': 'Модель не обучена'}), 400
+
+        historical_data, model_input, dataset_id = state.resolve_historical_data(data)
         days_ahead = data.get('days_ahead', 7)
         if not historical_data:
             logger.warning("Запрос на рекомендации: Не предоставлены исторические данные.")
             return jsonify({'error': 'Не предоставлены исторические данные'}), 400
         logger.info("Генерация рекомендаций...")
-        # Получаем предсказания от модели (для согласованности)
-        # В вашем JS-коде generate_mock_recommendations использует только historical_data,
-        # но мы передаём и предсказания для полноты картины.
-        try:
-            predictions = predictor.predict_next_days(historical_data, days_ahead)
-        except Exception as pred_error:
-            logger.warning(f"Не удалось получить предсказания для рекомендаций: {pred_error}")
-            predictions = [] # Используем пустой список, если предсказания не нужны
-        # Генерируем симулированные рекомендации (как в оригинале)
-        # В будущем можно заменить на логику, использующую predictions
-        recommendations = generate_mock_recommendations(historical_data, days_ahead)
+        recommendations = state.cached_recommendations(active_predictor, historical_data, model_input, days_ahead)
         logger.info(f"Сгенерировано {len(recommendations)} рекомендаций.")
         return jsonify({
             'recommendations': recommendations,
-            'days_ahead': days_ahead
+            'days_ahead': days_ahead,
+            'dataset_id': dataset_id,
+            'shop_id': shop_id
         })
+    except DatasetNotFoundError as e:
+        logger.warning(f"Набор данных {e} не найден.")
+        return jsonify({'error': f'Набор данных {e} не найден'}), 404
+    except ValueError as e:
+        logger.warning(f"Запрос на рекомендации: некорректные параметры: {e}")
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Ошибка при генерации рекомендаций: {e}", exc_info=True)
         return jsonify({'error': f'Ошибка при генерации рекомендаций: {str(e)}'}), 500
 
-@app.route('/api/model-stats', methods=['GET'])
-def get_model_stats():
-    """
-    API endpoint для получения статистики модели.
-    Пытается получить статистику из метода predictor.get_stats().
-    Если метод не существует или вызывает ошибку, возвращаются симулированные данные.
-    """
-    global model_trained, last_trained, predictor
+@bp.route('/api/datasets/<dataset_id>', methods=['PUT'])
+def put_dataset(dataset_id):
+    """API endpoint для создания или полной замены набора исторических данных"""
+    state = get_state()
     try:
-        # Предполагаем, что в AdMetricsPredictor есть метод get_stats()
-        # Проверяем, существует ли атрибут и является ли он вызываемым
-        if model_trained and hasattr(predictor, 'get_stats') and callable(getattr(predictor, 'get_stats')):
-            stats = predictor.get_stats()
-            logger.info("Статистика модели получена через predictor.get_stats()")
-        else:
-            # Если метод predictor.get_stats() отсутствует,
-            # попробуем импортировать отдельную функцию get_model_stats из модуля ml_model
-            # (убедитесь, что такая функция определена в ml_model.py)
-            logger.info("Метод predictor.get_stats() не найден, пробуем импортировать функцию из модуля.")
-            try:
-                from ml_model import get_model_stats as get_stats_function
-                if callable(get_stats_function):
-                    stats = get_stats_function()
-                    logger.info("Статистика модели получена через функцию из модуля ml_model.")
-                else:
-                     raise AttributeError("Функция get_model_stats в ml_model.py не является вызываемой.")
-            except (ImportError, AttributeError) as import_error:
-                 logger.warning(f"Не удалось импортировать или вызвать функцию из ml_model: {import_error}")
-                 # Если и это не удалось, используем симуляцию по умолчанию
-                 raise # Передаем ошибку в основной блок except для симуляции
+        data = request.json
+        if not data or not data.get('historical_data'):
+            return jsonify({'error': 'Не предоставлены исторические данные'}), 400
+        info = state.dataset_store.put(dataset_id, data['historical_data'])
+        state.feature_cache.invalidate(dataset_id)
+        return jsonify(info)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении набора данных '{dataset_id}': {e}", exc_info=True)
+        return jsonify({'error': f'Ошибка при сохранении набора данных: {str(e)}'}), 500
 
+@bp.route('/api/datasets/<dataset_id>/append', methods=['POST'])
+def append_dataset(dataset_id):
+    """API endpoint для добавления новых дней в набор исторических данных"""
+    try:
+        data = request.json
+        if not data or not data.get('historical_data'):
+            return jsonify({'error': 'Не предоставлены новые данные'}), 400
+        info = get_state().dataset_store.append(dataset_id, data['historical_data'])
+        return jsonify(info)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        # В случае любой ошибки (метод не найден, ошибка при вызове, ошибка импорта) используем симуляцию по умолчанию
-        logger.warning(f"Не удалось получить статистику модели, используются симулированные данные: {e}")
-        stats = {
-            'model_trained': model_trained,
-            'last_trained': last_trained,
-            'accuracy': {
-                'ctr_mae': round(np.random.uniform(0.001, 0.01), 4),
-                'cr_mae': round(np.random.uniform(0.0005, 0.005), 4),
-                'cpc_mae': round(np.random.uniform(0.5, 3.0), 2),
-                'spend_mae': round(np.random.uniform(1000, 5000), 2)
-            },
-            'feature_importance': {
-                'day_of_week': round(np.random.uniform(0.15, 0.3), 2),
-                'ctr_moving_avg': round(np.random.uniform(0.15, 0.3), 2),
-                'seasonality': round(np.random.uniform(0.1, 0.25), 2),
-                'past_spend': round(np.random.uniform(0.15, 0.3), 2),
-                'conversion_rate': round(np.random.uniform(0.1, 0.2), 2)
-            }
-        }
+        logger.error(f"Ошибка при добавлении данных в набор '{dataset_id}': {e}", exc_info=True)
+        return jsonify({'error': f'Ошибка при добавлении данных: {str(e)}'}), 500
 
-    # Убедимся, что основные поля присутствуют
-    stats.setdefault('model_trained', model_trained)
-    stats.setdefault('last_trained', last_trained)
-    return jsonify(stats)
+@bp.route('/api/datasets/<dataset_id>', methods=['GET'])
+def get_dataset_info(dataset_id):
+    """API endpoint для получения метаданных набора исторических данных"""
+    try:
+        return jsonify(get_state().dataset_store.info(dataset_id))
+    except DatasetNotFoundError:
+        return jsonify({'error': f"Набор данных '{dataset_id}' не найден"}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-def generate_mock_recommendations(historical_data, days_ahead):
-    """Генерация симулированных рекомендаций"""
-    recommendations = []
-    # Анализируем последние данные
-    if historical_data:
-        try:
-            last_data = historical_data[-1]
-            # Используем последние 7 точек данных, если доступно
-            recent_data_slice = historical_data[-min(14, len(historical_data)):]
-            avg_ctr = float(np.mean([d.get('ctr', 0) for d in recent_data_slice]))
-            avg_spend = float(np.mean([d.get('spend', 0) for d in recent_data_slice]))
-            # Генерируем рекомендации на основе анализа
-            if last_data.get('ctr', 0) > avg_ctr * 1.1:
-                recommendations.append({
-                    'type': 'positive',
-                    'message': 'Высокий CTR наблюдается в последнее время. Рассмотрите увеличение бюджета для масштабирования успешных кампаний.',
-                    'priority': 'high'
-                })
-            if last_data.get('spend', 0) > avg_spend * 1.5:
-                recommendations.append({
-                    'type': 'warning',
-                    'message': 'Значительный рост расходов. Проверьте эффективность новых кампаний.',
-                    'priority': 'medium'
-                })
-            if last_data.get('cpc', 0) > 25: # Используем .get для безопасности
-                recommendations.append({
-                    'type': 'negative',
-                    'message': 'Высокая стоимость клика. Рассмотрите оптимизацию таргетинга или креативов.',
-                    'priority': 'high'
-                })
-        except (IndexError, KeyError, TypeError, ValueError) as e:
-             logger.warning(f"Ошибка при анализе historical_data для рекомендаций: {e}")
-
-    # Добавляем общие рекомендации
-    recommendations.extend([
-        {
-            'type': 'info',
-            'message': f'Прогноз на {days_ahead} дней готов. Следите за предсказанными трендами.',
-            'priority': 'low'
-        },
-        {
-            'type': 'info',
-            'message': 'Рекомендуется регулярное обучение модели для повышения точности предсказаний.',
-            'priority': 'medium'
-        }
-    ])
-    return recommendations
+@bp.route('/api/datasets/<dataset_id>', methods=['DELETE'])
+def delete_dataset(dataset_id):
+    """API endpoint для удаления набора исторических данных"""
+    state = get_state()
+    try:
+        state.dataset_store.delete(dataset_id)
+        state.feature_cache.invalidate(dataset_id)
+        return jsonify({'status': 'success', 'dataset_id': dataset_id})
+    except DatasetNotFoundError:
+        return jsonify({'error': f"Набор данных '{dataset_id}' не найден"}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-def create_training_charts(model_stats=None):
+@bp.route('/api/history', methods=['GET'])
+def get_history():
     """
-    Создает графики, иллюстрирующие процесс и результаты обучения модели.
-    Адаптировано из python/model_viz.py
+    API endpoint для получения исторических данных дашборда.
+    История читается из хранилища (журнал и сегменты), поэтому дописанные
+    дни видны сразу, а не только после сжатия и выгрузки historical_data.json.
+    Параметры запроса start и end (YYYY-MM-DD) ограничивают диапазон дат.
     """
-    charts = {}
+    try:
+        storage = open_history_storage(get_state().history_path)
+        records = storage.read_records(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': f'Некорректный диапазон дат: {e}'}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при чтении исторических данных: {e}", exc_info=True)
+        return jsonify({'error': f'Ошибка при чтении исторических данных: {str(e)}'}), 500
+    return jsonify(records)
 
-    # --- График 1: Важность признаков ---
-    if model_stats and 'feature_importance' in model_stats:
-        feature_names = list(model_stats['feature_importance'].keys())
-        importances = list(model_stats['feature_importance'].values())
-        
-        # Сортировка по убыванию важности
-        sorted_indices = np.argsort(importances)[::-1]
-        sorted_features = [feature_names[i] for i in sorted_indices]
-        sorted_importances = [importances[i] for i in sorted_indices]
-        
-        fig_importance = go.Figure(data=go.Bar(
-            x=sorted_importances,
-            y=sorted_features,
-            orientation='h',
-            marker=dict(
-                color=sorted_importances,
-                colorscale='Blues',
-                showscale=False
-            ),
-            text=[f"{imp:.2f}" for imp in sorted_importances],
-            textposition='auto',
-        ))
-        
-        fig_importance.update_layout(
-            title="Важность признаков в модели",
-            xaxis_title="Важность",
-            yaxis_title="Признаки",
-            template="plotly_white",
-            height=400,
-            margin=dict(l=150, r=20, t=40, b=40)
-        )
-        # Сохраняем данные и layout отдельно, как ожидает фронтенд
-        charts['feature_importance'] = {
-            'data': fig_importance.data,
-            'layout': fig_importance.layout
-        }
+@bp.route('/api/prediction-cache', methods=['GET'])
+def get_prediction_cache_stats():
+    """API endpoint для получения счетчиков кэша предсказаний"""
+    return jsonify(get_state().prediction_cache.stats())
+
+@bp.route('/api/prediction-service', methods=['GET'])
+def get_prediction_service_stats():
+    """API endpoint для получения счетчиков объединения и пакетирования предсказаний"""
+    return jsonify(get_state().prediction_service.stats())
+
+@bp.route('/api/models/registry', methods=['GET'])
+def get_model_registry_stats():
+    """API endpoint для получения счетчиков реестра моделей магазинов"""
+    return jsonify(get_state().model_registry.stats())
 
-    # --- График 2: Точность модели (MAE) ---
-    metrics = ['CTR', 'CR', 'CPC', 'Spend']
-    if model_stats and 'accuracy' in model_stats:
-        # Используем MAE для "точности"
-        mae_values = [
-            model_stats['accuracy'].get('ctr_mae', 0.005),
-            model_stats['accuracy'].get('cr_mae', 0.002),
-            model_stats['accuracy'].get('cpc_mae', 1.2),
-            model_stats['accuracy'].get('spend_mae', 2500)
-        ]
+@bp.route('/api/models/registry/<shop_id>', methods=['DELETE'])
+def evict_registry_model(shop_id):
+    """API endpoint для выгрузки модели магазина из памяти"""
+    try:
+        return jsonify({'shop_id': shop_id, 'evicted': get_state().model_registry.evict(shop_id)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/api/model-stats', methods=['GET'])
+def get_model_stats():
+    """
+    API endpoint для получения статистики модели (predictor.get_stats()).
+    Параметр запроса shop_id выбирает модель магазина из реестра.
+    Статистика вычисляется при обучении, поэтому запрос не обращается к моделям.
+    """
+    state = get_state()
+    try:
+        active_predictor, shop_id = state.resolve_predictor(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if active_predictor is None:
+        if shop_id:
+            return jsonify({'error': f"Модель магазина '{shop_id}' не найдена"}), 404
+        return jsonify({'model_trained': False, 'last_trained': state.last_trained})
+    try:
+        stats = active_predictor.get_stats()
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики модели: {e}", exc_info=True)
+        return jsonify({'error': f'Ошибка при получении статистики модели: {str(e)}'}), 500
+    if shop_id:
+        stats['shop_id'] = shop_id
     else:
-        # Симуляция данных
-        mae_values = [0.005, 0.002, 1.2, 2500]
-        
-    fig_mae = go.Figure(data=go.Bar(
-        x=mae_values,
-        y=metrics,
-        orientation='h',
-        marker_color=['#2563eb', '#10b981', '#8b5cf6', '#dc2626'],
-        text=[f"{v:.4f}" if i < 2 else f"{v:,.0f}" for i, v in enumerate(mae_values)],
-        textposition='auto',
-    ))
-    
-    fig_mae.update_layout(
-        title="Средняя абсолютная ошибка (MAE) предсказаний",
-        xaxis_title="MAE",
-        yaxis_title="Метрики",
-        template="plotly_white",
-        height=300,
-        margin=dict(l=100, r=20, t=40, b=40)
-    )
-    charts['prediction_mae'] = {
-        'data': fig_mae.data,
-        'layout': fig_mae.layout
-    }
+        stats['last_trained'] = state.last_trained
+    return jsonify(stats)
 
-    # --- График 3: История обучения (Loss) ---
-    # Симуляция убывающего loss
-    epochs = list(range(1, 51)) # 50 эпох для примера
-    # Более реалистичная симуляция loss
-    initial_loss = 5.0
-    decay_rate = 0.05
-    noise_level = 0.1
-    loss_values = []
-    current_loss = initial_loss
-    for i in range(len(epochs)):
-        decay = current_loss * decay_rate
-        noise = np.random.normal(0, noise_level)
-        current_loss = max(0.01, current_loss - decay + noise)
-        loss_values.append(current_loss)
+@bp.route('/api/recommendations/portfolio', methods=['POST'])
+def get_portfolio_recommendations():
+    """
+    API endpoint для рекомендаций по всем кампаниям портфеля.
+    Кампании обрабатываются пакетами по chunk_size: признаки пакета строятся
+    за один проход, прогноз выполняется одним вызовом каждой модели, правила
+    проверяются векторно сразу для всех кампаний пакета. Кампании, для которых
+    не удалось построить прогноз, перечисляются в failed_campaigns
+    и не мешают остальным.
+    """
+    state = get_state()
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'Тело запроса должно быть в формате JSON'}), 400
+        active_predictor, shop_id = state.resolve_predictor(data)
+        if active_predictor is None:
+            return jsonify({'error': 'Модель не обучена'}), 400
+        campaigns = state.resolve_portfolio(data)
+        if not campaigns:
+            return jsonify({'error': 'Не предоставлены кампании (campaigns или dataset_ids)'}), 400
+        if len(campaigns) > state.portfolio_max_campaigns:
+            return jsonify({'error': f'Превышено максимальное число кампаний: {state.portfolio_max_campaigns}'}), 400
+        days_ahead = int(data.get('days_ahead', 7))
+        chunk_size = max(int(data.get('chunk_size', PORTFOLIO_CHUNK_SIZE)), 1)
         
-    fig_loss = go.Figure()
-    fig_loss.add_trace(go.Scatter(
-        x=epochs,
-        y=loss_values,
-        mode='lines+markers',
-        name='Training Loss',
-        line=dict(color='#dc2626', width=2),
-        marker=dict(size=4)
-    ))
-    
-    fig_loss.update_layout(
-        title="История обучения (Loss)",
-        xaxis_title="Эпоха",
-        yaxis_title="Значение Loss",
-        template="plotly_white",
-        height=300,
-        margin=dict(l=60, r=30, t=40, b=60)
-    )
-    charts['training_loss'] = {
-        'data': fig_loss.data,
-        'layout': fig_loss.layout
-    }
-
-    return charts
+        start = time.perf_counter()
+        skipped = [campaign_id for campaign_id, model_input in campaigns.items() if not len(model_input)]
+        histories = {campaign_id: model_input for campaign_id, model_input in campaigns.items() if len(model_input)}
+        if not histories:
+            return jsonify({'error': 'Ни для одной кампании не предоставлены исторические данные'}), 400
+        
+        recommendations = {}
+        failed = []
+        for forecast, error in active_predictor.iter_portfolio_forecasts(histories, days_ahead, chunk_size):
+            if forecast is None:
+                campaign_id, message = error
+                failed.append({'campaign_id': campaign_id, 'error': message})
+                continue
+            features, _, _, values = forecast
+            campaign_ids, signals = history_signals(features, key=PORTFOLIO_KEY)
+            signals = forecast_signals(signals, values, days_ahead)
+            recommendations.update(state.recommendation_engine.recommend_many(campaign_ids, signals))
+        logger.info(f"Рекомендации для {len(recommendations)} кампаний сгенерированы за "
+                    f"{time.perf_counter() - start:.2f} с (ошибок: {len(failed)}).")
+        return jsonify({
+            'recommendations': recommendations,
+            'summary': state.recommendation_engine.summarize(recommendations),
+            'campaigns': len(recommendations),
+            'skipped_campaigns': skipped,
+            'failed_campaigns': failed,
+            'days_ahead': days_ahead,
+            'shop_id': shop_id
+        })
+    except DatasetNotFoundError as e:
+        return jsonify({'error': f'Набор данных {e} не найден'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при генерации рекомендаций портфеля: {e}", exc_info=True)
+        return jsonify({'error': f'Ошибка при генерации рекомендаций портфеля: {str(e)}'}), 500
 
-@app.route('/api/training-charts', methods=['GET'])
+@bp.route('/api/training-charts', methods=['GET'])
 def get_training_charts():
     """
     API endpoint для получения данных графиков обучения и точности.
+    Графики строятся один раз для каждой версии модели; ответ поддерживает
+    условные запросы (If-None-Match / If-Modified-Since) и возвращает 304,
+    если графики не изменились.
     """
-    global model_trained, predictor
-    
+    state = get_state()
+    active_predictor = state.active_predictor()
+    if active_predictor is None:
+        return jsonify({'error': 'Модель еще не обучена'}), 404
     try:
-        logger.info("Генерация данных для графиков обучения...")
-        
-        # Получаем статистику модели для использования в графиках
-        model_stats = None
-        try:
-            # Пытаемся получить реальную статистику
-            if model_trained:
-                 # Предполагаем, что predictor имеет метод get_stats или аналогичный
-                 if hasattr(predictor, 'get_stats') and callable(getattr(predictor, 'get_stats')):
-                     model_stats = predictor.get_stats()
-                 else:
-                     # Если метода нет, используем эндпоинт /api/model-stats
-                     # Но для этого нужно имитировать вызов самого себя или иметь кэш
-                     # Проще использовать симуляцию или вызвать внутреннюю функцию
-                     # Пока используем симуляцию
-                     pass
-        except Exception as e:
-            logger.warning(f"Не удалось получить статистику модели для графиков: {e}")
-        
-        # Если статистика не получена, используем симуляцию
-        # В реальном приложении здесь должна быть логика получения реальных данных
-        if not model_stats:
-            model_stats = {
-                'model_trained': model_trained,
-                'last_trained': last_trained or 'Никогда',
-                'accuracy': {
-                    'ctr_mae': round(np.random.uniform(0.001, 0.01), 4),
-                    'cr_mae': round(np.random.uniform(0.0005, 0.005), 4),
-                    'cpc_mae': round(np.random.uniform(0.5, 3.0), 2),
-                    'spend_mae': round(np.random.uniform(1000, 5000), 2)
-                },
-                'feature_importance': {
-                    'day_of_week': round(np.random.uniform(0.15, 0.3), 2),
-                    'ctr_moving_avg': round(np.random.uniform(0.15, 0.3), 2),
-                    'seasonality': round(np.random.uniform(0.1, 0.25), 2),
-                    'past_spend': round(np.random.uniform(0.15, 0.3), 2),
-                    'conversion_rate': round(np.random.uniform(0.1, 0.2), 2)
-                }
-            }
-        
-        # Создаем графики
-        charts_data = create_training_charts(model_stats=model_stats)
-        
-        logger.info("Данные для графиков обучения успешно сгенерированы.")
-        return jsonify(charts_data)
-        
+        payload = state.training_charts.get(active_predictor.model_version, active_predictor.training_stats)
     except Exception as e:
         logger.error(f"Ошибка при генерации данных для графиков: {e}", exc_info=True)
         return jsonify({'error': f'Ошибка при генерации данных для графиков: {str(e)}'}), 500
+    response = current_app.response_class(payload.body, mimetype='application/json')
+    response.set_etag(payload.etag)
+    response.last_modified = payload.last_modified
+    # Браузер хранит ответ, но перепроверяет его при каждом обращении
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
-    # Попробуем загрузить уже обученную модель при запуске
-    if os.path.exists(model_save_path):
-        try:
-            predictor.load_model(model_save_path)
-            model_trained = True
-            # last_trained можно установить в текущее время или сохранить/загрузить вместе с моделью
-            last_trained = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            logger.info(f"Загружена ранее обученная модель из {model_save_path}.")
-        except Exception as e:
-            logger.warning(f"Не удалось загрузить модель из {model_save_path}: {e}")
-    else:
-         logger.info(f"Файл модели {model_save_path} не найден. Будет использована новая модель.")
+    # Сервер разработки; для продакшена - gunicorn -c api/gunicorn.conf.py
+    app = create_app()
 
     host = 'localhost'  # Слушаем на всех интерфейсах
     port = 5000
@@ -0,0 +1,18 @@
+# wsgi.py
+"""
+Точка входа WSGI для продакшен-запуска ML API.
+
+Запуск:
+    gunicorn -c api/gunicorn.conf.py
+
+Модель загружается при импорте модуля; с preload_app (см. gunicorn.conf.py)
+это происходит один раз в главном процессе до запуска воркеров.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ml_api import create_app
+
+app = create_app()
@@ -291,7 +291,10 @@ document.addEventListener('DOMContentLoaded', function () {
 
 async function loadHistoricalData() {
     try {
-        const response = await fetch('./api/data/historical_data.json');
+        // История из хранилища API включает дописанные дни; статический файл
+        // обновляется только при сжатии хранилища и нужен, если API недоступен
+        const response = await fetch('http://localhost:5000/api/history')
+            .catch(() => fetch('./api/data/historical_data.json'));
         if (!response.ok) {
             throw new Error(`Ошибка при загрузке исторических данных: ${response.status}`);
         }
@@ -66,17 +66,15 @@ class MLCharts {
 
     /**
      * Получение предсказаний от API.
-     * @param {Array} historicalData - Массив исторических данных.
+     * @param {Array} historicalData - Массив исторических данных (передается, только если нет набора данных).
      * @param {number} daysAhead - Количество дней для предсказания.
+     * @param {string|null} datasetId - Идентификатор набора данных на сервере.
      * @returns {Promise<Object|null>} Данные предсказаний или null при ошибке.
      */
-    async fetchPredictions(historicalData, daysAhead = 7) {
+    async fetchPredictions(historicalData, daysAhead = 7, datasetId = null) {
         try {
             console.log(`Запрос предсказаний на ${daysAhead} дней...`);
-            const requestData = {
-                historical_data: historicalData,
-                days_ahead: daysAhead
-            };
+            const requestData = buildHistoryRequest(historicalData, datasetId, { days_ahead: daysAhead });
 
             const response = await fetch(`${this.apiUrl}/api/predict`, {
                 method: 'POST',
@@ -107,8 +105,10 @@ class MLCharts {
      */
     async loadHistoricalData() {
         try {
-            console.log("Загрузка исторических данных из ./api/data/historical_data.json...");
-            const response = await fetch('./api/data/historical_data.json');
+            console.log(`Загрузка исторических данных из ${this.apiUrl}/api/history...`);
+            // Статический файл обновляется только при сжатии хранилища и нужен, если API недоступен
+            const response = await fetch(`${this.apiUrl}/api/history`)
+                .catch(() => fetch('./api/data/historical_data.json'));
             if (!response.ok) {
                 throw new Error(`Ошибка загрузки исторических данных: ${response.status}`);
             }
@@ -544,8 +544,9 @@ class MLCharts {
                 return;
             }
 
-            // 2. Получаем предсказания от API
-            const predictionsData = await this.fetchPredictions(historicalData, 14); // Предсказания на 14 дней
+            // 2. Синхронизируем историю с набором данных на сервере и получаем предсказания от API
+            const datasetId = await syncDatasetViaAPI(this.apiUrl, historicalData);
+            const predictionsData = await this.fetchPredictions(historicalData, 14, datasetId); // Предсказания на 14 дней
             if (!predictionsData) {
                 console.warn("Невозможно создать графики предсказаний: нет данных от API.");
                 // Можно показать сообщение в UI
@@ -0,0 +1,75 @@
+// js/ml_datasets.js
+
+/**
+ * Идентификатор набора исторических данных дашборда на стороне ML API.
+ * История загружается на сервер один раз, дальше дописываются только новые дни,
+ * а запросы на обучение, предсказания и рекомендации ссылаются на набор по ID.
+ */
+const ML_DASHBOARD_DATASET_ID = 'dashboard';
+
+/**
+ * Синхронизировать историю с набором данных на сервере
+ * @param {string} apiUrl - Базовый адрес ML API
+ * @param {Array} historicalData - Массив исторических данных, отсортированный по дате
+ * @param {string} datasetId - Идентификатор набора данных
+ * @returns {Promise<string|null>} Идентификатор набора или null, если синхронизировать не удалось
+ */
+async function syncDatasetViaAPI(apiUrl, historicalData, datasetId = ML_DASHBOARD_DATASET_ID) {
+    const url = `${apiUrl}/api/datasets/${encodeURIComponent(datasetId)}`;
+    const send = async (method, target, rows) => {
+        const response = await fetch(target, {
+            method: method,
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ historical_data: rows })
+        });
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            throw new Error(errorData.error || `Ошибка API (${response.status})`);
+        }
+        return response.json();
+    };
+
+    try {
+        const response = await fetch(url);
+        if (response.status === 404) {
+            console.log(`Загрузка истории в набор данных '${datasetId}' (${historicalData.length} записей)...`);
+            await send('PUT', url, historicalData);
+            return datasetId;
+        }
+        if (!response.ok) {
+            throw new Error(`Ошибка API (${response.status})`);
+        }
+
+        const info = await response.json();
+        const lastDate = info.last_date;
+        const newRows = lastDate ? historicalData.filter(row => String(row.date) > lastDate) : historicalData;
+        if (historicalData.length - newRows.length !== info.rows) {
+            // Старые дни на сервере не совпадают с локальной историей: заменяем набор целиком
+            console.log(`История изменилась, набор данных '${datasetId}' перезаписывается...`);
+            await send('PUT', url, historicalData);
+        } else if (newRows.length > 0) {
+            console.log(`Добавление ${newRows.length} новых дней в набор данных '${datasetId}'...`);
+            await send('POST', `${url}/append`, newRows);
+        }
+        return datasetId;
+    } catch (error) {
+        console.warn(`Не удалось синхронизировать набор данных '${datasetId}', история будет передаваться в запросах:`, error);
+        return null;
+    }
+}
+
+/**
+ * Тело запроса к ML API: ссылка на набор данных или, если набора нет, вся история
+ * @param {Array} historicalData - Массив исторических данных
+ * @param {string|null} datasetId - Идентификатор синхронизированного набора данных
+ * @param {Object} extra - Дополнительные поля запроса
+ * @returns {Object} Тело запроса
+ */
+function buildHistoryRequest(historicalData, datasetId, extra = {}) {
+    if (datasetId) {
+        return { dataset_id: datasetId, ...extra };
+    }
+    return { historical_data: historicalData, ...extra };
+}
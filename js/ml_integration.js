@@ -422,13 +422,15 @@ async function createFeatureImportanceChart(featureImportance) {
 }
 
 /**
- * Загрузить исторические данные из файла
+ * Загрузить исторические данные из API (при недоступности API - из файла)
  * @returns {Promise<Array|null>} Массив данных или null при ошибке
  */
 async function loadHistoricalData() {
     try {
-        console.log("Загрузка исторических данных из файла ./api/data/historical_data.json...");
-        const response = await fetch('./api/data/historical_data.json');
+        console.log("Загрузка исторических данных из http://localhost:5000/api/history...");
+        // Статический файл обновляется только при сжатии хранилища и нужен, если API недоступен
+        const response = await fetch('http://localhost:5000/api/history')
+            .catch(() => fetch('./api/data/historical_data.json'));
 
         if (!response.ok) {
             throw new Error(`Ошибка при загрузке исторических данных: ${response.status} ${response.statusText}`);
@@ -439,7 +441,7 @@ async function loadHistoricalData() {
         return data;
     } catch (error) {
         console.error("Не удалось загрузить исторические данные:", error);
-        showError(`Ошибка: Не удалось загрузить исторические данные из ./api/data/historical_data.json. ${error.message}`);
+        showError(`Ошибка: Не удалось загрузить исторические данные. ${error.message}`);
         return null;
     }
 }
@@ -470,10 +472,11 @@ async function getModelStatsFromAPI() {
 
 /**
  * Обучить модель через API
- * @param {Array} historicalData - Массив исторических данных
+ * @param {Array} historicalData - Массив исторических данных (передается, только если нет набора данных)
+ * @param {string|null} datasetId - Идентификатор набора данных на сервере
  * @returns {Promise<Object|null>} Результат обучения или null при ошибке
  */
-async function trainModelViaAPI(historicalData) {
+async function trainModelViaAPI(historicalData, datasetId = null) {
     try {
         console.log("Отправка данных на обучение модели через API...");
         showLoadingIndicator();
@@ -485,7 +488,7 @@ async function trainModelViaAPI(historicalData) {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ historical_data: historicalData })
+            body: JSON.stringify(buildHistoryRequest(historicalData, datasetId))
         });
 
         updateProgressBar(50); // Промежуточный прогресс
@@ -515,11 +518,12 @@ async function trainModelViaAPI(historicalData) {
 
 /**
  * Получить предсказания от API
- * @param {Array} historicalData - Массив исторических данных
+ * @param {Array} historicalData - Массив исторических данных (передается, только если нет набора данных)
  * @param {number} daysAhead - Количество дней для предсказания
+ * @param {string|null} datasetId - Идентификатор набора данных на сервере
  * @returns {Promise<Object|null>} Объект с предсказаниями или null при ошибке
  */
-async function getPredictionsFromAPI(historicalData, daysAhead = 7) {
+async function getPredictionsFromAPI(historicalData, daysAhead = 7, datasetId = null) {
     try {
         console.log(`Запрос предсказаний на ${daysAhead} дней...`);
         const response = await fetch('http://localhost:5000/api/predict', {
@@ -527,10 +531,7 @@ async function getPredictionsFromAPI(historicalData, daysAhead = 7) {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                historical_data: historicalData,
-                days_ahead: daysAhead
-            })
+            body: JSON.stringify(buildHistoryRequest(historicalData, datasetId, { days_ahead: daysAhead }))
         });
 
         if (!response.ok) {
@@ -550,11 +551,12 @@ async function getPredictionsFromAPI(historicalData, daysAhead = 7) {
 
 /**
  * Получить рекомендации от API
- * @param {Array} historicalData - Массив исторических данных
+ * @param {Array} historicalData - Массив исторических данных (передается, только если нет набора данных)
  * @param {number} daysAhead - Количество дней для анализа
+ * @param {string|null} datasetId - Идентификатор набора данных на сервере
  * @returns {Promise<Object|null>} Объект с рекомендациями или null при ошибке
  */
-async function getRecommendationsFromAPI(historicalData, daysAhead = 7) {
+async function getRecommendationsFromAPI(historicalData, daysAhead = 7, datasetId = null) {
     try {
         console.log(`Запрос рекомендаций на ${daysAhead} дней...`);
         const response = await fetch('http://localhost:5000/api/recommendations', {
@@ -562,10 +564,7 @@ async function getRecommendationsFromAPI(historicalData, daysAhead = 7) {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                historical_data: historicalData,
-                days_ahead: daysAhead
-            })
+            body: JSON.stringify(buildHistoryRequest(historicalData, datasetId, { days_ahead: daysAhead }))
         });
 
         if (!response.ok) {
@@ -596,33 +595,37 @@ async function handleTrainModelButtonClick() {
             throw new Error("Не удалось загрузить корректные исторические данные.");
         }
 
-        // 2. Обучение модели
-        const trainResult = await trainModelViaAPI(historicalData);
+        // 2. Синхронизация истории с набором данных на сервере: дальше запросы
+        // передают только dataset_id (при ошибке синхронизации - всю историю)
+        const datasetId = await syncDatasetViaAPI('http://localhost:5000', historicalData);
+
+        // 3. Обучение модели
+        const trainResult = await trainModelViaAPI(historicalData, datasetId);
         if (!trainResult) {
             // Ошибка уже показана в trainModelViaAPI
             return;
         }
 
-        // 3. Обновление статистики модели в UI
+        // 4. Обновление статистики модели в UI
         const updatedStats = await getModelStatsFromAPI();
         if (updatedStats) {
             updateModelStatsUI(updatedStats);
         }
 
-        // 4. Получение и отображение предсказаний
-        const predictionData = await getPredictionsFromAPI(historicalData, 14);
+        // 5. Получение и отображение предсказаний
+        const predictionData = await getPredictionsFromAPI(historicalData, 14, datasetId);
         if (predictionData && predictionData.predictions) {
             await createCTRPredictionChart(historicalData, predictionData.predictions);
             await createSpendPredictionChart(historicalData, predictionData.predictions);
         }
 
-        // 5. Получение и отображение важности признаков (если доступна в статистике)
+        // 6. Получение и отображение важности признаков (если доступна в статистике)
         if (updatedStats && updatedStats.feature_importance) {
             await createFeatureImportanceChart(updatedStats.feature_importance);
         }
 
-        // 6. Получение и отображение рекомендаций
-        const recommendationData = await getRecommendationsFromAPI(historicalData, 14);
+        // 7. Получение и отображение рекомендаций
+        const recommendationData = await getRecommendationsFromAPI(historicalData, 14, datasetId);
         if (recommendationData && recommendationData.recommendations) {
             displayRecommendations(recommendationData.recommendations);
         }
@@ -0,0 +1,244 @@
+# backtest.py
+"""
+Скользящая проверка (walk-forward backtesting) AdMetricsPredictor.
+
+История делится на последовательные фолды: модель обучается на окне до
+точки отсечения и предсказывает следующие horizon дней, которые сравниваются
+с фактическими значениями. Окно обучения либо растет с начала истории
+('expanding'), либо имеет фиксированную длину ('sliding').
+
+Признаки строятся один раз для всей истории: скользящие средние и процентные
+изменения в строке зависят только от предыдущих строк, поэтому срез общего
+DataFrame совпадает с признаками, построенными по истории до отсечения.
+Фолды независимы и выполняются параллельно в пуле процессов; DataFrame
+передается каждому процессу один раз при его запуске.
+
+Запуск:
+    python python/backtest.py --days 730 --folds 8 --horizon 14 --window sliding --train-size 365
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ml_model import AdMetricsPredictor, MA_WINDOWS, TARGET_COLUMNS, generate_historical_data
+
+# Типы окна обучения
+BACKTEST_WINDOWS = ('expanding', 'sliding')
+# Минимальная длина окна обучения по умолчанию
+DEFAULT_MIN_TRAIN_SIZE = 4 * max(MA_WINDOWS)
+
+# DataFrame признаков в процессе-исполнителе (см. _init_worker)
+_worker_frame = None
+
+
+def walk_forward_splits(n_rows, n_folds=5, horizon=7, window='expanding', train_size=None,
+                        step=None, min_train_size=DEFAULT_MIN_TRAIN_SIZE):
+    """
+    Границы фолдов скользящей проверки.
+
+    Последний фолд заканчивается на последней строке истории, предыдущие
+    сдвинуты назад на step строк. Фолды с окном обучения короче
+    min_train_size отбрасываются.
+
+    Args:
+        n_rows (int): Длина истории.
+        n_folds (int): Максимальное число фолдов.
+        horizon (int): Горизонт предсказания (длина тестового участка).
+        window (str): 'expanding' - обучение с начала истории,
+            'sliding' - на последних train_size строках.
+        train_size (int, optional): Длина окна для 'sliding'.
+        step (int, optional): Сдвиг между фолдами (по умолчанию - horizon).
+        min_train_size (int): Минимальная длина окна обучения.
+
+    Returns:
+        list: Кортежи (train_start, train_end, test_end) - границы срезов строк.
+    """
+    if window not in BACKTEST_WINDOWS:
+        raise ValueError(f"Неизвестный тип окна '{window}'. Доступны: {BACKTEST_WINDOWS}.")
+    if window == 'sliding' and not train_size:
+        raise ValueError("Для окна 'sliding' необходимо указать train_size.")
+    step = step or horizon
+    splits = []
+    for fold in range(n_folds):
+        train_end = n_rows - horizon - (n_folds - 1 - fold) * step
+        train_start = max(0, train_end - train_size) if window == 'sliding' else 0
+        if train_end - train_start < min_train_size:
+            continue
+        splits.append((train_start, train_end, min(train_end + horizon, n_rows)))
+    return splits
+
+
+def _init_worker(frame):
+    global _worker_frame
+    _worker_frame = frame
+
+
+def _run_fold(fold, split, predictor_options, horizon, recursive):
+    """
+    Обучение и оценка одного фолда на срезах общего DataFrame признаков.
+
+    Returns:
+        dict: Описание фолда и ошибки по шагам горизонта для каждой метрики.
+    """
+    train_start, train_end, test_end = split
+    train_frame = _worker_frame.iloc[train_start:train_end]
+    actual = _worker_frame.iloc[train_end:test_end]
+
+    predictor = AdMetricsPredictor(**predictor_options)
+    start = time.perf_counter()
+    predictor.train(train_frame)
+    fit_time = time.perf_counter() - start
+    predictions = predictor.predict_next_days(train_frame, days_ahead=horizon, recursive=recursive)
+
+    # Сопоставляем предсказания с фактом по дате (в истории могут быть пропуски дней)
+    actual_by_date = {date.strftime('%Y-%m-%d'): position
+                      for position, date in enumerate(pd.to_datetime(actual['date']))}
+    errors = {target: [None] * horizon for target in TARGET_COLUMNS}
+    for step, prediction in enumerate(predictions):
+        position = actual_by_date.get(prediction['date'])
+        if position is None:
+            continue
+        for target in TARGET_COLUMNS:
+            errors[target][step] = float(prediction[target] - actual[target].iloc[position])
+    return {
+        'fold': fold,
+        'train_rows': train_end - train_start,
+        'train_start': str(pd.Timestamp(train_frame['date'].iloc[0]).date()),
+        'train_end': str(pd.Timestamp(train_frame['date'].iloc[-1]).date()),
+        'fit_time_s': round(fit_time, 4),
+        'errors': errors
+    }
+
+
+def _horizon_curves(folds, horizon):
+    """MAE и RMSE по шагам горизонта и в среднем по всем шагам для каждой метрики."""
+    curves = {}
+    for target in TARGET_COLUMNS:
+        errors = np.array([[np.nan if value is None else value for value in fold['errors'][target]]
+                           for fold in folds], dtype=float).reshape(len(folds), horizon)
+        with np.errstate(invalid='ignore'):
+            mae = np.nanmean(np.abs(errors), axis=0) if len(folds) else np.full(horizon, np.nan)
+            rmse = np.sqrt(np.nanmean(errors ** 2, axis=0)) if len(folds) else np.full(horizon, np.nan)
+        curves[target] = {
+            'mae': [None if np.isnan(value) else float(value) for value in mae],
+            'rmse': [None if np.isnan(value) else float(value) for value in rmse],
+            'mean_mae': float(np.nanmean(np.abs(errors))) if np.isfinite(errors).any() else None
+        }
+    return curves
+
+
+def run_backtest(historical_data, n_folds=5, horizon=7, window='expanding', train_size=None, step=None,
+                 min_train_size=DEFAULT_MIN_TRAIN_SIZE, recursive=False, n_jobs=None,
+                 predictor_options=None):
+    """
+    Скользящая проверка модели на истории.
+
+    Args:
+        historical_data (list | dict | pd.DataFrame): История в любом формате,
+            который принимает AdMetricsPredictor.train.
+        n_folds (int): Максимальное число фолдов.
+        horizon (int): Горизонт предсказания в днях.
+        window (str): Тип окна обучения ('expanding' или 'sliding').
+        train_size (int, optional): Длина окна для 'sliding'.
+        step (int, optional): Сдвиг между фолдами (по умолчанию - horizon).
+        min_train_size (int): Минимальная длина окна обучения.
+        recursive (bool): Рекурсивный режим predict_next_days.
+        n_jobs (int, optional): Число процессов (по умолчанию - число ядер, не больше числа фолдов).
+        predictor_options (dict, optional): Параметры AdMetricsPredictor
+            (engine, backend, backend_params). Внутри фолда обучение последовательное,
+            проверочная выборка - последние дни окна.
+
+    Returns:
+        dict: Параметры, результаты фолдов и кривые ошибок по шагам горизонта.
+    """
+    start = time.perf_counter()
+    frame = AdMetricsPredictor().build_features(historical_data)
+    splits = walk_forward_splits(len(frame), n_folds, horizon, window, train_size, step, min_train_size)
+    if not splits:
+        raise ValueError("История слишком коротка для заданных фолдов.")
+    options = dict(predictor_options or {}, execution='sequential', tree_jobs=1)
+    options.setdefault('validation', 'time')
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(splits))
+
+    if n_jobs == 1:
+        _init_worker(frame)
+        folds = [_run_fold(fold, split, options, horizon, recursive) for fold, split in enumerate(splits)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(frame,)) as executor:
+            futures = [executor.submit(_run_fold, fold, split, options, horizon, recursive)
+                       for fold, split in enumerate(splits)]
+            folds = [future.result() for future in futures]
+
+    return {
+        'config': {
+            'rows': len(frame),
+            'folds': len(splits),
+            'horizon': horizon,
+            'window': window,
+            'train_size': train_size,
+            'step': step or horizon,
+            'recursive': recursive,
+            'n_jobs': n_jobs,
+            'predictor_options': options
+        },
+        'folds': folds,
+        'horizon_errors': _horizon_curves(folds, horizon),
+        'wall_time_s': round(time.perf_counter() - start, 4)
+    }
+
+
+def _load_history(path):
+    """История из historical_data.json или директории HistoryStorage."""
+    if os.path.isdir(path):
+        from history_storage import HistoryStorage
+        return HistoryStorage(path).load_columns()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скользящая проверка AdMetricsPredictor.")
+    parser.add_argument('--input', help="historical_data.json или директория HistoryStorage.")
+    parser.add_argument('--days', type=int, default=730, help="Длина синтетической истории, если --input не задан.")
+    parser.add_argument('--folds', type=int, default=5, help="Число фолдов.")
+    parser.add_argument('--horizon', type=int, default=7, help="Горизонт предсказания в днях.")
+    parser.add_argument('--window', choices=BACKTEST_WINDOWS, default='expanding', help="Тип окна обучения.")
+    parser.add_argument('--train-size', type=int, help="Длина окна для --window sliding.")
+    parser.add_argument('--step', type=int, help="Сдвиг между фолдами.")
+    parser.add_argument('--recursive', action='store_true', help="Рекурсивный режим предсказания.")
+    parser.add_argument('--jobs', type=int, help="Число процессов.")
+    parser.add_argument('--engine', default='separate', help="Движок модели.")
+    parser.add_argument('--backend', default='random_forest', help="Бэкенд модели.")
+    parser.add_argument('--json', help="Путь для сохранения результатов в JSON.")
+    args = parser.parse_args()
+
+    history = _load_history(args.input) if args.input else generate_historical_data(args.days, save_to_file=False)
+    result = run_backtest(history, args.folds, args.horizon, args.window, args.train_size, args.step,
+                          recursive=args.recursive, n_jobs=args.jobs,
+                          predictor_options={'engine': args.engine, 'backend': args.backend})
+
+    config = result['config']
+    print(f"\n=== Скользящая проверка: {config['folds']} фолдов, окно {config['window']}, "
+          f"горизонт {config['horizon']}, {config['n_jobs']} процессов, {result['wall_time_s']:.1f} с ===")
+    print(f"{'Шаг':>4}  " + '  '.join(f"{target + ' MAE':>14}" for target in TARGET_COLUMNS))
+    for step in range(config['horizon']):
+        values = [result['horizon_errors'][target]['mae'][step] for target in TARGET_COLUMNS]
+        print(f"{step + 1:>4}  " + '  '.join(f"{value:>14.6g}" if value is not None else f"{'-':>14}"
+                                            for value in values))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+
+if __name__ == '__main__':
+    main()
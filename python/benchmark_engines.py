@@ -0,0 +1,91 @@
+# benchmark_engines.py
+"""
+Сравнение движков AdMetricsPredictor: четыре отдельные модели ('separate')
+против одной модели на все метрики ('multioutput'), для каждого бэкенда
+из ESTIMATOR_BACKENDS.
+
+Измеряются время обучения, задержка predict_next_days, размер сохраненной
+модели и MAE по каждой метрике.
+
+Запуск:
+    python python/benchmark_engines.py --days 1000 --horizon 14 --backends random_forest hist_gradient_boosting
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ml_model import (AdMetricsPredictor, ENGINES, ESTIMATOR_BACKENDS, TARGET_COLUMNS,
+                      generate_historical_data, get_artifact_size)
+
+
+def benchmark_engine(engine, backend, data, horizon, repeats):
+    """
+    Замер одного сочетания движка и бэкенда.
+
+    Returns:
+        dict: Время обучения, задержка предсказания, размер модели и MAE.
+    """
+    predictor = AdMetricsPredictor(engine=engine, backend=backend)
+    start = time.perf_counter()
+    predictor.train(data)
+    fit_time = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictor.predict_next_days(data, days_ahead=horizon)
+        latencies.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, 'model')
+        predictor.save_model(model_path)
+        model_size = get_artifact_size(model_path)
+
+    return {
+        'engine': engine,
+        'backend': backend,
+        'fit_time_s': round(fit_time, 4),
+        'predict_latency_ms': round(float(np.median(latencies)) * 1000, 3),
+        'model_size_mb': round(model_size / 2 ** 20, 3),
+        'mae': {target: float(predictor.training_stats['accuracy'][target]) for target in TARGET_COLUMNS}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение движков AdMetricsPredictor.")
+    parser.add_argument('--days', type=int, default=730, help="Длина синтетической истории в днях.")
+    parser.add_argument('--horizon', type=int, default=14, help="Горизонт predict_next_days.")
+    parser.add_argument('--repeats', type=int, default=5, help="Повторы замера предсказания.")
+    parser.add_argument('--backends', nargs='+', default=['random_forest'],
+                        choices=sorted(ESTIMATOR_BACKENDS), help="Бэкенды моделей для сравнения.")
+    parser.add_argument('--json', help="Путь для сохранения результатов в JSON.")
+    args = parser.parse_args()
+
+    data = generate_historical_data(days=args.days, save_to_file=False)
+    results = [
+        benchmark_engine(engine, backend, data, args.horizon, args.repeats)
+        for backend in args.backends for engine in ENGINES
+    ]
+
+    print(f"\n=== Сравнение движков ({args.days} дней, горизонт {args.horizon}) ===")
+    print(f"{'Бэкенд':<24} {'Движок':<12} {'Обучение, с':>12} {'Предсказание, мс':>17} {'Размер, МБ':>11}  MAE")
+    for result in results:
+        mae = ', '.join(f"{target}={value:.4g}" for target, value in result['mae'].items())
+        print(f"{result['backend']:<24} {result['engine']:<12} {result['fit_time_s']:>12.3f} {result['predict_latency_ms']:>17.3f} "
+              f"{result['model_size_mb']:>11.3f}  {mae}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+
+if __name__ == '__main__':
+    main()
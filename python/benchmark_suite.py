@@ -0,0 +1,387 @@
+# benchmark_suite.py
+"""
+Набор бенчмарков ML-пайплайна с отслеживанием регрессий.
+
+Замеряются этапы AdMetricsPredictor (create_features, prepare_data_for_training,
+train, predict_next_days, save_model/load_model) и эндпоинты Flask API на
+синтетических историях разной длины - от 100 дней до миллионов строк.
+Каждый случай (этап x размер) выполняется в отдельном процессе, чтобы пиковый
+RSS относился только к нему. Результаты (время, пиковый RSS, пропускная
+способность) сохраняются в JSON и сравниваются с сохраненным базовым файлом.
+
+Запуск:
+    python python/benchmark_suite.py --sizes 100 1000 10000 --output bench.json
+    python python/benchmark_suite.py --baseline bench_baseline.json --fail-on-regression
+    python python/benchmark_suite.py --stages train predict_next_days --save-baseline bench_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+# Обучение на всей истории дорого; для этапов, которым нужна обученная модель,
+# она обучается на хвосте истории этой длины
+MODEL_TRAIN_ROWS = 1000
+# Начальная дата синтетической истории (миллион дней укладывается в диапазон pandas)
+HISTORY_START_DATE = '1900-01-01'
+# Допустимый рост времени и пикового RSS относительно базового файла
+DEFAULT_TIME_THRESHOLD = 0.2
+DEFAULT_RSS_THRESHOLD = 0.2
+# Изменения времени меньше этой величины (в секундах) считаются шумом
+DEFAULT_MIN_TIME_DELTA = 0.005
+
+
+def _records(size):
+    from history_storage import columns_to_records
+    return columns_to_records(_columns(size))
+
+
+def _columns(size):
+    from synthetic_data import generate_historical_data_vectorized
+    columns = generate_historical_data_vectorized(1, size, start_date=HISTORY_START_DATE)
+    del columns['shop_id']
+    return columns
+
+
+def _trained_predictor(records):
+    from ml_model import AdMetricsPredictor
+    predictor = AdMetricsPredictor()
+    predictor.train(records[-MODEL_TRAIN_ROWS:])
+    return predictor
+
+
+# --- Этапы: setup(size, work_dir) возвращает функцию одного замера ---
+
+def _stage_create_features(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    records = _records(size)
+    predictor = AdMetricsPredictor()
+    return lambda: predictor.create_features(records)
+
+
+def _stage_create_features_from_arrays(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    columns = _columns(size)
+    predictor = AdMetricsPredictor()
+    return lambda: predictor.create_features_from_arrays(columns)
+
+
+def _stage_prepare_data_for_training(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    records = _records(size)
+    predictor = AdMetricsPredictor()
+    return lambda: predictor.prepare_data_for_training(records)
+
+
+def _stage_train(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    records = _records(size)
+    return lambda: AdMetricsPredictor().train(records)
+
+
+def _stage_predict_next_days(size, work_dir):
+    records = _records(size)
+    predictor = _trained_predictor(records)
+    return lambda: predictor.predict_next_days(records, days_ahead=7)
+
+
+def _stage_save_model(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    records = _records(size)
+    predictor = AdMetricsPredictor()
+    predictor.train(records)
+    path = os.path.join(work_dir, 'model')
+    return lambda: predictor.save_model(path)
+
+
+def _stage_load_model(size, work_dir):
+    from ml_model import AdMetricsPredictor
+    path = os.path.join(work_dir, 'model')
+    predictor = AdMetricsPredictor()
+    predictor.train(_records(size))
+    predictor.save_model(path)
+
+    def run():
+        loaded = AdMetricsPredictor()
+        loaded.load_model(path, lazy=False)
+    return run
+
+
+def _api_client(work_dir):
+    """Отдельный экземпляр Flask-приложения с данными во временной директории и его тестовый клиент."""
+    sys.path.append(os.path.abspath(os.path.join(current_dir, '..', 'api')))
+    import ml_api
+    app = ml_api.create_app({'ML_DATA_DIR': os.path.join(work_dir, 'data')})
+    return app.extensions[ml_api.STATE_KEY], app.test_client()
+
+
+def _checked(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def _install_model(state, records):
+    state.predictor = _trained_predictor(records)
+    state.model_trained = True
+
+
+def _stage_api_health(size, work_dir):
+    _, client = _api_client(work_dir)
+    return lambda: _checked(client.get('/api/health'))
+
+
+def _stage_api_train(size, work_dir):
+    _, client = _api_client(work_dir)
+    body = {'historical_data': _records(size)}
+    return lambda: _checked(client.post('/api/train', json=body))
+
+
+def _stage_api_predict(size, work_dir):
+    state, client = _api_client(work_dir)
+    records = _records(size)
+    _install_model(state, records)
+    body = {'historical_data': records, 'days_ahead': 7}
+
+    def run():
+        # Замеряем полный путь предсказания, а не попадание в кэш
+        state.prediction_cache.clear()
+        _checked(client.post('/api/predict', json=body))
+    return run
+
+
+def _stage_api_predict_cached(size, work_dir):
+    state, client = _api_client(work_dir)
+    records = _records(size)
+    _install_model(state, records)
+    body = {'historical_data': records, 'days_ahead': 7}
+    _checked(client.post('/api/predict', json=body))
+    return lambda: _checked(client.post('/api/predict', json=body))
+
+
+def _stage_api_recommendations(size, work_dir):
+    state, client = _api_client(work_dir)
+    records = _records(size)
+    _install_model(state, records)
+    body = {'historical_data': records, 'days_ahead': 7}
+
+    def run():
+        state.prediction_cache.clear()
+        _checked(client.post('/api/recommendations', json=body))
+    return run
+
+
+def _stage_api_model_stats(size, work_dir):
+    state, client = _api_client(work_dir)
+    _install_model(state, _records(size))
+    return lambda: _checked(client.get('/api/model-stats'))
+
+
+def _stage_api_training_charts(size, work_dir):
+    state, client = _api_client(work_dir)
+    _install_model(state, _records(size))
+    return lambda: _checked(client.get('/api/training-charts'))
+
+
+# Этап: (setup, максимальный размер по умолчанию или None, зависит ли от размера)
+STAGES = {
+    'create_features': (_stage_create_features, None, True),
+    'create_features_from_arrays': (_stage_create_features_from_arrays, None, True),
+    'prepare_data_for_training': (_stage_prepare_data_for_training, None, True),
+    'train': (_stage_train, 10000, True),
+    'predict_next_days': (_stage_predict_next_days, None, True),
+    'save_model': (_stage_save_model, 10000, True),
+    'load_model': (_stage_load_model, 10000, True),
+    'api_health': (_stage_api_health, None, False),
+    'api_train': (_stage_api_train, 10000, True),
+    'api_predict': (_stage_api_predict, 100000, True),
+    'api_predict_cached': (_stage_api_predict_cached, 100000, True),
+    'api_recommendations': (_stage_api_recommendations, 100000, True),
+    'api_model_stats': (_stage_api_model_stats, None, False),
+    'api_training_charts': (_stage_api_training_charts, None, False),
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах, в macOS - в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(stage, size, repeats):
+    """
+    Замер одного случая в текущем процессе (вызывается в дочернем процессе).
+
+    Returns:
+        dict: Время замеров, пиковый RSS до и после, пропускная способность.
+    """
+    import logging
+    logging.disable(logging.INFO)
+    setup = STAGES[stage][0]
+    with tempfile.TemporaryDirectory() as work_dir:
+        run = setup(size, work_dir)
+        rss_before = _peak_rss_mb()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak_rss = _peak_rss_mb()
+    median = float(np.median(times))
+    return {
+        'stage': stage,
+        'size': size,
+        'status': 'ok',
+        'repeats': repeats,
+        'wall_time_s': round(median, 6),
+        'min_time_s': round(min(times), 6),
+        'throughput_rows_s': round(size / median, 1) if median > 0 else None,
+        'peak_rss_mb': round(peak_rss, 1),
+        'stage_rss_mb': round(peak_rss - rss_before, 1)
+    }
+
+
+def run_case_subprocess(stage, size, repeats, timeout):
+    """Запуск случая в отдельном процессе; ошибки и таймауты попадают в результат."""
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', stage, str(size), str(repeats)]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'stage': stage, 'size': size, 'status': 'timeout'}
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'unknown error'
+        return {'stage': stage, 'size': size, 'status': 'error', 'error': error}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _case_key(result):
+    return result['stage'], result['size']
+
+
+def compare_with_baseline(results, baseline, time_threshold, rss_threshold,
+                          min_time_delta=DEFAULT_MIN_TIME_DELTA):
+    """
+    Сравнение результатов с базовыми. Регрессия по времени засчитывается,
+    только если рост превышает и относительный порог, и min_time_delta.
+
+    Returns:
+        list: Результаты с полями baseline_time_s, time_change, rss_change и regression.
+    """
+    baseline_by_case = {_case_key(result): result for result in baseline.get('results', [])}
+    compared = []
+    for result in results:
+        result = dict(result)
+        base = baseline_by_case.get(_case_key(result))
+        if result['status'] == 'ok' and base and base.get('status') == 'ok':
+            time_change = result['wall_time_s'] / base['wall_time_s'] - 1 if base['wall_time_s'] else 0.0
+            rss_change = result['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base['peak_rss_mb'] else 0.0
+            result['baseline_time_s'] = base['wall_time_s']
+            result['time_change'] = round(time_change, 4)
+            result['rss_change'] = round(rss_change, 4)
+            time_regression = (time_change > time_threshold
+                               and result['wall_time_s'] - base['wall_time_s'] > min_time_delta)
+            result['regression'] = time_regression or rss_change > rss_threshold
+        compared.append(result)
+    return compared
+
+
+def _format_change(value):
+    return f"{value:+.1%}" if value is not None else '-'
+
+
+def print_results(results):
+    print(f"{'Этап':<30} {'Строк':>9} {'Время, с':>10} {'Строк/с':>12} {'RSS, МБ':>9} {'Изм. времени':>13} {'Изм. RSS':>9}")
+    for result in results:
+        if result['status'] != 'ok':
+            print(f"{result['stage']:<30} {result['size']:>9} {result['status']:>10} {result.get('error', '')}")
+            continue
+        flag = '  РЕГРЕССИЯ' if result.get('regression') else ''
+        print(f"{result['stage']:<30} {result['size']:>9} {result['wall_time_s']:>10.4f} "
+              f"{result['throughput_rows_s'] or 0:>12,.0f} {result['peak_rss_mb']:>9.1f} "
+              f"{_format_change(result.get('time_change')):>13} {_format_change(result.get('rss_change')):>9}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки ML-пайплайна с отслеживанием регрессий.")
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES),
+                        help="Замеряемые этапы.")
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help="Длины истории в строках.")
+    parser.add_argument('--repeats', type=int, default=3, help="Повторы замера в каждом случае.")
+    parser.add_argument('--no-size-limits', action='store_true',
+                        help="Не ограничивать размеры для дорогих этапов (обучение, API).")
+    parser.add_argument('--timeout', type=float, default=1800, help="Таймаут одного случая в секундах.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Файл результатов.")
+    parser.add_argument('--baseline', help="Базовый файл результатов для сравнения.")
+    parser.add_argument('--save-baseline', help="Сохранить результаты как базовые в указанный файл.")
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD,
+                        help="Допустимый относительный рост времени.")
+    parser.add_argument('--rss-threshold', type=float, default=DEFAULT_RSS_THRESHOLD,
+                        help="Допустимый относительный рост пикового RSS.")
+    parser.add_argument('--min-time-delta', type=float, default=DEFAULT_MIN_TIME_DELTA,
+                        help="Минимальный абсолютный рост времени (с), считающийся регрессией.")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Завершиться с кодом 1 при обнаружении регрессии.")
+    parser.add_argument('--run-case', nargs=3, metavar=('STAGE', 'SIZE', 'REPEATS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        stage, size, repeats = args.run_case
+        print(json.dumps(run_case(stage, int(size), int(repeats))))
+        return
+
+    results = []
+    for stage in args.stages:
+        _, max_size, size_dependent = STAGES[stage]
+        sizes = sorted(args.sizes) if size_dependent else [min(args.sizes)]
+        for size in sizes:
+            if max_size is not None and size > max_size and not args.no_size_limits:
+                results.append({'stage': stage, 'size': size, 'status': 'skipped'})
+                continue
+            result = run_case_subprocess(stage, size, args.repeats, args.timeout)
+            results.append(result)
+            print(f"{stage} [{size}]: {result.get('wall_time_s', result['status'])}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results = compare_with_baseline(results, json.load(f), args.time_threshold,
+                                            args.rss_threshold, args.min_time_delta)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats,
+            'baseline': args.baseline
+        },
+        'results': results
+    }
+    print_results(results)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {path}")
+
+    regressions = [result for result in results if result.get('regression')]
+    if regressions:
+        print(f"Обнаружено регрессий: {len(regressions)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+# compiled_forest.py
+"""
+Компактное представление обученных лесов для быстрого предсказания.
+
+Узлы всех деревьев всех моделей упаковываются в общие плоские массивы NumPy
+(признак, порог, дочерние узлы, значение листа), а предсказание выполняется
+одним векторным обходом сразу по всем деревьям: на каждом шаге все строки
+во всех деревьях, еще не дошедшие до листа, спускаются на один уровень. В отличие от predict в sklearn,
+здесь нет проверки входа, преобразования DataFrame и запуска потоков на
+каждый вызов, поэтому несколько строк оцениваются за сотни микросекунд.
+На больших матрицах обход в sklearn (на C) быстрее, поэтому упакованный лес
+предназначен прежде всего для предсказаний по одной или нескольким строкам;
+большие матрицы обходятся пакетами по APPLY_CHUNK_ROWS строк.
+
+Упакованный лес сохраняется набором файлов .npy (см. CompiledForest.save) и
+загружается через memory map: массивы не копируются в память процесса, а
+процессы, открывшие одну версию артефакта, разделяют страницы кэша ОС.
+
+Результат совпадает с predict sklearn до последнего бита:
+- признаки, как и в sklearn, приводятся к float32;
+- порог float64 заменяется ближайшим снизу float32, что для признака float32
+  дает то же сравнение;
+- пропуски направляются по missing_go_to_left;
+- предсказания деревьев суммируются последовательно в порядке estimators_.
+"""
+import json
+import os
+
+import numpy as np
+
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+
+# Усредняющие леса, которые можно упаковать
+FOREST_TYPES = (RandomForestRegressor, ExtraTreesRegressor)
+# Массивы узлов, сохраняемые в .npy, и файл с разметкой моделей по деревьям
+PACKED_ARRAYS = ('feature', 'threshold', 'missing_right', 'children', 'value', 'roots')
+LAYOUT_FILE = 'layout.json'
+# Число строк, обходимых за раз: ограничивает размер промежуточных матриц (строки x деревья)
+APPLY_CHUNK_ROWS = 4096
+
+
+class UnsupportedModelError(TypeError):
+    """Модель не является усредняющим лесом деревьев sklearn."""
+
+
+def _forest_trees(model):
+    """Деревья обученного леса (RandomForestRegressor, ExtraTreesRegressor)."""
+    if not isinstance(model, FOREST_TYPES) or not hasattr(model, 'estimators_'):
+        raise UnsupportedModelError(f"Модель {type(model).__name__} не является обученным лесом деревьев.")
+    return [tree.tree_ for tree in model.estimators_]
+
+
+def _float32_floor(threshold):
+    """Наибольшее float32, не превосходящее порог: x > порог <=> x > результат для любого float32 x."""
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class CompiledForest:
+    """
+    Леса нескольких моделей, упакованные в общие массивы узлов.
+
+    Каждому узлу соответствуют два слота (2 * узел - переход влево,
+    2 * узел + 1 - вправо), поэтому шаг обхода - это один индекс
+    children[слот + (x > порог)]. Листья ссылаются сами на себя: дошедшие
+    до листа строки остаются на месте, пока остальные продолжают спуск.
+    """
+
+    def __init__(self, models):
+        """
+        Args:
+            models (dict): {имя: обученный лес sklearn}. Все леса должны быть
+                обучены на одном наборе признаков.
+
+        Raises:
+            UnsupportedModelError: Одна из моделей не является усредняющим лесом.
+        """
+        features, thresholds, children, missing_right, values = [], [], [], [], []
+        roots, slices, outputs = [], {}, {}
+        n_outputs = max((model.n_outputs_ for model in models.values() if hasattr(model, 'n_outputs_')), default=1)
+        offset = 0
+        max_depth = 0
+        for name, model in models.items():
+            trees = _forest_trees(model)
+            first_tree = len(roots)
+            for tree in trees:
+                n_nodes = tree.node_count
+                is_leaf = tree.children_left < 0
+                own = np.arange(offset, offset + n_nodes)
+                left = np.where(is_leaf, own, tree.children_left + offset)
+                right = np.where(is_leaf, own, tree.children_right + offset)
+                features.append(np.where(is_leaf, 0, tree.feature))
+                thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+                children.append(np.stack([left, right], axis=1))
+                missing_left = getattr(tree, 'missing_go_to_left', None)
+                if missing_left is None:
+                    missing_right.append(np.zeros(n_nodes, dtype=bool))
+                else:
+                    missing_right.append(~np.asarray(missing_left, dtype=bool) & ~is_leaf)
+                leaf_values = np.zeros((n_nodes, n_outputs))
+                leaf_values[:, :tree.n_outputs] = tree.value[:, :, 0]
+                values.append(leaf_values)
+                roots.append(offset)
+                max_depth = max(max_depth, tree.max_depth)
+                offset += n_nodes
+            slices[name] = slice(first_tree, len(roots))
+            outputs[name] = model.n_outputs_
+
+        # Массивы по слотам: признак и порог узла повторяются для обоих слотов
+        self.feature = np.repeat(np.concatenate(features).astype(np.intp), 2)
+        self.threshold = np.repeat(_float32_floor(np.concatenate(thresholds)), 2)
+        self.missing_right = np.repeat(np.concatenate(missing_right), 2)
+        # Слот дочернего узла для перехода из каждого слота
+        self.children = 2 * np.concatenate(children).astype(np.intp).ravel()
+        self.value = np.concatenate(values)
+        self.roots = 2 * np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.slices = slices
+        self.outputs = outputs
+
+    def save(self, directory):
+        """
+        Сохранение упакованного леса в директорию: по файлу .npy на массив
+        узлов и layout.json с разметкой моделей.
+
+        Args:
+            directory (str): Директория (создается при необходимости).
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in PACKED_ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        layout = {
+            'max_depth': int(self.max_depth),
+            'slices': {name: [trees.start, trees.stop] for name, trees in self.slices.items()},
+            'outputs': {name: int(n_outputs) for name, n_outputs in self.outputs.items()}
+        }
+        with open(os.path.join(directory, LAYOUT_FILE), 'w', encoding='utf-8') as f:
+            json.dump(layout, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Загрузка леса, сохраненного методом save.
+
+        Args:
+            directory (str): Директория с массивами.
+            mmap_mode (str | None): Режим memory map для массивов
+                (None - прочитать их в память).
+
+        Returns:
+            CompiledForest: Лес, массивы которого отображены из файлов.
+        """
+        with open(os.path.join(directory, LAYOUT_FILE), 'r', encoding='utf-8') as f:
+            layout = json.load(f)
+        forest = cls.__new__(cls)
+        for name in PACKED_ARRAYS:
+            setattr(forest, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode))
+        forest.max_depth = layout['max_depth']
+        forest.slices = {name: slice(*trees) for name, trees in layout['slices'].items()}
+        forest.outputs = layout['outputs']
+        return forest
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.value)
+
+    @property
+    def nbytes(self):
+        """Объем упакованных массивов в байтах."""
+        return int(sum(array.nbytes for array in (self.feature, self.threshold, self.missing_right,
+                                                  self.children, self.value, self.roots)))
+
+    def apply(self, X):
+        """
+        Листья, в которые попадает каждая строка в каждом дереве.
+
+        Args:
+            X (np.ndarray | pd.DataFrame): Матрица признаков (строки x признаки).
+
+        Returns:
+            np.ndarray: Индексы листов в упакованных массивах (строки x деревья).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        # Слоты пар (строка, дерево) и смещения строк в плоской матрице
+        slots = np.broadcast_to(self.roots, (n_rows, self.n_trees)).ravel().copy()
+        row_offsets = np.repeat(np.arange(n_rows) * n_features, self.n_trees)
+        has_missing = np.isnan(flat).any()
+        # Пары, еще не дошедшие до листа: лист ссылается сам на себя
+        active = np.arange(len(slots))
+        for _ in range(self.max_depth):
+            current = slots[active]
+            x = flat[self.feature[current] + row_offsets[active]]
+            go_right = x > self.threshold[current]
+            if has_missing:
+                go_right |= np.isnan(x) & self.missing_right[current]
+            following = self.children[current + go_right]
+            slots[active] = following
+            active = active[following != current]
+            if not len(active):
+                break
+        return (slots // 2).reshape(n_rows, self.n_trees)
+
+    def predict_trees(self, X):
+        """
+        Предсказания каждого дерева.
+
+        Returns:
+            np.ndarray: Массив (деревья x строки x выходы).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) <= APPLY_CHUNK_ROWS:
+            return np.asarray(self.value[self.apply(X).T])
+        return np.concatenate([self.value[self.apply(X[start:start + APPLY_CHUNK_ROWS]).T]
+                               for start in range(0, len(X), APPLY_CHUNK_ROWS)], axis=1)
+
+    def predict(self, X):
+        """
+        Предсказания всех моделей, совпадающие с model.predict(X).
+
+        Args:
+            X (np.ndarray | pd.DataFrame): Матрица признаков.
+
+        Returns:
+            dict: {имя: np.ndarray} размера (строки,) для моделей с одним
+                выходом или (строки x выходы) для моделей с несколькими.
+        """
+        return self.aggregate(self.predict_trees(X))
+
+    def split(self, tree_values):
+        """
+        Предсказания деревьев по моделям (см. predict_trees).
+
+        Returns:
+            dict: {имя: np.ndarray (деревья x строки)} для моделей с одним
+                выходом или (деревья x строки x выходы) для моделей с несколькими.
+        """
+        results = {}
+        for name, trees in self.slices.items():
+            n_outputs = self.outputs[name]
+            results[name] = tree_values[trees, :, 0] if n_outputs == 1 else tree_values[trees, :, :n_outputs]
+        return results
+
+    def aggregate(self, tree_values):
+        """
+        Средние по деревьям каждой модели (см. predict_trees). Накопленная сумма
+        складывает деревья последовательно, как predict в sklearn.
+        """
+        return {name: forest_mean(values) for name, values in self.split(tree_values).items()}
+
+
+def forest_mean(tree_predictions):
+    """
+    Среднее предсказаний деревьев (деревья по первой оси), совпадающее с predict
+    леса: деревья складываются последовательно в порядке estimators_.
+    """
+    return np.cumsum(tree_predictions, axis=0)[-1] / len(tree_predictions)
+
+
+def tree_quantiles(tree_predictions, quantiles):
+    """
+    Квантили предсказаний деревьев (линейная интерполяция, как np.quantile):
+    одна сортировка по оси деревьев на все уровни квантилей.
+
+    Returns:
+        np.ndarray: Массив (квантили x строки [x выходы]).
+    """
+    ordered = np.sort(tree_predictions, axis=0)
+    position = np.asarray(quantiles, dtype=float) * (len(ordered) - 1)
+    below = np.floor(position).astype(np.intp)
+    above = np.minimum(below + 1, len(ordered) - 1)
+    weight = (position - below).reshape((-1,) + (1,) * (ordered.ndim - 1))
+    return ordered[below] + (ordered[above] - ordered[below]) * weight
+
+
+def tree_predictions(model, X):
+    """
+    Предсказания каждого дерева обученного леса одним проходом по деревьям.
+
+    Args:
+        model: Обученный лес (см. FOREST_TYPES).
+        X (np.ndarray | pd.DataFrame): Матрица признаков.
+
+    Returns:
+        np.ndarray | None: (деревья x строки) или (деревья x строки x выходы);
+            None, если модель не является лесом.
+    """
+    if not isinstance(model, FOREST_TYPES) or not hasattr(model, 'estimators_'):
+        return None
+    # Как и predict леса, деревья получают уже проверенную матрицу float32
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    return np.stack([tree.predict(X, check_input=False) for tree in model.estimators_])
+
+
+def compile_models(models):
+    """
+    Упаковка моделей AdMetricsPredictor.models, если все они - леса.
+
+    Returns:
+        CompiledForest | None: None, если хотя бы одна модель не является лесом
+            (например, бустинг или линейная модель).
+    """
+    try:
+        return CompiledForest(models)
+    except UnsupportedModelError:
+        return None
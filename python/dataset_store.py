@@ -0,0 +1,318 @@
+# dataset_store.py
+"""
+Серверное хранилище исторических данных кампаний.
+
+Клиент один раз загружает историю под идентификатором кампании/магазина,
+дальше дописывает только новые дни, а запросы на обучение и предсказание
+ссылаются на набор данных по ID вместо передачи всей истории.
+
+Каждый набор данных - директория HistoryStorage (журнал новых дней и
+колоночные сегменты, см. history_storage.py), поэтому добавление N дней
+стоит O(N), а не перезапись всей истории. Рядом с хранилищем лежит
+DATASET.json с версией и эпохой набора. В памяти держатся записи
+ограниченного числа недавно использованных наборов (LRU).
+
+Хранилище может использоваться несколькими процессами сервиса: изменения
+выполняются под файловой блокировкой HistoryStorage, а запись из кэша
+перечитывается, если отметка DATASET.json изменилась в другом процессе.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import logging
+from collections import OrderedDict
+
+from history_storage import HistoryStorage, columns_to_records, merge_columns, rows_to_columns
+
+logger = logging.getLogger(__name__)
+
+# Допустимые идентификаторы наборов данных (используются как имена файлов и директорий)
+DATASET_ID_PATTERN = re.compile(r'^(?!\.{1,2}$)[A-Za-z0-9_.-]{1,64}$')
+# Версия и эпоха набора данных внутри его директории
+DATASET_META_FILE = 'DATASET.json'
+
+
+class DatasetNotFoundError(KeyError):
+    """Набор данных с указанным идентификатором не найден."""
+
+
+class _Dataset:
+    """Открытый набор данных: хранилище, записи истории, версия, эпоха и отметка DATASET.json."""
+
+    def __init__(self, storage, rows, version, epoch, stamp=None):
+        self.storage = storage
+        self.rows = rows
+        self.version = version
+        self.epoch = epoch
+        self.stamp = stamp
+
+
+class DatasetStore:
+    """Хранилище исторических данных, ключом которого является ID кампании/магазина."""
+
+    def __init__(self, root_dir, max_cached=64, compact_threshold=1000):
+        """
+        Инициализация хранилища.
+
+        Args:
+            root_dir (str): Директория, в которой хранятся наборы данных.
+            max_cached (int): Максимальное число наборов данных, записи
+                которых держатся в памяти.
+            compact_threshold (int): Число строк в журнале набора, после
+                которого он сжимается в колоночный сегмент.
+        """
+        self.root_dir = root_dir
+        self.max_cached = max_cached
+        self.compact_threshold = compact_threshold
+        os.makedirs(root_dir, exist_ok=True)
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _validate_id(self, dataset_id):
+        if not isinstance(dataset_id, str) or not DATASET_ID_PATTERN.match(dataset_id):
+            raise ValueError(f"Некорректный идентификатор набора данных: '{dataset_id}'.")
+
+    def _path(self, dataset_id):
+        return os.path.join(self.root_dir, dataset_id)
+
+    def _meta_path(self, dataset_id):
+        return os.path.join(self._path(dataset_id), DATASET_META_FILE)
+
+    def _read_meta(self, dataset_id):
+        """Версия и эпоха набора данных или None, если набора нет."""
+        try:
+            with open(self._meta_path(dataset_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _stamp(self, dataset_id):
+        """Отметка DATASET.json (заменяется при каждом изменении набора) или None."""
+        try:
+            stat = os.stat(self._meta_path(dataset_id))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _write_meta(self, dataset_id, dataset):
+        """Атомарная запись версии и эпохи набора данных (под блокировкой хранилища)."""
+        path = self._meta_path(dataset_id)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': dataset.version, 'epoch': dataset.epoch}, f)
+        os.replace(tmp_path, path)
+        dataset.stamp = self._stamp(dataset_id)
+
+    def _remember(self, dataset_id, dataset):
+        """Добавление набора в LRU-кэш (вызывается под блокировкой)."""
+        self._datasets[dataset_id] = dataset
+        self._datasets.move_to_end(dataset_id)
+        while len(self._datasets) > self.max_cached:
+            self._datasets.popitem(last=False)
+        return dataset
+
+    def _load(self, dataset_id):
+        """Открытие набора данных (вызывается под блокировкой)."""
+        dataset = self._datasets.get(dataset_id)
+        if dataset is not None:
+            if self._sync(dataset_id, dataset):
+                self._datasets.move_to_end(dataset_id)
+                return dataset
+            del self._datasets[dataset_id]
+        if self._stamp(dataset_id) is None:
+            raise DatasetNotFoundError(dataset_id)
+        storage = HistoryStorage(self._path(dataset_id), compact_threshold=self.compact_threshold)
+        dataset = _Dataset(storage, None, None, None)
+        if not self._sync(dataset_id, dataset):
+            raise DatasetNotFoundError(dataset_id)
+        return self._remember(dataset_id, dataset)
+
+    def _sync(self, dataset_id, dataset):
+        """
+        Перечитывание набора, если DATASET.json изменил другой процесс
+        (вызывается под блокировкой).
+
+        Returns:
+            bool: False, если набор данных удален.
+        """
+        stamp = self._stamp(dataset_id)
+        if stamp is None:
+            return False
+        if stamp == dataset.stamp:
+            return True
+        with dataset.storage.locked():
+            meta = self._read_meta(dataset_id)
+            if meta is None:
+                return False
+            dataset.rows = dataset.storage.read_records()
+            dataset.version, dataset.epoch = meta['version'], meta['epoch']
+            dataset.stamp = self._stamp(dataset_id)
+        return True
+
+    def _replace(self, dataset_id, rows, version, epoch, storage):
+        """Запись всей истории набора одним сегментом (вызывается под блокировкой)."""
+        with storage.locked():
+            storage.reset()
+            if rows:
+                storage.append_columns(rows_to_columns(rows))
+            dataset = _Dataset(storage, storage.read_records(), version, epoch)
+            self._write_meta(dataset_id, dataset)
+        return self._remember(dataset_id, dataset)
+
+    def _open_storage(self, dataset_id):
+        """Хранилище набора из кэша или новое (вызывается под блокировкой)."""
+        dataset = self._datasets.get(dataset_id)
+        if dataset is not None:
+            return dataset.storage
+        return HistoryStorage(self._path(dataset_id), compact_threshold=self.compact_threshold)
+
+    @staticmethod
+    def _normalize_rows(rows):
+        if not isinstance(rows, list):
+            raise ValueError("Данные должны быть списком записей.")
+        for row in rows:
+            if not isinstance(row, dict) or 'date' not in row:
+                raise ValueError("Каждая запись должна быть словарем с полем 'date'.")
+        return sorted(rows, key=lambda row: str(row['date']))
+
+    def exists(self, dataset_id):
+        """Проверка существования набора данных."""
+        self._validate_id(dataset_id)
+        return self._stamp(dataset_id) is not None
+
+    def get(self, dataset_id):
+        """
+        Получение истории набора данных.
+
+        Args:
+            dataset_id (str): Идентификатор кампании/магазина.
+
+        Returns:
+            list: Список словарей с историческими данными (дата и метрики),
+                отсортированный по дате. Список разделяется с хранилищем
+                и не должен изменяться.
+        """
+        self._validate_id(dataset_id)
+        with self._lock:
+            return self._load(dataset_id).rows
+
+    def snapshot(self, dataset_id):
+        """
+        Согласованные история и метаданные набора данных, полученные под
+        одной блокировкой.
+
+        Returns:
+            tuple: (rows, info) — как у методов get() и info().
+        """
+        self._validate_id(dataset_id)
+        with self._lock:
+            dataset = self._load(dataset_id)
+            return dataset.rows, self._describe(dataset_id, dataset)
+
+    def info(self, dataset_id):
+        """
+        Метаданные набора данных без самой истории.
+
+        Returns:
+            dict: Идентификатор, число строк, версия, эпоха и диапазон дат.
+        """
+        self._validate_id(dataset_id)
+        with self._lock:
+            return self._describe(dataset_id, self._load(dataset_id))
+
+    @staticmethod
+    def _describe(dataset_id, dataset):
+        rows = dataset.rows
+        return {
+            'dataset_id': dataset_id,
+            'rows': len(rows),
+            'version': dataset.version,
+            'epoch': dataset.epoch,
+            'first_date': rows[0]['date'] if rows else None,
+            'last_date': rows[-1]['date'] if rows else None
+        }
+
+    def put(self, dataset_id, rows):
+        """
+        Создание или полная замена набора данных.
+
+        Args:
+            dataset_id (str): Идентификатор кампании/магазина.
+            rows (list): Список словарей с историческими данными.
+
+        Returns:
+            dict: Метаданные набора данных.
+        """
+        self._validate_id(dataset_id)
+        rows = self._normalize_rows(rows)
+        with self._lock:
+            try:
+                self._load(dataset_id)
+            except DatasetNotFoundError:
+                pass
+            storage = self._open_storage(dataset_id)
+            with storage.locked():
+                previous = self._read_meta(dataset_id)
+                version, epoch = (previous['version'] + 1, previous['epoch'] + 1) if previous else (1, 1)
+                dataset = self._replace(dataset_id, rows, version, epoch, storage)
+            logger.info(f"Набор данных '{dataset_id}' сохранен: {len(rows)} записей.")
+            return self._describe(dataset_id, dataset)
+
+    def append(self, dataset_id, rows):
+        """
+        Добавление новых дней в набор данных.
+
+        Записи с датами после последней сохраненной дописываются в журнал
+        хранилища. Записи с уже существующими или более ранними датами
+        заменяют/вставляются в историю, при этом увеличивается эпоха
+        набора — признак того, что старые строки изменились.
+
+        Args:
+            dataset_id (str): Идентификатор кампании/магазина.
+            rows (list): Список словарей с новыми днями.
+
+        Returns:
+            dict: Метаданные набора данных.
+        """
+        self._validate_id(dataset_id)
+        rows = self._normalize_rows(rows)
+        columns = rows_to_columns(rows)
+        with self._lock:
+            try:
+                dataset = self._load(dataset_id)
+            except DatasetNotFoundError:
+                dataset = None
+            storage = dataset.storage if dataset is not None else self._open_storage(dataset_id)
+            with storage.locked():
+                # Между открытием и блокировкой набор мог изменить или удалить другой процесс
+                if dataset is None or not self._sync(dataset_id, dataset):
+                    self._datasets.pop(dataset_id, None)
+                    dataset = self._replace(dataset_id, [], 0, 1, storage)
+                existing = dataset.rows
+                storage.append(rows)
+                if not existing or not rows or str(columns['date'][0]) > existing[-1]['date']:
+                    # Новые дни идут после истории: достаточно дописать их записи
+                    dataset.rows = existing + columns_to_records(merge_columns([columns]))
+                else:
+                    dataset.rows = storage.read_records()
+                    dataset.epoch += 1
+                dataset.version += 1
+                self._write_meta(dataset_id, dataset)
+            logger.info(f"В набор данных '{dataset_id}' добавлено {len(rows)} записей.")
+            return self._describe(dataset_id, dataset)
+
+    def delete(self, dataset_id):
+        """Удаление набора данных."""
+        self._validate_id(dataset_id)
+        with self._lock:
+            self._datasets.pop(dataset_id, None)
+            path = self._path(dataset_id)
+            if not HistoryStorage.exists(path):
+                raise DatasetNotFoundError(dataset_id)
+            # DATASET.json удаляется первым: другие процессы сразу видят, что набора нет
+            with HistoryStorage(path, compact_threshold=self.compact_threshold).locked():
+                if os.path.exists(self._meta_path(dataset_id)):
+                    os.remove(self._meta_path(dataset_id))
+                shutil.rmtree(path, ignore_errors=True)
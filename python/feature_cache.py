@@ -0,0 +1,166 @@
+# feature_cache.py
+"""
+Инкрементальный кэш признаков для create_features.
+
+Для каждого набора данных хранится уже посчитанный DataFrame признаков в
+колоночных буферах с запасом по емкости. Когда к истории дописываются
+новые дни, построчные признаки считаются только для них, а скользящие
+средние и процентные изменения продолжаются по хвосту из max(MA_WINDOWS)
+последних строк, поэтому добавление N строк стоит O(N), а не O(истории).
+"""
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ml_model import MA_WINDOWS, build_base_features, add_window_features
+
+logger = logging.getLogger(__name__)
+
+
+class _FeatureBuffer:
+    """Колоночные буферы признаков с амортизированным O(1) добавлением строк."""
+
+    def __init__(self, df):
+        self.columns = list(df.columns)
+        self.size = len(df)
+        capacity = max(64, self.size * 2)
+        self.arrays = {}
+        for col in self.columns:
+            values = df[col].to_numpy()
+            array = np.empty(capacity, dtype=values.dtype)
+            array[:self.size] = values
+            self.arrays[col] = array
+        self._frame = None
+
+    def tail(self, n):
+        """Последние n строк в виде DataFrame."""
+        start = max(0, self.size - n)
+        return pd.DataFrame({col: self.arrays[col][start:self.size] for col in self.columns})
+
+    def extend(self, df):
+        """Дописывает строки df (с теми же колонками) в конец буферов."""
+        n = len(df)
+        if self.size + n > len(self.arrays[self.columns[0]]):
+            capacity = max((self.size + n) * 2, 64)
+            for col in self.columns:
+                array = np.empty(capacity, dtype=self.arrays[col].dtype)
+                array[:self.size] = self.arrays[col][:self.size]
+                self.arrays[col] = array
+        for col in self.columns:
+            # Ошибка приведения типов (например, NaN в целочисленной колонке)
+            # приводит к полному пересчету на уровне FeatureCache
+            self.arrays[col][self.size:self.size + n] = df[col].to_numpy(dtype=self.arrays[col].dtype)
+        self.size += n
+        self._frame = None
+
+    def frame(self):
+        """DataFrame-представление буферов без копирования данных."""
+        if self._frame is None:
+            self._frame = pd.DataFrame(
+                {col: self.arrays[col][:self.size] for col in self.columns}, copy=False
+            )
+        return self._frame
+
+
+class _CacheEntry:
+    def __init__(self, epoch, buffer, last_row):
+        self.epoch = epoch
+        self.buffer = buffer
+        self.last_row = last_row
+
+
+class FeatureCache:
+    """
+    Кэш DataFrame признаков, ключом которого является ID набора данных.
+
+    Запись считается продолжаемой, если эпоха набора данных не изменилась,
+    история не стала короче, а строка, на которой закончился кэш, совпадает
+    с сохраненной. Иначе признаки пересчитываются полностью.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Args:
+            max_entries (int): Максимальное число наборов данных в кэше.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'extends': 0, 'rebuilds': 0}
+
+    def get(self, key, historical_data, epoch=None):
+        """
+        Получение DataFrame признаков для истории набора данных.
+
+        Args:
+            key (str): Идентификатор набора данных.
+            historical_data (list): Полная история в хронологическом порядке.
+            epoch (int, optional): Эпоха набора данных; меняется при изменении
+                старых строк и сбрасывает кэш.
+
+        Returns:
+            pd.DataFrame: DataFrame признаков. Разделяется с кэшем и не должен изменяться.
+        """
+        if not historical_data:
+            raise ValueError("Исторические данные не могут быть пустыми.")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_prefix(entry, historical_data, epoch):
+                self._entries.move_to_end(key)
+                cached_size = entry.buffer.size
+                if cached_size == len(historical_data):
+                    self.stats['hits'] += 1
+                    return entry.buffer.frame()
+                try:
+                    self._extend(entry, historical_data[cached_size:])
+                    self.stats['extends'] += 1
+                    return entry.buffer.frame()
+                except (ValueError, TypeError) as e:
+                    logger.info(f"Не удалось продолжить признаки для '{key}', полный пересчет: {e}")
+
+            df = add_window_features(build_base_features(pd.DataFrame(historical_data)))
+            self._entries[key] = _CacheEntry(epoch, _FeatureBuffer(df), dict(historical_data[-1]))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['rebuilds'] += 1
+            return self._entries[key].buffer.frame()
+
+    @staticmethod
+    def _is_prefix(entry, historical_data, epoch):
+        cached_size = entry.buffer.size
+        return (entry.epoch == epoch
+                and cached_size <= len(historical_data)
+                and historical_data[cached_size - 1] == entry.last_row)
+
+    @staticmethod
+    def _extend(entry, new_rows):
+        """Досчитывает признаки только для новых строк."""
+        buffer = entry.buffer
+        new_df = build_base_features(pd.DataFrame(new_rows))
+        last_date = buffer.arrays['date'][buffer.size - 1]
+        if new_df['date'].iloc[0] <= last_date:
+            raise ValueError("новые строки не идут после последней даты кэша")
+
+        # Хвоста из max(MA_WINDOWS) строк достаточно и для окон, и для pct_change
+        tail = buffer.tail(max(MA_WINDOWS))
+        combined = pd.concat([tail, new_df], ignore_index=True)
+        combined = add_window_features(combined).iloc[len(tail):]
+        missing = set(buffer.columns) ^ set(combined.columns)
+        if missing:
+            raise ValueError(f"набор колонок изменился: {sorted(missing)}")
+        buffer.extend(combined[buffer.columns])
+        entry.last_row = dict(new_rows[-1])
+
+    def invalidate(self, key):
+        """Удаляет запись набора данных из кэша."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Полная очистка кэша."""
+        with self._lock:
+            self._entries.clear()
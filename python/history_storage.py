@@ -0,0 +1,493 @@
+# history_storage.py
+"""
+Хранилище исторических данных: журнал новых дней + колоночные сегменты.
+
+Новые дни дописываются в журнал JSON Lines (O(N) на добавление N строк,
+без перезаписи всего файла). Крупные пачки данных можно сразу записывать
+бинарным колоночным сегментом - директорией с .npy-файлом на колонку.
+Периодически журнал и сегменты сжимаются в один отсортированный сегмент,
+который pandas/NumPy читают напрямую (в том числе через memory map).
+
+Структура директории:
+    MANIFEST.json      - текущие сегменты и журнал (заменяется атомарно)
+    log-<gen>.jsonl    - журнал добавленных строк
+    seg-<gen>/         - колоночный сегмент: date.npy, spend.npy, ...
+    LOCK               - файл блокировки для нескольких процессов
+
+Хранилище может одновременно использоваться несколькими процессами
+(воркеры gunicorn): операции выполняются под блокировкой flock файла LOCK,
+а манифест и журнал, измененные другим процессом, перечитываются.
+"""
+import json
+import os
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками процесса
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Числовые колонки, которые хранятся в сегментах
+METRIC_COLUMNS = ['spend', 'impressions', 'clicks', 'conversions', 'revenue']
+# Счетчики: хранятся как float, но в записях возвращаются целыми числами
+COUNT_COLUMNS = ['impressions', 'clicks', 'conversions']
+DATE_DTYPE = 'datetime64[D]'
+MANIFEST_FILE = 'MANIFEST.json'
+LOCK_FILE = 'LOCK'
+
+
+def _atomic_write_json(path, payload):
+    """Запись JSON во временный файл с fsync и атомарной заменой."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _file_stamp(path):
+    """Отпечаток файла (время изменения и размер) для проверки внешних перезаписей."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _manifest_stamp(path):
+    """Отметка манифеста: он заменяется атомарно, поэтому новая версия - новый inode."""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def merge_columns(parts):
+    """
+    Объединение колоночных частей в одну отсортированную по дате.
+    При совпадении дат остается строка из более поздней части.
+
+    Args:
+        parts (list): Список словарей {колонка: np.ndarray} в порядке записи.
+
+    Returns:
+        dict: Словарь {колонка: np.ndarray}.
+    """
+    parts = [part for part in parts if len(part['date'])]
+    if not parts:
+        return empty_columns()
+    if len(parts) == 1:
+        merged = parts[0]
+    else:
+        merged = {col: np.concatenate([part[col] for part in parts]) for col in ['date'] + METRIC_COLUMNS}
+    dates = merged['date']
+    if len(dates) > 1 and not (dates[1:] > dates[:-1]).all():
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        # Из одинаковых дат оставляем последнюю записанную
+        keep = np.r_[dates[1:] != dates[:-1], True]
+        merged = {col: merged[col][order][keep] for col in merged}
+    return merged
+
+
+def empty_columns():
+    """Пустой набор колонок."""
+    columns = {'date': np.empty(0, dtype=DATE_DTYPE)}
+    columns.update({col: np.empty(0, dtype=float) for col in METRIC_COLUMNS})
+    return columns
+
+
+def rows_to_columns(rows):
+    """Преобразование списка словарей в колонки хранилища."""
+    columns = {'date': np.array([str(row['date'])[:10] for row in rows], dtype=DATE_DTYPE)}
+    for col in METRIC_COLUMNS:
+        columns[col] = np.array([_to_float(row.get(col)) for row in rows], dtype=float)
+    return columns
+
+
+def _column_values(values, as_int):
+    """Значения колонки для записей: NaN - None, целые счетчики - int."""
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    if as_int and (missing | (values == np.round(values))).all():
+        result = np.where(missing, 0, values).astype(np.int64).tolist()
+    else:
+        result = values.tolist()
+    if missing.any():
+        for i in np.flatnonzero(missing):
+            result[i] = None
+    return result
+
+
+def columns_to_records(columns):
+    """
+    Преобразование колонок в список словарей формата historical_data.json:
+    счетчики (COUNT_COLUMNS) - целые числа, пропуски - None.
+    """
+    dates = np.datetime_as_string(columns['date'], unit='D')
+    metrics = [_column_values(columns[col], col in COUNT_COLUMNS) for col in METRIC_COLUMNS]
+    return [
+        dict(zip(['date'] + METRIC_COLUMNS, values))
+        for values in zip(dates.tolist(), *metrics)
+    ]
+
+
+class HistoryStorage:
+    """Хранилище истории одной кампании/магазина с журналом и колоночными сегментами."""
+
+    def __init__(self, root_dir, compact_threshold=1000, json_export_path=None):
+        """
+        Args:
+            root_dir (str): Директория хранилища.
+            compact_threshold (int): Число строк в журнале, после которого
+                выполняется автоматическое сжатие.
+            json_export_path (str, optional): JSON-файл, который обновляется
+                при каждом сжатии (для клиентов, читающих historical_data.json).
+        """
+        self.root_dir = root_dir
+        self.compact_threshold = compact_threshold
+        self.json_export_path = json_export_path
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._manifest = None
+        self._manifest_stamp = None
+        # Колонки журнала в памяти и размер файла журнала, по которому они прочитаны
+        self._log_columns = None
+        self._log_size = None
+        with self.locked():
+            self._repair_log()
+
+    @contextmanager
+    def locked(self):
+        """
+        Блокировка хранилища от других потоков и процессов. Повторный вход
+        из того же потока допускается, поэтому последовательность операций
+        (например, добавление строк и запись метаданных рядом с хранилищем)
+        можно выполнить атомарно для других процессов.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                # Директорию могли удалить вместе с хранилищем в другом процессе
+                os.makedirs(self.root_dir, exist_ok=True)
+                if fcntl is not None:
+                    self._lock_file = open(os.path.join(self.root_dir, LOCK_FILE), 'a')
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                except BaseException:
+                    self._release_file_lock()
+                    raise
+            self._lock_depth += 1
+            try:
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._release_file_lock()
+
+    def _release_file_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _refresh(self):
+        """Перечитывание манифеста и журнала, измененных другим процессом (под блокировкой)."""
+        manifest_path = os.path.join(self.root_dir, MANIFEST_FILE)
+        try:
+            stamp = _manifest_stamp(manifest_path)
+        except FileNotFoundError:
+            self._manifest = {'generation': 0, 'segments': [], 'log_file': 'log-0.jsonl', 'json_stamp': None}
+            _atomic_write_json(manifest_path, self._manifest)
+            self._manifest_stamp = _manifest_stamp(manifest_path)
+            self._log_columns = None
+            return
+        if stamp != self._manifest_stamp:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._manifest_stamp = stamp
+            self._log_columns = None
+        elif self._log_columns is not None and self._current_log_size() != self._log_size:
+            self._log_columns = None
+
+    def _current_log_size(self):
+        try:
+            return os.path.getsize(self._log_path)
+        except FileNotFoundError:
+            return 0
+
+    def _repair_log(self):
+        """Отбрасывание оборванной последней строки журнала после сбоя записи."""
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+                logger.warning(f"Оборванная запись журнала '{self._log_path}' отброшена.")
+
+    @classmethod
+    def exists(cls, root_dir):
+        """Является ли директория хранилищем истории."""
+        return os.path.isfile(os.path.join(root_dir, MANIFEST_FILE))
+
+    @property
+    def _log_path(self):
+        return os.path.join(self.root_dir, self._manifest['log_file'])
+
+    # --- Запись ---
+
+    def append(self, rows):
+        """
+        Добавление строк в журнал. Строки с уже существующими датами
+        заменяют старые значения при чтении.
+
+        Args:
+            rows (list): Список словарей с полями date и метриками.
+        """
+        if not rows:
+            return
+        columns = rows_to_columns(rows)
+        lines = ''.join(
+            json.dumps(record, ensure_ascii=False) + '\n' for record in columns_to_records(columns)
+        )
+        with self.locked():
+            with open(self._log_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                self._log_size = f.tell()
+            if self._log_columns is not None:
+                self._log_columns = merge_columns([self._log_columns, columns]) \
+                    if len(self._log_columns['date']) else columns
+            if self.log_rows() >= self.compact_threshold:
+                self.compact()
+
+    def append_columns(self, columns):
+        """
+        Запись пачки строк сразу колоночным сегментом (без журнала).
+
+        Args:
+            columns (dict): Словарь {'date': массив дат, метрика: массив}.
+        """
+        columns = {
+            'date': np.asarray(columns['date']).astype(DATE_DTYPE),
+            **{col: np.asarray(columns.get(col, np.full(len(columns['date']), np.nan)), dtype=float)
+               for col in METRIC_COLUMNS}
+        }
+        if not len(columns['date']):
+            return
+        with self.locked():
+            generation = self._manifest['generation'] + 1
+            segment = self._write_segment(generation, merge_columns([columns]))
+            self._commit_manifest(generation, self._manifest['segments'] + [segment], self._manifest['log_file'])
+
+    def _publish(self, generation, segments, log_file, json_stamp=None):
+        """Атомарная смена состояния с удалением сегментов и журнала, которые больше не используются."""
+        old_segments = set(self._manifest['segments']) - set(segments)
+        old_log = self._log_path if log_file != self._manifest['log_file'] else None
+        self._commit_manifest(generation, segments, log_file, json_stamp)
+        for name in old_segments:
+            shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+        if old_log and os.path.exists(old_log):
+            os.remove(old_log)
+
+    def _write_segment(self, generation, columns):
+        segment = f'seg-{generation:06d}'
+        tmp_dir = os.path.join(self.root_dir, f'{segment}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_dir, f'{col}.npy'), values)
+        os.replace(tmp_dir, os.path.join(self.root_dir, segment))
+        return segment
+
+    def _commit_manifest(self, generation, segments, log_file, json_stamp=None):
+        self._manifest = {
+            'generation': generation,
+            'segments': segments,
+            'log_file': log_file,
+            'json_stamp': json_stamp or self._manifest.get('json_stamp')
+        }
+        manifest_path = os.path.join(self.root_dir, MANIFEST_FILE)
+        _atomic_write_json(manifest_path, self._manifest)
+        self._manifest_stamp = _manifest_stamp(manifest_path)
+
+    def compact(self):
+        """
+        Сжатие журнала и всех сегментов в один отсортированный сегмент.
+        Новое состояние публикуется атомарной заменой MANIFEST.json,
+        после чего старые файлы удаляются.
+        """
+        with self.locked():
+            columns = self.read_columns(mmap_mode=None)
+            generation = self._manifest['generation'] + 1
+            segment = self._write_segment(generation, columns)
+            log_file = f'log-{generation}.jsonl'
+            open(os.path.join(self.root_dir, log_file), 'a').close()
+            json_stamp = self._export_json(columns, self.json_export_path) if self.json_export_path else None
+            self._publish(generation, [segment], log_file, json_stamp)
+            self._log_columns = empty_columns()
+            self._log_size = 0
+            logger.info(f"Хранилище '{self.root_dir}' сжато: {len(columns['date'])} строк.")
+
+    # --- Чтение ---
+
+    def _read_log(self):
+        """
+        Колонки журнала (кэшируются в памяти, вызывается под блокировкой);
+        оборванная последняя строка пропускается.
+        """
+        if self._log_columns is None:
+            rows = []
+            self._log_size = 0
+            if os.path.exists(self._log_path):
+                with open(self._log_path, 'r', encoding='utf-8') as f:
+                    self._log_size = os.fstat(f.fileno()).st_size
+                    for line in f:
+                        try:
+                            rows.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            logger.warning(f"Пропущена поврежденная строка журнала в '{self._log_path}'.")
+            self._log_columns = merge_columns([rows_to_columns(rows)]) if rows else empty_columns()
+        return self._log_columns
+
+    def log_rows(self):
+        """Число строк в журнале."""
+        with self.locked():
+            return len(self._read_log()['date'])
+
+    def _read_segment(self, segment, mmap_mode):
+        directory = os.path.join(self.root_dir, segment)
+        return {
+            col: np.load(os.path.join(directory, f'{col}.npy'), mmap_mode=mmap_mode)
+            for col in ['date'] + METRIC_COLUMNS
+        }
+
+    def read_columns(self, start=None, end=None, mmap_mode='r'):
+        """
+        Чтение колонок за диапазон дат без разбора всей истории:
+        в каждом сегменте границы находятся бинарным поиском по дате.
+
+        Args:
+            start (str, optional): Начальная дата включительно (YYYY-MM-DD).
+            end (str, optional): Конечная дата включительно (YYYY-MM-DD).
+            mmap_mode (str | None): Режим memory map для сегментов.
+
+        Returns:
+            dict: Словарь {колонка: np.ndarray}, отсортированный по дате.
+                Если данные лежат в одном сегменте без журнала, массивы
+                являются представлениями memory map без копирования.
+        """
+        start = np.datetime64(start, 'D') if start is not None else None
+        end = np.datetime64(end, 'D') if end is not None else None
+        with self.locked():
+            parts = [self._read_segment(name, mmap_mode) for name in self._manifest['segments']]
+            parts.append(self._read_log())
+        sliced = []
+        for part in parts:
+            dates = part['date']
+            lo = np.searchsorted(dates, start, side='left') if start is not None else 0
+            hi = np.searchsorted(dates, end, side='right') if end is not None else len(dates)
+            sliced.append({col: values[lo:hi] for col, values in part.items()})
+        return merge_columns(sliced)
+
+    def load_columns(self, start=None, end=None, compact=True):
+        """
+        Колонки для обучения в виде memory-mapped массивов без копирования.
+
+        Если помимо сегмента есть журнал или несколько сегментов, хранилище
+        предварительно сжимается, чтобы вся история лежала в одном
+        сегменте и ее не приходилось склеивать в памяти.
+
+        Args:
+            start (str, optional): Начальная дата включительно (YYYY-MM-DD).
+            end (str, optional): Конечная дата включительно (YYYY-MM-DD).
+            compact (bool): Сжимать ли хранилище перед чтением.
+
+        Returns:
+            dict: Словарь {колонка: np.ndarray} для
+                AdMetricsPredictor.create_features_from_arrays.
+        """
+        with self.locked():
+            if compact and (len(self._manifest['segments']) > 1 or self.log_rows()):
+                self.compact()
+            return self.read_columns(start, end, mmap_mode='r')
+
+    def read_frame(self, start=None, end=None):
+        """Диапазон истории в виде pandas DataFrame."""
+        columns = self.read_columns(start, end)
+        frame = pd.DataFrame({col: columns[col] for col in ['date'] + METRIC_COLUMNS}, copy=False)
+        frame['date'] = frame['date'].astype('datetime64[ns]')
+        return frame
+
+    def read_records(self, start=None, end=None):
+        """Диапазон истории в виде списка словарей (формат historical_data.json)."""
+        return columns_to_records(self.read_columns(start, end))
+
+    def tail(self, n):
+        """
+        Последние n строк истории в виде списка словарей. Читаются только
+        хвосты сегментов и журнала, а не вся история.
+        """
+        if n <= 0:
+            return []
+        with self.locked():
+            parts = [self._read_segment(name, 'r') for name in self._manifest['segments']]
+            parts.append(self._read_log())
+        merged = merge_columns([{col: values[-n:] for col, values in part.items()} for part in parts])
+        return columns_to_records({col: values[-n:] for col, values in merged.items()})
+
+    def __len__(self):
+        return len(self.read_columns()['date'])
+
+    @staticmethod
+    def _export_json(columns, filepath):
+        """Атомарная выгрузка колонок в JSON-файл; возвращает отпечаток файла."""
+        tmp_path = f'{filepath}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(columns_to_records(columns), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+        return _file_stamp(filepath)
+
+    def json_is_stale(self, filepath):
+        """
+        Был ли JSON-файл изменен в обход хранилища (после последнего
+        импорта или выгрузки).
+        """
+        with self.locked():
+            return os.path.exists(filepath) and _file_stamp(filepath) != self._manifest.get('json_stamp')
+
+    def reset(self):
+        """Удаление всей истории хранилища."""
+        with self.locked():
+            generation = self._manifest['generation'] + 1
+            log_file = f'log-{generation}.jsonl'
+            open(os.path.join(self.root_dir, log_file), 'a').close()
+            self._publish(generation, [], log_file)
+            self._log_columns = empty_columns()
+            self._log_size = 0
+
+    def import_json(self, filepath):
+        """Импорт файла historical_data.json в хранилище одним сегментом."""
+        with open(filepath, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+        with self.locked():
+            self.append_columns(rows_to_columns(rows))
+            self._commit_manifest(self._manifest['generation'], self._manifest['segments'],
+                                  self._manifest['log_file'], _file_stamp(filepath))
+        return len(rows)
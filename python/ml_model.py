@@ -2,32 +2,426 @@
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor, BaseEnsemble
+from sklearn.linear_model import Ridge
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error
+from sklearn.metrics import mean_absolute_error, r2_score
+import copy
 import json
 import joblib
 import os
 import logging
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from history_storage import HistoryStorage, METRIC_COLUMNS
+from compiled_forest import (FOREST_TYPES, CompiledForest, compile_models, forest_mean, tree_predictions,
+                             tree_quantiles)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Целевые метрики, для каждой из которых обучается отдельная модель
+TARGET_COLUMNS = ['ctr', 'cr', 'cpc', 'spend']
+# Окна скользящих средних и ряды, для которых они считаются
+MA_WINDOWS = [7, 14]
+MA_SERIES = ['ctr', 'spend', 'cr']
+# Режимы выполнения обучения моделей для разных метрик
+EXECUTION_MODES = ('sequential', 'threads', 'processes')
+# Способ выделения проверочной выборки при обучении: случайный или последние дни
+VALIDATION_MODES = ('random', 'time')
+# Доля проверочной выборки
+VALIDATION_SIZE = 0.2
+# Движки моделей: отдельная модель на метрику или одна модель на все метрики
+ENGINES = ('separate', 'multioutput')
+# Ключ единственной модели в self.models для движка 'multioutput'
+MULTIOUTPUT_KEY = 'multioutput'
+# Формат артефакта модели (см. AdMetricsPredictor.save_model)
+ARTIFACT_SCHEMA_VERSION = 1
+ARTIFACT_CURRENT_FILE = 'CURRENT'
+ARTIFACT_META_FILE = 'meta.json'
+# Директория с отдельным файлом на каждую модель
+ARTIFACT_MODELS_DIR = 'models'
+# Упакованный лес (см. compiled_forest), который загружается через memory map
+ARTIFACT_FOREST_DIR = 'forest'
+ARTIFACT_KEEP_VERSIONS = 2
+# Попытки загрузки, если версию удалили между чтением CURRENT и открытием ее файлов
+ARTIFACT_LOAD_ATTEMPTS = 3
+# Максимальное число точек кривой обучения ансамбля в training_stats
+LOSS_CURVE_POINTS = 50
+# Способ вычисления предсказаний: predict моделей sklearn или упакованный лес
+# (см. compiled_forest); упакованный лес используется для матриц до COMPILED_MAX_ROWS строк.
+# Модель, загруженная из артефакта, предсказывает лесом из артефакта при любом способе
+INFERENCE_ENGINES = ('sklearn', 'compiled')
+COMPILED_MAX_ROWS = 256
+# Режимы обучения: полное, дообучение новыми деревьями или выбор по дрейфу MAE
+TRAIN_MODES = ('full', 'incremental', 'auto')
+# Дообучение: доля деревьев леса, заменяемых новыми, и окно последних дней,
+# на которых обучаются новые деревья
+INCREMENTAL_TREE_FRACTION = 0.2
+INCREMENTAL_WINDOW_DAYS = 90
+# После стольких дообучений подряд выполняется полное обучение
+# (к этому моменту заменено 80% деревьев)
+INCREMENTAL_MAX_UPDATES = 4
+# Полное обучение, если MAE на новых днях больше MAE проверки во столько раз
+DRIFT_THRESHOLD = 1.5
+# Минимальное число новых строк для оценки дрейфа
+DRIFT_MIN_ROWS = 7
+# Квантили нижней и верхней границы интервала предсказания
+INTERVAL_QUANTILES = (0.1, 0.9)
+# Колонка кампании в признаках портфеля и число кампаний в одном пакете предсказания
+PORTFOLIO_KEY = 'campaign_id'
+PORTFOLIO_CHUNK_SIZE = 500
+
+def _random_forest_backend(n_jobs, multioutput, **params):
+    """Случайный лес (поддерживает несколько выходов напрямую)."""
+    params = {'n_estimators': 100, 'random_state': 42, **params}
+    return RandomForestRegressor(n_jobs=n_jobs, **params)
+
+def _hist_gradient_boosting_backend(n_jobs, multioutput, **params):
+    """Гистограммный градиентный бустинг; для нескольких выходов - по модели на выход."""
+    params = {'random_state': 42, **params}
+    if multioutput:
+        return MultiOutputRegressor(HistGradientBoostingRegressor(**params), n_jobs=n_jobs)
+    return HistGradientBoostingRegressor(**params)
+
+def _ridge_backend(n_jobs, multioutput, **params):
+    """Линейный базовый уровень: стандартизация признаков и гребневая регрессия."""
+    params = {'alpha': 1.0, **params}
+    return make_pipeline(StandardScaler(), Ridge(**params))
+
+# Реестр бэкендов моделей: имя -> фабрика factory(n_jobs, multioutput, **params)
+ESTIMATOR_BACKENDS = {
+    'random_forest': _random_forest_backend,
+    'hist_gradient_boosting': _hist_gradient_boosting_backend,
+    'ridge': _ridge_backend
+}
+
+def register_backend(name, factory):
+    """
+    Регистрация бэкенда модели.
+    
+    Args:
+        name (str): Имя бэкенда для параметра backend в AdMetricsPredictor.
+        factory (callable): Фабрика factory(n_jobs, multioutput, **params),
+            возвращающая несобранный sklearn-совместимый регрессор.
+    """
+    ESTIMATOR_BACKENDS[name] = factory
+
+def _measure_latency(model, X_row, repeats=5):
+    """Задержка предсказания одной строки (медиана, мс)."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(X_row)
+        latencies.append(time.perf_counter() - start)
+    return round(float(np.median(latencies)) * 1000, 4)
+
+def _fit_target(target, model, X_train, y_train, X_test, y_test):
+    """
+    Обучение и оценка модели для одной метрики. Вынесено на уровень модуля,
+    чтобы функцию можно было выполнять в пуле процессов.
+    
+    Returns:
+        tuple: (target, обученная модель, оценки - см. _validation_scores)
+    """
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    predict_time = time.perf_counter() - start
+    return target, model, _validation_scores(y_test, y_pred, fit_time, predict_time)
+
+def _validation_scores(y_true, y_pred, fit_time, predict_time):
+    """
+    Оценки модели одной метрики на проверочной выборке.
+    
+    Returns:
+        dict: MAE, R2 (None, если в выборке меньше двух строк), квантили
+            INTERVAL_QUANTILES остатков (факт - предсказание), время обучения
+            и время предсказания проверочной выборки в секундах.
+    """
+    residuals = np.asarray(y_true, dtype=float) - np.asarray(y_pred, dtype=float)
+    return {
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'r2': float(r2_score(y_true, y_pred)) if len(y_true) > 1 else None,
+        'residual_interval': [float(q) for q in np.quantile(residuals, INTERVAL_QUANTILES)],
+        'fit_time': fit_time,
+        'predict_time': predict_time
+    }
+
+def _staged_predictions(model, X):
+    """
+    Предсказания ансамбля по мере добавления деревьев (усредняющие ансамбли,
+    например случайный лес) или итераций (бустинг).
+    
+    Yields:
+        np.ndarray: Предсказание после очередной стадии. Для моделей
+            без стадий (линейные модели) ничего не выдается.
+    """
+    if hasattr(model, 'staged_predict'):
+        yield from model.staged_predict(X)
+    elif isinstance(model, MultiOutputRegressor):
+        for stage in zip(*(_staged_predictions(estimator, X) for estimator in model.estimators_)):
+            yield np.column_stack(stage)
+    elif isinstance(model, BaseEnsemble):
+        # Деревья леса обучены на массиве, поэтому имена признаков не нужны
+        X_array = np.asarray(X, dtype=np.float32)
+        total = None
+        for stage, estimator in enumerate(model.estimators_, start=1):
+            prediction = estimator.predict(X_array)
+            total = prediction if total is None else total + prediction
+            yield total / stage
+
+def _loss_curve(staged, y_true, transform=None):
+    """
+    MAE проверочной выборки по стадиям ансамбля, прореженная до LOSS_CURVE_POINTS точек.
+    
+    Args:
+        staged (iterable): Предсказания по стадиям (см. _staged_predictions).
+        y_true (np.ndarray): Истинные значения формы (n,) или (n, k).
+        transform (callable, optional): Перевод предсказания в масштаб y_true.
+        
+    Returns:
+        list | None: Для каждого столбца y_true - {'stages': номера стадий,
+            'mae': MAE на этих стадиях}; None для моделей без стадий.
+    """
+    y_true = np.asarray(y_true, dtype=float).reshape(len(y_true), -1)
+    errors = np.array([
+        np.abs(np.reshape(transform(pred) if transform else pred, y_true.shape) - y_true).mean(axis=0)
+        for pred in staged
+    ])
+    if not len(errors):
+        return None
+    stages = np.unique(np.linspace(1, len(errors), min(LOSS_CURVE_POINTS, len(errors))).round().astype(int))
+    return [{'stages': stages.tolist(), 'mae': errors[stages - 1, i].tolist()} for i in range(y_true.shape[1])]
+
+def _feature_importances(model):
+    """
+    Важность признаков модели: feature_importances_ деревьев или нормированные
+    модули коэффициентов линейной модели (признаки стандартизованы).
+    
+    Returns:
+        np.ndarray | None: Важности, нормированные на единицу, или None.
+    """
+    importances = getattr(model, 'feature_importances_', None)
+    if importances is None and isinstance(model, MultiOutputRegressor):
+        parts = [_feature_importances(estimator) for estimator in model.estimators_]
+        importances = np.mean(parts, axis=0) if parts and all(p is not None for p in parts) else None
+    if importances is None and hasattr(model, 'steps'):
+        coef = getattr(model.steps[-1][1], 'coef_', None)
+        importances = np.abs(coef).reshape(-1, coef.shape[-1]).mean(axis=0) if coef is not None else None
+    if importances is None:
+        return None
+    importances = np.asarray(importances, dtype=float)
+    total = importances.sum()
+    return importances / total if total > 0 else importances
+
+def _mean_importance(importance_by_model):
+    """Важность признаков, усредненная по моделям, по убыванию важности."""
+    if not importance_by_model:
+        return {}
+    features = next(iter(importance_by_model.values()))
+    mean = {feature: round(float(np.mean([part.get(feature, 0.0) for part in importance_by_model.values()])), 6)
+            for feature in features}
+    return dict(sorted(mean.items(), key=lambda item: item[1], reverse=True))
+
+def _replace_oldest_trees(model, X, y, update_number):
+    """
+    Замена самых старых деревьев леса новыми, обученными на (X, y).
+    
+    Новые деревья добавляются через warm_start в конец estimators_, после чего
+    столько же деревьев удаляется из начала, так что размер леса не меняется.
+    Зерно генератора меняется с каждым дообучением, иначе новые деревья
+    получали бы одни и те же случайные подвыборки.
+    
+    Returns:
+        int: Число замененных деревьев.
+    """
+    n_trees = len(model.estimators_)
+    n_new = max(1, int(round(n_trees * INCREMENTAL_TREE_FRACTION)))
+    params = model.get_params()
+    base_seed = params['random_state'] if isinstance(params['random_state'], (int, np.integer)) else 0
+    seed = base_seed + update_number * n_trees
+    model.set_params(warm_start=True, n_estimators=n_trees + n_new, random_state=seed)
+    try:
+        model.fit(X, y)
+    finally:
+        model.set_params(warm_start=params['warm_start'], n_estimators=n_trees,
+                         random_state=params['random_state'])
+    model.estimators_ = model.estimators_[n_new:]
+    return n_new
+
+class TrainingCancelled(Exception):
+    """Обучение было отменено до завершения."""
+
+def build_base_features(df, key=None):
+    """
+    Построчные признаки: разбор дат, сортировка, числовые метрики,
+    производные показатели и календарные признаки.
+    
+    Args:
+        df (pd.DataFrame): Сырые исторические данные.
+        key (str, optional): Колонка с идентификатором кампании, если в df
+            истории нескольких кампаний. Строки группируются по кампаниям
+            (в порядке первого появления) и сортируются по дате внутри кампании.
+        
+    Returns:
+        pd.DataFrame: DataFrame, отсортированный по дате, с построчными признаками.
+    """
+    df['date'] = pd.to_datetime(df['date'])
+    if key is None:
+        # Уже отсортированные данные (например, колонки HistoryStorage) не копируем
+        if not df['date'].is_monotonic_increasing:
+            df = df.sort_values('date').reset_index(drop=True)
+    else:
+        codes, _ = pd.factorize(df[key])
+        dates = df['date'].to_numpy()
+        ordered = (codes[1:] > codes[:-1]) | ((codes[1:] == codes[:-1]) & (dates[1:] >= dates[:-1]))
+        if not ordered.all():
+            order = np.lexsort((dates, codes))
+            df = df.iloc[order].reset_index(drop=True)
+        elif not df.index.equals(pd.RangeIndex(len(df))):
+            df = df.reset_index(drop=True)
+    
+    # Преобразуем метрики в числовые значения
+    for col in METRIC_COLUMNS:
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+            
+    # Рассчитываем производные метрики
+    df['ctr'] = np.where(df['impressions'] > 0, df['clicks'] / df['impressions'], 0)
+    df['cr'] = np.where(df['clicks'] > 0, df['conversions'] / df['clicks'], 0)
+    df['cpc'] = np.where(df['clicks'] > 0, df['spend'] / df['clicks'], 0)
+    df['roas'] = np.where(df['spend'] > 0, df['revenue'] / df['spend'], 0)
+    
+    # Создаем временные признаки
+    df['day_of_week'] = df['date'].dt.dayofweek
+    df['day_of_month'] = df['date'].dt.day
+    df['month'] = df['date'].dt.month
+    return df
+
+def add_window_features(df, key=None):
+    """
+    Оконные признаки: скользящие средние и процентные изменения.
+    Значение в строке зависит только от предыдущих max(MA_WINDOWS) строк.
+    
+    Args:
+        df (pd.DataFrame): DataFrame после build_base_features.
+        key (str, optional): Колонка с идентификатором кампании: окна
+            не пересекают границы кампаний, и значения совпадают с
+            посчитанными по каждой кампании отдельно.
+        
+    Returns:
+        pd.DataFrame: Тот же DataFrame с добавленными оконными признаками.
+    """
+    if key is not None:
+        grouped = df.groupby(key, sort=False)
+        for window in MA_WINDOWS:
+            for series in MA_SERIES:
+                rolling = grouped[series].rolling(window=window, min_periods=1).mean()
+                df[f'{series}_ma_{window}'] = rolling.reset_index(level=0, drop=True)
+        df['spend_pct_change'] = grouped['spend'].pct_change().fillna(0)
+        df['impressions_pct_change'] = grouped['impressions'].pct_change().fillna(0)
+        return df
+    
+    # Создаем скользящие средние
+    for window in MA_WINDOWS:
+        df[f'ctr_ma_{window}'] = df['ctr'].rolling(window=window, min_periods=1).mean()
+        df[f'spend_ma_{window}'] = df['spend'].rolling(window=window, min_periods=1).mean()
+        df[f'cr_ma_{window}'] = df['cr'].rolling(window=window, min_periods=1).mean()
+        
+    # Создаем процентные изменения
+    df['spend_pct_change'] = df['spend'].pct_change().fillna(0)
+    df['impressions_pct_change'] = df['impressions'].pct_change().fillna(0)
+    return df
+
 class AdMetricsPredictor:
     """Класс для предсказания рекламных метрик с использованием машинного обучения."""
 
-    def __init__(self):
-        """Инициализация модели и других атрибутов."""
-        self.models = {
-            'ctr': RandomForestRegressor(n_estimators=100, random_state=42),
-            'cr': RandomForestRegressor(n_estimators=100, random_state=42),
-            'cpc': RandomForestRegressor(n_estimators=100, random_state=42),
-            'spend': RandomForestRegressor(n_estimators=100, random_state=42)
-        }
+    def __init__(self, execution='sequential', n_workers=None, tree_jobs=None, engine='separate',
+                 backend='random_forest', backend_params=None, validation='random', inference='sklearn'):
+        """
+        Инициализация модели и других атрибутов.
+        
+        Args:
+            execution (str): Режим обучения моделей метрик: 'sequential' - по очереди,
+                'threads' или 'processes' - одновременно в пуле потоков/процессов.
+            n_workers (int, optional): Число моделей метрик, обучаемых одновременно.
+                По умолчанию - min(числа метрик, числа ядер).
+            tree_jobs (int, optional): n_jobs каждого леса (параллелизм по деревьям).
+                По умолчанию ядра делятся поровну между одновременно обучаемыми моделями.
+            engine (str): 'separate' - отдельный лес для каждой метрики,
+                'multioutput' - один лес, предсказывающий все метрики сразу
+                по стандартизованным целевым переменным.
+            backend (str): Имя бэкенда модели из ESTIMATOR_BACKENDS
+                ('random_forest', 'hist_gradient_boosting', 'ridge').
+            backend_params (dict, optional): Параметры, передаваемые фабрике бэкенда.
+            validation (str): Проверочная выборка для MAE: 'random' - случайные 20% строк,
+                'time' - последние 20% дней (без утечки будущего в обучение).
+            inference (str): 'sklearn' - предсказания через predict моделей,
+                'compiled' - через упакованный лес (только для лесов; для других
+                бэкендов используется predict).
+        """
+        if backend not in ESTIMATOR_BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд '{backend}'. Доступны: {sorted(ESTIMATOR_BACKENDS)}.")
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок '{engine}'. Доступны: {ENGINES}.")
+        if validation not in VALIDATION_MODES:
+            raise ValueError(f"Неизвестный способ валидации '{validation}'. Доступны: {VALIDATION_MODES}.")
+        if execution not in EXECUTION_MODES:
+            raise ValueError(f"Неизвестный режим выполнения '{execution}'. Доступны: {EXECUTION_MODES}.")
+        if inference not in INFERENCE_ENGINES:
+            raise ValueError(f"Неизвестный способ предсказания '{inference}'. Доступны: {INFERENCE_ENGINES}.")
+        cpu_count = os.cpu_count() or 1
+        if execution == 'sequential':
+            n_workers = 1
+        elif n_workers is None:
+            n_workers = min(len(TARGET_COLUMNS), cpu_count)
+        if tree_jobs is None:
+            tree_jobs = 1 if execution == 'sequential' else max(1, cpu_count // n_workers)
+        self.execution = execution
+        self.n_workers = n_workers
+        self.tree_jobs = tree_jobs
+        self.engine = engine
+        self.backend = backend
+        self.backend_params = dict(backend_params or {})
+        self.validation = validation
+        self.inference = inference
+        # Упакованный лес и версия модели, из которой он построен (см. _compiled_forest)
+        self._compiled = (None, None)
+        # Открытые файлы моделей артефакта, которые еще не прочитаны (см. load_model)
+        self._models = None
+        self._artifact_files = None
+        self._models_lock = threading.Lock()
+        factory = ESTIMATOR_BACKENDS[backend]
+        if engine == 'multioutput':
+            # Одна модель использует весь бюджет ядер
+            self.models = {
+                MULTIOUTPUT_KEY: factory(n_workers * tree_jobs, True, **self.backend_params)
+            }
+        else:
+            self.models = {
+                target: factory(tree_jobs, False, **self.backend_params) for target in TARGET_COLUMNS
+            }
+        # Параметры стандартизации целевых переменных для движка 'multioutput'
+        self.target_scaling = None
         self.is_trained = False
+        # Идентификатор обученной модели; меняется при каждом обучении
+        self.model_version = None
         self.feature_columns = []
         self.training_stats = {}
+        # Статистика для get_stats, собранная из training_stats при первом обращении
+        self._stats = None
 
     def create_features(self, historical_data):
         """
@@ -43,50 +437,115 @@ class AdMetricsPredictor:
             raise ValueError("Исторические данные не могут быть пустыми.")
             
         # Создаем DataFrame
-        df = pd.DataFrame(historical_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date').reset_index(drop=True)
-        
-        # Преобразуем метрики в числовые значения
-        metric_columns = ['spend', 'impressions', 'clicks', 'conversions', 'revenue']
-        for col in metric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                
-        # Рассчитываем производные метрики
-        df['ctr'] = np.where(df['impressions'] > 0, df['clicks'] / df['impressions'], 0)
-        df['cr'] = np.where(df['clicks'] > 0, df['conversions'] / df['clicks'], 0)
-        df['cpc'] = np.where(df['clicks'] > 0, df['spend'] / df['clicks'], 0)
-        df['roas'] = np.where(df['spend'] > 0, df['revenue'] / df['spend'], 0)
+        df = build_base_features(pd.DataFrame(historical_data))
+        return add_window_features(df) # Не удаляем NaN здесь, чтобы сохранить все данные
+
+    def create_features_from_arrays(self, columns):
+        """
+        Создание признаков из типизированных колонок без промежуточного
+        списка словарей.
         
-        # Создаем временные признаки
-        df['day_of_week'] = df['date'].dt.dayofweek
-        df['day_of_month'] = df['date'].dt.day
-        df['month'] = df['date'].dt.month
+        Колонки (например, из HistoryStorage.load_columns) оборачиваются в
+        DataFrame без копирования, поэтому memory-mapped массивы не читаются
+        в память целиком - копируются только вычисляемые признаки.
         
-        # Создаем скользящие средние
-        for window in [7, 14]:
-            df[f'ctr_ma_{window}'] = df['ctr'].rolling(window=window, min_periods=1).mean()
-            df[f'spend_ma_{window}'] = df['spend'].rolling(window=window, min_periods=1).mean()
-            df[f'cr_ma_{window}'] = df['cr'].rolling(window=window, min_periods=1).mean()
+        Args:
+            columns (dict): Словарь {'date': массив datetime64, метрика: массив float}
+                с колонками date, spend, impressions, clicks, conversions, revenue.
             
-        # Создаем процентные изменения
-        df['spend_pct_change'] = df['spend'].pct_change().fillna(0)
-        df['impressions_pct_change'] = df['impressions'].pct_change().fillna(0)
+        Returns:
+            pd.DataFrame: DataFrame с признаками и целевыми переменными.
+        """
+        missing = [col for col in ['date'] + METRIC_COLUMNS if col not in columns]
+        if missing:
+            raise ValueError(f"Отсутствуют колонки исторических данных: {missing}.")
+        if not len(columns['date']):
+            raise ValueError("Исторические данные не могут быть пустыми.")
+        df = pd.DataFrame({col: columns[col] for col in ['date'] + METRIC_COLUMNS}, copy=False)
+        return add_window_features(build_base_features(df))
+
+    def build_features(self, historical_data):
+        """
+        Признаки истории в любом из форматов, которые принимают train и
+        predict_next_days: готовый DataFrame (например, из FeatureCache)
+        используется как есть, словарь колонок обрабатывается через
+        create_features_from_arrays, список словарей - через create_features.
         
-        return df # Не удаляем NaN здесь, чтобы сохранить все данные
+        Args:
+            historical_data (list | dict | pd.DataFrame): История кампании.
+            
+        Returns:
+            pd.DataFrame: DataFrame с признаками и целевыми переменными.
+        """
+        if isinstance(historical_data, pd.DataFrame):
+            if historical_data.empty:
+                raise ValueError("Исторические данные не могут быть пустыми.")
+            return historical_data
+        if isinstance(historical_data, dict):
+            return self.create_features_from_arrays(historical_data)
+        return self.create_features(historical_data)
+
+    def create_portfolio_features(self, histories):
+        """
+        Признаки для историй многих кампаний за один векторный проход:
+        истории объединяются в один DataFrame, а оконные признаки считаются
+        по группам кампаний.
+        
+        Args:
+            histories (dict): {campaign_id: история} - список словарей, словарь
+                колонок (см. create_features_from_arrays) или готовый DataFrame
+                с признаками (используется как есть).
+                
+        Returns:
+            pd.DataFrame: Признаки всех кампаний с колонкой PORTFOLIO_KEY; строки
+                сгруппированы по кампаниям в порядке histories и отсортированы
+                по дате внутри кампании.
+        """
+        rows, row_keys, column_parts, ready_parts = [], [], [], []
+        for campaign_id, history in histories.items():
+            if len(history) == 0:
+                raise ValueError(f"Исторические данные кампании '{campaign_id}' не могут быть пустыми.")
+            if isinstance(history, pd.DataFrame):
+                ready_parts.append(history.assign(**{PORTFOLIO_KEY: campaign_id}))
+            elif isinstance(history, dict):
+                missing = [col for col in ['date'] + METRIC_COLUMNS if col not in history]
+                if missing:
+                    raise ValueError(f"Отсутствуют колонки исторических данных кампании '{campaign_id}': {missing}.")
+                part = pd.DataFrame({col: history[col] for col in ['date'] + METRIC_COLUMNS})
+                column_parts.append(part.assign(**{PORTFOLIO_KEY: campaign_id}))
+            else:
+                rows.extend(history)
+                row_keys.extend([campaign_id] * len(history))
+                
+        raw_parts = column_parts
+        if rows:
+            raw_parts = [pd.DataFrame(rows).assign(**{PORTFOLIO_KEY: row_keys})] + column_parts
+        parts = list(ready_parts)
+        if raw_parts:
+            raw = raw_parts[0] if len(raw_parts) == 1 else pd.concat(raw_parts, ignore_index=True)
+            parts.append(add_window_features(build_base_features(raw, key=PORTFOLIO_KEY), key=PORTFOLIO_KEY))
+        df = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+        
+        # Возвращаем кампании в порядке histories (стабильная сортировка сохраняет порядок дат)
+        position = pd.Series(range(len(histories)), index=list(histories))
+        order = position.reindex(df[PORTFOLIO_KEY]).to_numpy()
+        if (np.diff(order) < 0).any():
+            df = df.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+        return df
 
     def prepare_data_for_training(self, historical_data):
         """
         Подготовка данных для обучения.
         
         Args:
-            historical_data (list): Список словарей с историческими данными.
+            historical_data (list | dict | pd.DataFrame): Список словарей с историческими
+                данными, словарь колонок (см. create_features_from_arrays)
+                или готовый DataFrame с признаками.
             
         Returns:
             tuple: (X, y) - признаки и целевые переменные.
         """
-        df = self.create_features(historical_data)
+        df = self.build_features(historical_data)
         
         # Признаки (X) - все колонки кроме целевых и даты
         feature_columns = [col for col in df.columns if col not in ['ctr', 'cr', 'cpc', 'spend', 'date', 'revenue', 'clicks', 'impressions', 'conversions']]
@@ -99,167 +558,1142 @@ class AdMetricsPredictor:
         # Целевые переменные (y)
         y = df[['ctr', 'cr', 'cpc', 'spend']]
         
-        # Удаляем строки с NaN в признаках или целях
+        # Удаляем строки с NaN в признаках или целях (без копирования, если таких строк нет)
         mask = X.notna().all(axis=1) & y.notna().all(axis=1)
-        X = X[mask]
-        y = y[mask]
+        if not mask.all():
+            X = X[mask]
+            y = y[mask]
         
         if X.empty:
             raise ValueError("Нет данных для обучения после очистки.")
             
         return X, y
 
-    def train(self, historical_data):
+    def train(self, historical_data, progress_callback=None, cancel_event=None, mode='full'):
         """
         Обучение модели на исторических данных.
         
+        При отмене модели остаются частично обученными, поэтому фоновое
+        обучение следует выполнять на отдельном экземпляре предиктора
+        (для дообучения - на копии рабочей модели, см. clone).
+        
         Args:
-            historical_data (list): Список словарей с историческими данными.
+            historical_data (list | dict | pd.DataFrame): Список словарей с историческими
+                данными, словарь колонок (см. create_features_from_arrays)
+                или готовый DataFrame с признаками.
+            progress_callback (callable, optional): Вызывается как
+                progress_callback(target, completed, total) после обучения
+                модели для каждой метрики.
+            cancel_event (threading.Event, optional): Если событие установлено,
+                обучение прерывается исключением TrainingCancelled перед
+                следующей метрикой.
+            mode (str): 'full' - обучение всех моделей заново; 'incremental' -
+                дообучение обученных лесов (см. _train_incremental); 'auto' -
+                дообучение, если MAE на новых днях не ушла от MAE проверки
+                (см. _choose_train_mode), иначе полное обучение.
         """
-        if not historical_data:
+        if mode not in TRAIN_MODES:
+            raise ValueError(f"Неизвестный режим обучения '{mode}'. Доступны: {TRAIN_MODES}.")
+        if len(historical_data) == 0:
             raise ValueError("Для обучения необходимы исторические данные.")
             
+        features = self.build_features(historical_data)
+        reason, drift = 'запрошено полное обучение', None
+        if mode != 'full':
+            decision, reason, drift = self._choose_train_mode(features, mode)
+            if decision == 'incremental':
+                self._train_incremental(features, reason, drift, progress_callback, cancel_event)
+                return
+            logger.info(f"Вместо дообучения выполняется полное обучение: {reason}.")
+            
         logger.info(f"Начало обучения модели на {len(historical_data)} точках данных...")
         
         # Подготовка данных
-        X, y = self.prepare_data_for_training(historical_data)
+        X, y = self.prepare_data_for_training(features)
         
         # Разделение на обучающую и тестовую выборки
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        if self.validation == 'time':
+            # Строки отсортированы по дате: проверяем на последних днях
+            split = len(X) - int(np.ceil(len(X) * VALIDATION_SIZE))
+            X_train, X_test, y_train, y_test = X.iloc[:split], X.iloc[split:], y.iloc[:split], y.iloc[split:]
+        else:
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=VALIDATION_SIZE, random_state=42)
         
         # Обучение моделей для каждой метрики
         mae_scores = {}
-        for target in ['ctr', 'cr', 'cpc', 'spend']:
-            logger.info(f"Обучение модели для {target}...")
-            self.models[target].fit(X_train, y_train[target])
+        r2_scores = {}
+        residual_intervals = {}
+        fit_times = {}
+        predict_times = {}
+        train_start = time.perf_counter()
+        for completed, (target, model, scores) in enumerate(
+                self._fit_targets(X_train, X_test, y_train, y_test, cancel_event), start=1):
+            self.models[target if self.engine == 'separate' else MULTIOUTPUT_KEY] = model
+            mae_scores[target] = scores['mae']
+            r2_scores[target] = scores['r2']
+            residual_intervals[target] = scores['residual_interval']
+            fit_times[target] = round(scores['fit_time'], 4)
+            predict_times[target] = round(scores['predict_time'], 4)
+            logger.info(f"MAE для {target}: {scores['mae']:.6f} (обучение {scores['fit_time']:.2f} с)")
+            if progress_callback is not None:
+                progress_callback(target, completed, len(TARGET_COLUMNS))
+            
+        train_wall_time = time.perf_counter() - train_start
+        
+        # Задержка предсказания одной строки каждой моделью; размер моделей
+        # записывается при сохранении (см. save_model)
+        X_row = X_test.iloc[:1] if len(X_test) else X_train.iloc[:1]
+        inference_latency = {name: _measure_latency(model, X_row) for name, model in self.models.items()}
             
-            # Оценка точности
-            y_pred = self.models[target].predict(X_test)
-            mae = mean_absolute_error(y_test[target], y_pred)
-            mae_scores[target] = mae
-            logger.info(f"MAE для {target}: {mae:.6f}")
+        # Кривые обучения ансамблей и важность признаков для графиков и статистики
+        loss_curve = self._loss_curves(X_test, y_test) if len(X_test) else {}
+        feature_importance_by_model = self._feature_importance()
             
         self.is_trained = True
+        self.model_version = uuid.uuid4().hex
         self.training_stats = {
             'data_points': len(historical_data),
             'train_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'accuracy': mae_scores
+            'accuracy': mae_scores,
+            'r2': r2_scores,
+            'residual_interval': residual_intervals,
+            # Источник границ интервалов предсказания (см. predict_matrix)
+            'interval_method': ('trees' if all(isinstance(model, FOREST_TYPES) for model in self.models.values())
+                                else 'residuals'),
+            'fit_time': fit_times,
+            'validation_predict_time': predict_times,
+            'validation_size': len(X_test),
+            'train_wall_time': round(train_wall_time, 4),
+            'execution': {'mode': self.execution, 'n_workers': self.n_workers, 'tree_jobs': self.tree_jobs},
+            'engine': self.engine,
+            'backend': self.backend,
+            'backend_params': self.backend_params,
+            'validation': self.validation,
+            'inference_latency_ms': inference_latency,
+            'model_size_bytes': {},
+            'loss_curve': loss_curve,
+            'feature_importance': _mean_importance(feature_importance_by_model),
+            'feature_importance_by_model': feature_importance_by_model,
+            # Последняя дата обучающих данных: строки после нее - новые для дообучения
+            'last_date': pd.to_datetime(features['date']).max().strftime('%Y-%m-%d'),
+            'update': {
+                'mode': 'full',
+                'reason': reason,
+                'drift': drift,
+                'updates_since_full': 0,
+                'full_train_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
         }
+        self._stats = None
         
         logger.info("Обучение модели завершено успешно.")
 
-    def predict_next_days(self, historical_data, days_ahead=7):
+    def clone(self):
+        """
+        Копия предиктора с копиями обученных моделей: дообучение копии
+        не меняет модель, которая продолжает обслуживать запросы.
+        
+        Returns:
+            AdMetricsPredictor: Независимая копия.
+        """
+        other = AdMetricsPredictor(execution=self.execution, n_workers=self.n_workers, tree_jobs=self.tree_jobs,
+                                   engine=self.engine, backend=self.backend, backend_params=self.backend_params,
+                                   validation=self.validation, inference=self.inference)
+        if self.is_trained:
+            other.models = self._copy_models()
+            other.is_trained = True
+            other.model_version = self.model_version
+            other.feature_columns = list(self.feature_columns)
+            other.target_scaling = copy.deepcopy(self.target_scaling)
+            other.training_stats = copy.deepcopy(self.training_stats)
+        return other
+
+    def _choose_train_mode(self, features, mode):
+        """
+        Выбор между дообучением и полным обучением.
+        
+        Дообучение возможно только для обученных лесов со статистикой прошлого
+        обучения. В режиме 'auto' полное обучение выбирается также, если новых
+        дней нет или их больше половины истории, если подряд выполнено
+        INCREMENTAL_MAX_UPDATES дообучений или если MAE модели на новых днях
+        превышает MAE проверки при последнем полном обучении больше чем в
+        DRIFT_THRESHOLD раз (см. _mae_drift).
+        
+        Args:
+            features (pd.DataFrame): Признаки всей истории.
+            mode (str): 'incremental' или 'auto'.
+            
+        Returns:
+            tuple: ('incremental' | 'full', причина, дрейф - см. _mae_drift, или None).
+        """
+        if not self.is_trained:
+            return 'full', 'модель еще не обучена', None
+        stats = self.training_stats
+        if not stats.get('last_date') or not stats.get('accuracy'):
+            return 'full', 'нет статистики прошлого обучения', None
+        if any(col not in features.columns for col in self.feature_columns):
+            return 'full', 'изменился набор признаков', None
+        if not all(isinstance(model, FOREST_TYPES) for model in self.models.values()):
+            return 'full', f"бэкенд '{self.backend}' не поддерживает дообучение", None
+            
+        new_rows = features[pd.to_datetime(features['date']) > pd.Timestamp(stats['last_date'])]
+        drift = self._mae_drift(new_rows)
+        if mode == 'incremental':
+            return 'incremental', 'запрошено дообучение', drift
+        if new_rows.empty:
+            return 'full', 'нет новых данных', drift
+        if len(new_rows) * 2 > len(features):
+            return 'full', 'новых данных больше половины истории', drift
+        if stats.get('update', {}).get('updates_since_full', 0) >= INCREMENTAL_MAX_UPDATES:
+            return 'full', f'выполнено {INCREMENTAL_MAX_UPDATES} дообучений подряд', drift
+        ratio = drift['ratio']
+        if ratio and max(ratio.values()) > DRIFT_THRESHOLD:
+            worst = max(ratio, key=ratio.get)
+            return 'full', f'дрейф MAE {worst}: в {ratio[worst]:.2f} раза выше проверки', drift
+        return 'incremental', 'дрейф MAE в пределах порога', drift
+
+    def _mae_drift(self, new_rows):
+        """
+        Дрейф ошибки с последнего полного обучения.
+        
+        Перед каждым дообучением текущая модель предсказывает новые, еще не
+        виденные ею строки; абсолютные ошибки накапливаются от дообучения к
+        дообучению, поэтому дрейф оценивается и при ежедневном добавлении
+        одного дня. MAE накопленных строк сравнивается с MAE проверочной
+        выборки последнего полного обучения.
+        
+        Returns:
+            dict: rows - число накопленных строк, abs_error - {метрика: сумма
+                абсолютных ошибок}, ratio - {метрика: отношение MAE к MAE
+                проверки} или None, если строк меньше DRIFT_MIN_ROWS.
+        """
+        previous = self.training_stats.get('update') or {}
+        previous_drift = previous.get('drift') if previous.get('mode') == 'incremental' else None
+        rows = previous_drift['rows'] if previous_drift else 0
+        abs_error = dict(previous_drift['abs_error']) if previous_drift else {}
+        new_rows = new_rows.dropna(subset=self.feature_columns + TARGET_COLUMNS)
+        if len(new_rows):
+            predictions = self.predict_matrix(new_rows[self.feature_columns].to_numpy(dtype=float))
+            for target in TARGET_COLUMNS:
+                errors = np.abs(new_rows[target].to_numpy(dtype=float) - predictions[target])
+                abs_error[target] = abs_error.get(target, 0.0) + float(errors.sum())
+            rows += len(new_rows)
+        ratio = None
+        if rows >= DRIFT_MIN_ROWS:
+            baseline = self.training_stats['accuracy']
+            ratio = {target: round(abs_error[target] / rows / baseline[target], 4)
+                     for target in TARGET_COLUMNS if baseline.get(target)}
+        return {'rows': rows, 'abs_error': abs_error, 'ratio': ratio}
+
+    def _train_incremental(self, features, reason, drift, progress_callback=None, cancel_event=None):
+        """
+        Дообучение лесов: в каждый лес добавляется INCREMENTAL_TREE_FRACTION
+        новых деревьев (warm_start), обученных на последних INCREMENTAL_WINDOW_DAYS
+        днях, а столько же самых старых деревьев удаляется. Признаки берутся
+        из переданного DataFrame (например, из FeatureCache), поэтому заново
+        вычисляются только признаки новых строк. Стандартизация целевых
+        переменных движка 'multioutput' сохраняется от полного обучения.
+        """
+        start = time.perf_counter()
+        dates = pd.to_datetime(features['date'])
+        recent = features[dates > dates.max() - pd.Timedelta(days=INCREMENTAL_WINDOW_DAYS)]
+        X, y = self.prepare_data_for_training(recent)
+        previous = self.training_stats.get('update', {})
+        update_number = previous.get('updates_since_full', 0) + 1
+        logger.info(f"Дообучение модели на {len(X)} последних строках ({reason})...")
+        
+        replaced = {}
+        completed = 0
+        for key, model in self.models.items():
+            if cancel_event is not None and cancel_event.is_set():
+                raise TrainingCancelled("Обучение отменено.")
+            if key == MULTIOUTPUT_KEY:
+                mean = np.asarray(self.target_scaling['mean'])
+                scale = np.asarray(self.target_scaling['scale'])
+                targets = (y[TARGET_COLUMNS].to_numpy() - mean) / scale
+            else:
+                targets = y[key]
+            replaced[key] = _replace_oldest_trees(model, X, targets, update_number)
+            for target in (TARGET_COLUMNS if key == MULTIOUTPUT_KEY else [key]):
+                completed += 1
+                if progress_callback is not None:
+                    progress_callback(target, completed, len(TARGET_COLUMNS))
+                    
+        feature_importance_by_model = self._feature_importance()
+        fit_time = time.perf_counter() - start
+        self.model_version = uuid.uuid4().hex
+        self.training_stats = dict(
+            self.training_stats,
+            data_points=len(features),
+            train_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            last_date=dates.max().strftime('%Y-%m-%d'),
+            feature_importance=_mean_importance(feature_importance_by_model),
+            feature_importance_by_model=feature_importance_by_model,
+            update={
+                'mode': 'incremental',
+                'reason': reason,
+                'drift': drift,
+                'updates_since_full': update_number,
+                'full_train_date': previous.get('full_train_date'),
+                'fit_rows': len(X),
+                'replaced_trees': replaced,
+                'fit_time': round(fit_time, 4)
+            }
+        )
+        self._stats = None
+        logger.info(f"Дообучение завершено за {fit_time:.2f} с: заменено деревьев {replaced}.")
+
+    def _loss_curves(self, X_test, y_test):
+        """
+        MAE проверочной выборки по мере добавления деревьев/итераций для каждой метрики.
+        
+        Returns:
+            dict: {метрика: {'stages': [...], 'mae': [...]}}; метрики,
+                модели которых не являются ансамблями, пропускаются.
+        """
+        if self.engine == 'multioutput':
+            scale = np.asarray(self.target_scaling['scale'])
+            mean = np.asarray(self.target_scaling['mean'])
+            curves = _loss_curve(_staged_predictions(self.models[MULTIOUTPUT_KEY], X_test),
+                                 y_test[TARGET_COLUMNS], transform=lambda pred: pred * scale + mean)
+            return dict(zip(TARGET_COLUMNS, curves)) if curves else {}
+        curves = {}
+        for target in TARGET_COLUMNS:
+            curve = _loss_curve(_staged_predictions(self.models[target], X_test), y_test[target])
+            if curve is not None:
+                curves[target] = curve[0]
+        return curves
+
+    def _feature_importance(self):
+        """
+        Важность признаков каждой модели, сопоставленная с feature_columns.
+        
+        Returns:
+            dict: {ключ модели: {признак: важность}} по убыванию важности;
+                модели, не сообщающие важность признаков, пропускаются.
+        """
+        result = {}
+        for name, model in self.models.items():
+            importances = _feature_importances(model)
+            if importances is None or len(importances) != len(self.feature_columns):
+                continue
+            order = np.argsort(importances)[::-1]
+            result[name] = {self.feature_columns[i]: round(float(importances[i]), 6) for i in order}
+        return result
+
+    def get_stats(self):
+        """
+        Статистика обученной модели для API и дашбордов: MAE и R2 по метрикам,
+        важность признаков, время обучения и предсказания.
+        
+        Все значения вычисляются при обучении (размер моделей - при сохранении)
+        и хранятся в training_stats и в meta.json артефакта, поэтому вызов не
+        обращается к самим моделям и не загружает их с диска.
+        
+        Returns:
+            dict: Статистика модели; поля accuracy - '<метрика>_mae' и '<метрика>_r2'.
+        """
+        if self._stats is None:
+            stats = self.training_stats
+            accuracy = {}
+            for target in TARGET_COLUMNS:
+                if target in stats.get('accuracy', {}):
+                    accuracy[f'{target}_mae'] = stats['accuracy'][target]
+                if stats.get('r2', {}).get(target) is not None:
+                    accuracy[f'{target}_r2'] = stats['r2'][target]
+            self._stats = {
+                'model_trained': self.is_trained,
+                'model_version': self.model_version,
+                'last_trained': stats.get('train_date'),
+                'data_points': stats.get('data_points'),
+                'engine': self.engine,
+                'backend': self.backend,
+                'inference': self.inference,
+                'validation': stats.get('validation'),
+                'validation_size': stats.get('validation_size'),
+                'accuracy': accuracy,
+                'prediction_interval': {
+                    'quantiles': list(INTERVAL_QUANTILES),
+                    'method': stats.get('interval_method')
+                },
+                'feature_importance': stats.get('feature_importance', {}),
+                'feature_importance_by_model': stats.get('feature_importance_by_model', {}),
+                'timings': {
+                    'fit_time_s': stats.get('fit_time', {}),
+                    'validation_predict_time_s': stats.get('validation_predict_time', {}),
+                    'train_wall_time_s': stats.get('train_wall_time'),
+                    'inference_latency_ms': stats.get('inference_latency_ms', {})
+                },
+                'model_size_bytes': stats.get('model_size_bytes', {}),
+                'last_update': stats.get('update')
+            }
+        return dict(self._stats)
+
+    def _fit_targets(self, X_train, X_test, y_train, y_test, cancel_event=None):
+        """
+        Обучение моделей всех метрик в выбранном режиме выполнения.
+        
+        Yields:
+            tuple: (target, обученная модель, оценки) по мере готовности.
+        """
+        if self.engine == 'multioutput':
+            yield from self._fit_multioutput(X_train, X_test, y_train, y_test, cancel_event)
+            return
+            
+        if self.execution == 'sequential':
+            for target in TARGET_COLUMNS:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TrainingCancelled(f"Обучение отменено перед моделью для {target}.")
+                logger.info(f"Обучение модели для {target}...")
+                yield _fit_target(target, self.models[target], X_train, y_train[target], X_test, y_test[target])
+            return
+            
+        executor_class = ThreadPoolExecutor if self.execution == 'threads' else ProcessPoolExecutor
+        logger.info(f"Параллельное обучение моделей: {self.n_workers} x {self.tree_jobs} ({self.execution})...")
+        with executor_class(max_workers=self.n_workers) as executor:
+            pending = {
+                executor.submit(_fit_target, target, self.models[target],
+                                X_train, y_train[target], X_test, y_test[target])
+                for target in TARGET_COLUMNS
+            }
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                if cancel_event is not None and cancel_event.is_set():
+                    for future in pending:
+                        future.cancel()
+                    raise TrainingCancelled("Обучение отменено.")
+
+    def _fit_multioutput(self, X_train, X_test, y_train, y_test, cancel_event=None):
+        """
+        Обучение одной модели на все метрики. Целевые переменные
+        стандартизуются, чтобы метрики разного масштаба (CTR и расход)
+        одинаково влияли на критерий разбиения.
+        
+        Yields:
+            tuple: (target, модель, оценки) для каждой метрики; время
+                обучения и предсказания общее для всех метрик.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise TrainingCancelled("Обучение отменено.")
+        mean = y_train[TARGET_COLUMNS].mean().to_numpy(dtype=float, copy=True)
+        scale = y_train[TARGET_COLUMNS].std(ddof=0).to_numpy(dtype=float, copy=True)
+        scale[~(scale > 0)] = 1.0
+        self.target_scaling = {'mean': mean.tolist(), 'scale': scale.tolist()}
+        
+        logger.info("Обучение общей модели для всех метрик...")
+        model = self.models[MULTIOUTPUT_KEY]
+        start = time.perf_counter()
+        model.fit(X_train, (y_train[TARGET_COLUMNS].to_numpy() - mean) / scale)
+        fit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        y_pred = model.predict(X_test) * scale + mean
+        predict_time = time.perf_counter() - start
+        for i, target in enumerate(TARGET_COLUMNS):
+            yield target, model, _validation_scores(y_test[target], y_pred[:, i], fit_time, predict_time)
+
+    def predict_next_days(self, historical_data, days_ahead=7, recursive=False):
         """
         Предсказание метрик на несколько дней вперед.
         
+        По умолчанию используется пакетный режим: календарные признаки для всего
+        горизонта собираются в одну матрицу, и каждая модель вызывается один раз.
+        В рекурсивном режиме скользящие средние и процентные изменения
+        пересчитываются по предсказанным значениям с инкрементальным
+        обновлением окон.
+        
         Args:
-            historical_data (list): Список словарей с историческими данными.
+            historical_data (list | dict | pd.DataFrame): Список словарей с историческими
+                данными, словарь колонок (см. create_features_from_arrays)
+                или готовый DataFrame с признаками.
             days_ahead (int): Количество дней для предсказания.
+            recursive (bool): Пересчитывать ли скользящие признаки по предсказаниям.
             
         Returns:
             list: Список словарей с предсказаниями.
         """
+        df, future_dates = self._prepare_forecast(historical_data, days_ahead)
+        if len(future_dates) == 0:
+            return []
+            
+        if recursive:
+            pred_values = self._predict_recursive(df, future_dates)
+        else:
+            X_pred = self._build_forecast_matrix(df.iloc[-1], future_dates)
+            pred_values = self.predict_matrix(X_pred)
+            
+        return self.format_forecast(future_dates, pred_values)
+
+    def _prepare_forecast(self, historical_data, days_ahead):
+        """
+        Проверки и подготовка к предсказанию: признаки истории и даты горизонта.
+        
+        Args:
+            historical_data (list | dict | pd.DataFrame): История (см. predict_next_days).
+            days_ahead (int): Количество дней для предсказания.
+            
+        Returns:
+            tuple: (DataFrame с признаками, pd.DatetimeIndex дат горизонта);
+                даты пусты, если days_ahead <= 0.
+        """
         if not self.is_trained:
             raise RuntimeError("Модель не обучена. Сначала вызовите метод train().")
             
-        if not historical_data:
+        if len(historical_data) == 0:
             raise ValueError("Для предсказания необходимы исторические данные.")
             
         # Получаем последние данные и создаем признаки
-        df = self.create_features(historical_data)
+        df = self.build_features(historical_data)
         if df.empty:
             raise ValueError("Невозможно создать признаки из предоставленных исторических данных.")
             
-        # Берем последнюю строку с признаками (уже с MA, % change и т.д.)
-        last_row = df.iloc[[-1]].copy() # Используем двойные скобки для получения DataFrame
+        last_date = pd.to_datetime(df['date'].iloc[-1])
+        future_dates = pd.date_range(last_date + timedelta(days=1), periods=max(int(days_ahead), 0), freq='D')
+        return df, future_dates
+
+    def prepare_forecast_matrix(self, historical_data, days_ahead):
+        """
+        Матрица признаков горизонта предсказания (пакетный режим predict_next_days).
         
-        predictions = []
-        current_date = pd.to_datetime(last_row['date'].iloc[0])
+        Вместе с predict_matrix и format_forecast позволяет выполнить
+        predict_next_days по шагам, например объединив матрицы нескольких
+        запросов к одной модели в один вызов predict_matrix.
+        
+        Args:
+            historical_data (list | dict | pd.DataFrame): История (см. predict_next_days).
+            days_ahead (int): Количество дней для предсказания.
+            
+        Returns:
+            tuple: (np.ndarray матрицы признаков, pd.DatetimeIndex дат горизонта);
+                матрица без строк, если days_ahead <= 0.
+        """
+        df, future_dates = self._prepare_forecast(historical_data, days_ahead)
+        return self._build_forecast_matrix(df.iloc[-1], future_dates), future_dates
+
+    def _build_forecast_matrix(self, last_row, future_dates):
+        """
+        Матрица признаков для всего горизонта предсказания.
+        
+        Все строки повторяют признаки последнего дня, кроме календарных,
+        которые вычисляются сразу для всех дат.
         
-        for i in range(1, days_ahead + 1):
-            next_date = current_date + timedelta(days=i)
+        Args:
+            last_row (pd.Series): Последняя строка DataFrame с признаками.
+            future_dates (pd.DatetimeIndex): Даты горизонта предсказания.
             
-            # Создаем новую строку для предсказания
-            pred_row = last_row.copy()
-            pred_row['date'] = next_date
-            pred_row['day_of_week'] = next_date.dayofweek
-            pred_row['day_of_month'] = next_date.day
-            pred_row['month'] = next_date.month
+        Returns:
+            np.ndarray: Матрица размера (len(future_dates), len(feature_columns)).
+        """
+        base = last_row[self.feature_columns].to_numpy(dtype=float)
+        X = np.tile(base, (len(future_dates), 1))
+        return self._set_calendar_features(X, future_dates)
+
+    def _set_calendar_features(self, X, dates):
+        """Заполнение календарных признаков матрицы X (на месте) по датам ее строк."""
+        calendar = {
+            'day_of_week': dates.dayofweek,
+            'day_of_month': dates.day,
+            'month': dates.month
+        }
+        for i, col in enumerate(self.feature_columns):
+            if col in calendar:
+                X[:, i] = calendar[col]
+        return X
+
+    def predict_matrix(self, X):
+        """
+        Предсказание всех целевых метрик и границ интервалов по матрице признаков.
+        
+        Для лесов точка и интервал получаются из одних и тех же предсказаний
+        деревьев: среднее деревьев совпадает с predict леса, а квантили
+        INTERVAL_QUANTILES по деревьям дают границы. Для остальных бэкендов
+        границы - это точка плюс квантили остатков на проверочной выборке
+        (training_stats['residual_interval']).
+        
+        Args:
+            X (np.ndarray): Матрица признаков в порядке feature_columns.
+            
+        Returns:
+            dict: Словарь {метрика: np.ndarray предсказаний}, дополненный
+                границами '{метрика}_lower' и '{метрика}_upper'.
+        """
+        trees = self._tree_predictions(X)
+        if trees is None:
+            # Модели обучались на DataFrame, поэтому сохраняем имена признаков
+            X_frame = pd.DataFrame(X, columns=self.feature_columns)
+            outputs = {key: model.predict(X_frame) for key, model in self.models.items()}
+            bounds = None
+        else:
+            outputs = {key: forest_mean(values) for key, values in trees.items()}
+            bounds = {key: tree_quantiles(values, INTERVAL_QUANTILES) for key, values in trees.items()}
+            
+        if self.engine == 'multioutput':
+            scale = np.asarray(self.target_scaling['scale'])
+            mean = np.asarray(self.target_scaling['mean'])
+            values = outputs[MULTIOUTPUT_KEY] * scale + mean
+            result = {target: values[:, i] for i, target in enumerate(TARGET_COLUMNS)}
+            if bounds is not None:
+                # Масштаб положителен, поэтому квантили переводятся в исходные единицы напрямую
+                lower, upper = bounds[MULTIOUTPUT_KEY] * scale + mean
+                bounds = {target: (lower[:, i], upper[:, i]) for i, target in enumerate(TARGET_COLUMNS)}
+        else:
+            result = {target: outputs[target] for target in TARGET_COLUMNS}
+            
+        residual_interval = self.training_stats.get('residual_interval') or {}
+        for target in TARGET_COLUMNS:
+            if bounds is not None:
+                lower, upper = bounds[target]
+            elif target in residual_interval:
+                low, high = residual_interval[target]
+                lower, upper = result[target] + low, result[target] + high
+            else:
+                # Модель сохранена до появления интервалов: границы совпадают с точкой
+                lower = upper = result[target]
+            # Метрики неотрицательны
+            result[f'{target}_lower'] = np.maximum(lower, 0)
+            result[f'{target}_upper'] = np.maximum(upper, result[f'{target}_lower'])
+        return result
+
+    def _tree_predictions(self, X):
+        """
+        Предсказания каждого дерева для всех моделей: упакованным лесом
+        (см. _compiled_forest) или деревьями sklearn.
+        
+        Returns:
+            dict | None: {ключ модели: np.ndarray (деревья x строки [x выходы])};
+                None, если модели не являются лесами.
+        """
+        compiled = self._compiled_forest(len(X))
+        if compiled is not None:
+            return compiled.split(compiled.predict_trees(X))
+        trees = {}
+        for key, model in self.models.items():
+            values = tree_predictions(model, X)
+            if values is None:
+                return None
+            trees[key] = values
+        return trees
+
+    def _compiled_forest(self, n_rows=None):
+        """
+        Упакованный лес, которым вычисляются предсказания.
+        
+        Пока модели артефакта не прочитаны с диска, используется лес из
+        артефакта (см. load_model) для матриц любого размера. Иначе при
+        inference='compiled' лес строится из моделей при первом предсказании
+        и используется для матриц до COMPILED_MAX_ROWS строк.
+        
+        Args:
+            n_rows (int | None): Число строк матрицы признаков.
             
-            # Подготавливаем признаки для предсказания
-            X_pred = pred_row[self.feature_columns]
+        Returns:
+            CompiledForest | None: None, если упакованный лес не используется
+                или модели не являются лесами.
+        """
+        if not self.is_trained:
+            return None
+        version, compiled = self._compiled
+        if self._models is None and version == self.model_version:
+            return compiled
+        if self.inference != 'compiled' or (n_rows is not None and n_rows > COMPILED_MAX_ROWS):
+            return None
+        return self._pack_models()
+
+    def _pack_models(self):
+        """Упакованный лес текущей версии модели; строится один раз на версию."""
+        version, compiled = self._compiled
+        if version != self.model_version:
+            start = time.perf_counter()
+            compiled = compile_models(self.models)
+            if compiled is None:
+                logger.info(f"Бэкенд '{self.backend}' не поддерживает упакованный лес.")
+            else:
+                logger.info(f"Лес упакован за {time.perf_counter() - start:.2f} с: {compiled.n_trees} деревьев, "
+                            f"{compiled.n_nodes} узлов, {compiled.nbytes / 1024 ** 2:.1f} МБ.")
+            self._compiled = (self.model_version, compiled)
+        return compiled
+
+    def _predict_recursive(self, df, future_dates):
+        """
+        Рекурсивное предсказание с пересчетом скользящих признаков.
+        
+        Скользящие суммы окон обновляются инкрементально: новое значение
+        добавляется, а выпавшее из окна вычитается, без копирования DataFrame.
+        
+        Args:
+            df (pd.DataFrame): DataFrame с признаками из create_features.
+            future_dates (pd.DatetimeIndex): Даты горизонта предсказания.
             
-            # Делаем предсказания
-            pred_values = {}
-            for target in ['ctr', 'cr', 'cpc', 'spend']:
-                pred_values[target] = self.models[target].predict(X_pred)[0]
+        Returns:
+            dict: Словарь {метрика: np.ndarray предсказаний}.
+        """
+        max_window = max(MA_WINDOWS)
+        index = {col: i for i, col in enumerate(self.feature_columns)}
+        row = df.iloc[-1][self.feature_columns].to_numpy(dtype=float)
+        
+        # Хвосты рядов и суммы окон по последним фактическим значениям
+        history = {}
+        sums = {}
+        for series in MA_SERIES:
+            tail = df[series].to_numpy(dtype=float)[-max_window:]
+            history[series] = deque(np.nan_to_num(tail).tolist(), maxlen=max_window)
+            for window in MA_WINDOWS:
+                sums[(series, window)] = float(sum(list(history[series])[-window:]))
+        prev_spend = float(df['spend'].iloc[-1])
+        prev_impressions = float(df['impressions'].iloc[-1])
+        
+        pred_values = {}
+        for step, next_date in enumerate(future_dates):
+            for col, value in (('day_of_week', next_date.dayofweek),
+                               ('day_of_month', next_date.day),
+                               ('month', next_date.month)):
+                if col in index:
+                    row[index[col]] = value
+                    
+            step_values = self.predict_matrix(row[np.newaxis, :])
+            for key, values in step_values.items():
+                pred_values.setdefault(key, np.empty(len(future_dates)))[step] = values[0]
                 
-            # Создаем запись предсказания
-            prediction = {
-                'date': next_date.strftime('%Y-%m-%d'),
-                'ctr': float(pred_values['ctr']),
-                'cr': float(pred_values['cr']),
-                'cpc': float(pred_values['cpc']),
-                'spend': float(pred_values['spend'])
-            }
+            # Сдвигаем окна: добавляем предсказание, вычитаем выпавшее значение
+            for series in MA_SERIES:
+                new_value = float(step_values[series][0])
+                window_values = history[series]
+                for window in MA_WINDOWS:
+                    if len(window_values) >= window:
+                        sums[(series, window)] -= window_values[-window]
+                    sums[(series, window)] += new_value
+                window_values.append(new_value)
+                for window in MA_WINDOWS:
+                    col = f'{series}_ma_{window}'
+                    if col in index:
+                        row[index[col]] = sums[(series, window)] / min(len(window_values), window)
+                        
+            # Процентные изменения по предсказанному расходу и оценке показов
+            spend = float(step_values['spend'][0])
+            cpc = float(step_values['cpc'][0])
+            ctr = float(step_values['ctr'][0])
+            impressions = spend / cpc / ctr if cpc > 0 and ctr > 0 else prev_impressions
+            if 'spend_pct_change' in index:
+                row[index['spend_pct_change']] = spend / prev_spend - 1 if prev_spend else 0.0
+            if 'impressions_pct_change' in index:
+                row[index['impressions_pct_change']] = impressions / prev_impressions - 1 if prev_impressions else 0.0
+            prev_spend = spend
+            prev_impressions = impressions
             
-            # Добавляем доверительные интервалы (симуляция)
-            prediction['ctr_lower'] = max(0, prediction['ctr'] * 0.9)
-            prediction['ctr_upper'] = prediction['ctr'] * 1.1
-            prediction['spend_lower'] = max(0, prediction['spend'] * 0.85)
-            prediction['spend_upper'] = prediction['spend'] * 1.15
+        return pred_values
+
+    def format_forecast(self, future_dates, pred_values):
+        """
+        Преобразование массивов предсказаний в список словарей для API.
+        
+        Args:
+            future_dates (pd.DatetimeIndex): Даты горизонта предсказания.
+            pred_values (dict): Предсказания и границы интервалов (см. predict_matrix).
             
+        Returns:
+            list: Список словарей с предсказаниями.
+        """
+        predictions = []
+        for i, next_date in enumerate(future_dates):
+            # Создаем запись предсказания с границами интервала для каждой метрики
+            prediction = {'date': next_date.strftime('%Y-%m-%d')}
+            for target in TARGET_COLUMNS:
+                prediction[target] = float(pred_values[target][i])
+                prediction[f'{target}_lower'] = float(pred_values[f'{target}_lower'][i])
+                prediction[f'{target}_upper'] = float(pred_values[f'{target}_upper'][i])
             predictions.append(prediction)
             
-            # Обновляем last_row для следующей итерации (простая симуляция)
-            last_row = pred_row.copy()
-            last_row['ctr'] = prediction['ctr']
-            last_row['cr'] = prediction['cr']
-            last_row['cpc'] = prediction['cpc']
-            last_row['spend'] = prediction['spend']
-            
         return predictions
 
-    def save_model(self, filepath):
+    def predict_portfolio(self, histories, days_ahead=7, chunk_size=PORTFOLIO_CHUNK_SIZE):
+        """
+        Предсказание метрик для многих кампаний (см. iter_portfolio_predictions).
+        
+        Args:
+            histories (dict): {campaign_id: история} (см. create_portfolio_features).
+            days_ahead (int): Количество дней для предсказания.
+            chunk_size (int): Число кампаний в одном пакете.
+            
+        Returns:
+            dict: {campaign_id: список предсказаний в формате predict_next_days}.
+            
+        Raises:
+            ValueError: Для какой-либо кампании не удалось построить прогноз.
+        """
+        results = {}
+        for campaign_id, predictions, error in self.iter_portfolio_predictions(histories, days_ahead, chunk_size):
+            if error is not None:
+                raise ValueError(f"Кампания '{campaign_id}': {error}")
+            results[campaign_id] = predictions
+        return results
+
+    def iter_portfolio_predictions(self, histories, days_ahead=7, chunk_size=PORTFOLIO_CHUNK_SIZE):
+        """
+        Предсказания для многих кампаний по мере их готовности.
+        
+        Прогнозы строятся пакетами (см. iter_portfolio_forecasts), поэтому
+        ошибка одной кампании не затрагивает остальные.
+        
+        Args:
+            histories (dict): {campaign_id: история} (см. create_portfolio_features).
+            days_ahead (int): Количество дней для предсказания.
+            chunk_size (int): Число кампаний в одном пакете.
+            
+        Yields:
+            tuple: (campaign_id, список предсказаний или None, текст ошибки или None)
+                в порядке histories.
+        """
+        for forecast, error in self.iter_portfolio_forecasts(histories, days_ahead, chunk_size):
+            if forecast is None:
+                campaign_id, message = error
+                yield campaign_id, None, message
+            else:
+                yield from self._format_portfolio(forecast)
+
+    def iter_portfolio_forecasts(self, histories, days_ahead=7, chunk_size=PORTFOLIO_CHUNK_SIZE):
+        """
+        Прогнозы для многих кампаний пакетами вместе с признаками, по которым
+        они построены (например, для рекомендаций по истории и прогнозу).
+        
+        Кампании обрабатываются пакетами по chunk_size: признаки пакета
+        строятся за один проход, строки всех шагов горизонта всех кампаний
+        складываются в одну матрицу, и каждая модель вызывается для пакета
+        один раз. При ошибке пакет делится пополам, пока ошибка не будет
+        локализована в одной кампании: остальные кампании по-прежнему
+        обрабатываются пакетно.
+        
+        Args:
+            histories (dict): {campaign_id: история} (см. create_portfolio_features).
+            days_ahead (int): Количество дней для предсказания.
+            chunk_size (int): Число кампаний в одном пакете.
+            
+        Yields:
+            tuple: (forecast, None) для обработанной группы кампаний, где
+                forecast - (DataFrame с признаками кампаний, список campaign_id,
+                даты горизонта - np.ndarray datetime64 (кампании x дни),
+                {метрика: np.ndarray (кампании x дни)}), или (None, (campaign_id,
+                текст ошибки)) для кампании, прогноз которой не построен.
+                Кампании следуют в порядке histories.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Модель не обучена. Сначала вызовите метод train().")
+        campaign_ids = list(histories)
+        chunk_size = max(int(chunk_size), 1)
+        for start in range(0, len(campaign_ids), chunk_size):
+            chunk = {campaign_id: histories[campaign_id] for campaign_id in campaign_ids[start:start + chunk_size]}
+            yield from self._iter_portfolio_chunk(chunk, days_ahead)
+
+    def _iter_portfolio_chunk(self, histories, days_ahead):
+        """Прогнозы пакета кампаний с делением пакета при ошибке (см. iter_portfolio_forecasts)."""
+        try:
+            forecast = self._forecast_portfolio(histories, days_ahead)
+        except Exception as e:
+            if len(histories) == 1:
+                yield None, (next(iter(histories)), str(e))
+                return
+            logger.debug(f"Пакет из {len(histories)} кампаний не обработан целиком ({e}), пакет делится.")
+            items = list(histories.items())
+            middle = len(items) // 2
+            yield from self._iter_portfolio_chunk(dict(items[:middle]), days_ahead)
+            yield from self._iter_portfolio_chunk(dict(items[middle:]), days_ahead)
+            return
+        yield forecast, None
+
+    def _forecast_portfolio(self, histories, days_ahead):
+        """
+        Прогноз для пакета кампаний одним вызовом каждой модели.
+        
+        Args:
+            histories (dict): {campaign_id: история} (см. create_portfolio_features).
+            days_ahead (int): Количество дней для предсказания.
+            
+        Returns:
+            tuple: (DataFrame с признаками кампаний, список campaign_id,
+                даты горизонта - np.ndarray datetime64 (кампании x дни),
+                {метрика: np.ndarray (кампании x дни)}).
+        """
+        features = self.create_portfolio_features(histories)
+        last = features.groupby(PORTFOLIO_KEY, sort=False).tail(1)
+        campaign_ids = last[PORTFOLIO_KEY].tolist()
+        days_ahead = max(int(days_ahead), 0)
+        last_dates = pd.to_datetime(last['date']).to_numpy().astype('datetime64[D]')
+        future_dates = last_dates[:, np.newaxis] + np.arange(1, days_ahead + 1)
+        if days_ahead == 0:
+            empty = np.empty((len(campaign_ids), 0))
+            return features, campaign_ids, future_dates, {target: empty for target in TARGET_COLUMNS}
+        
+        # Строка кампании повторяется для каждого шага горизонта, календарные
+        # признаки заполняются сразу для всех строк
+        X = np.repeat(last[self.feature_columns].to_numpy(dtype=float), days_ahead, axis=0)
+        self._set_calendar_features(X, pd.DatetimeIndex(future_dates.ravel()))
+        values = self.predict_matrix(X)
+        shape = (len(campaign_ids), days_ahead)
+        return features, campaign_ids, future_dates, {target: array.reshape(shape) for target, array in values.items()}
+
+    def _format_portfolio(self, forecast):
+        """Предсказания пакета кампаний в формате iter_portfolio_predictions."""
+        _, campaign_ids, future_dates, pred_values = forecast
+        for i, campaign_id in enumerate(campaign_ids):
+            predictions = self.format_forecast(
+                pd.DatetimeIndex(future_dates[i]), {target: values[i] for target, values in pred_values.items()}
+            )
+            yield campaign_id, predictions, None
+
+    @property
+    def models(self):
+        """Модели по метрикам; модели артефакта читаются с диска при первом обращении."""
+        if self._models is None and self._artifact_files is not None:
+            with self._models_lock:
+                if self._models is None:
+                    self._models = _read_artifact_models(self._artifact_files)
+                    _close_artifact_files(self._artifact_files)
+                    self._artifact_files = None
+        return self._models
+
+    @models.setter
+    def models(self, value):
+        self._models = value
+        if self._artifact_files is not None:
+            _close_artifact_files(self._artifact_files)
+            self._artifact_files = None
+
+    def _copy_models(self):
+        """
+        Независимые копии моделей. Непрочитанные модели артефакта читаются
+        с диска в копию, а сам предиктор продолжает предсказывать лесом
+        из артефакта.
         """
-        Сохранение обученной модели в файл.
+        with self._models_lock:
+            if self._models is None and self._artifact_files is not None:
+                return _read_artifact_models(self._artifact_files)
+        return copy.deepcopy(self.models)
+
+    def save_model(self, filepath, compress=0):
+        """
+        Сохранение обученной модели в версионированный артефакт.
+        
+        Артефакт - директория с файлом CURRENT, указывающим на текущую версию,
+        и поддиректориями версий. Версия содержит meta.json (схема, признаки,
+        статистика обучения), models/<ключ>.joblib (модели sklearn) и, если
+        все модели - леса, forest/ с массивами упакованного леса в .npy
+        (см. CompiledForest.save), по которым загруженная модель предсказывает
+        без чтения моделей sklearn. Новая версия записывается рядом и
+        активируется атомарной заменой CURRENT, поэтому читатели никогда
+        не видят частично записанную модель.
         
         Args:
-            filepath (str): Путь к файлу для сохранения модели.
+            filepath (str): Путь к директории артефакта.
+            compress (int | tuple): Сжатие моделей sklearn в joblib: 0 - без
+                сжатия, 1-9 - уровень zlib, либо кортеж вида ('lz4', 3),
+                ('gzip', 6). Упакованный лес не сжимается, чтобы его можно
+                было отображать в память.
         """
         if not self.is_trained:
             raise RuntimeError("Невозможно сохранить необученную модель.")
             
-        model_data = {
-            'models': self.models,
+        os.makedirs(filepath, exist_ok=True)
+        version = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+        version_dir = os.path.join(filepath, version)
+        os.makedirs(version_dir)
+        
+        os.makedirs(os.path.join(version_dir, ARTIFACT_MODELS_DIR))
+        model_files = {}
+        model_size = {}
+        for key, model in self.models.items():
+            model_files[key] = f'{ARTIFACT_MODELS_DIR}/{key}.joblib'
+            joblib.dump(model, os.path.join(version_dir, model_files[key]), compress=compress)
+            model_size[key] = os.path.getsize(os.path.join(version_dir, model_files[key]))
+        # Размер файлов моделей попадает в статистику и в meta.json
+        self.training_stats['model_size_bytes'] = model_size
+        self._stats = None
+        forest = self._pack_models()
+        if forest is not None:
+            forest.save(os.path.join(version_dir, ARTIFACT_FOREST_DIR))
+        meta = {
+            'schema_version': ARTIFACT_SCHEMA_VERSION,
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'compression': compress if isinstance(compress, (int, str)) else list(compress),
             'is_trained': self.is_trained,
+            'model_version': self.model_version,
             'feature_columns': self.feature_columns,
-            'training_stats': self.training_stats
+            'training_stats': self.training_stats,
+            'engine': self.engine,
+            'backend': self.backend,
+            'target_scaling': self.target_scaling,
+            'model_files': model_files,
+            'packed_forest': ARTIFACT_FOREST_DIR if forest is not None else None
         }
-        
-        joblib.dump(model_data, filepath)
-        logger.info(f"Модель успешно сохранена в '{filepath}'.")
+        with open(os.path.join(version_dir, ARTIFACT_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2, default=str)
+            
+        # Атомарно переключаем текущую версию и удаляем устаревшие
+        current_tmp = os.path.join(filepath, f'{ARTIFACT_CURRENT_FILE}.{version}.tmp')
+        with open(current_tmp, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(filepath, ARTIFACT_CURRENT_FILE))
+        _prune_artifact_versions(filepath, keep=ARTIFACT_KEEP_VERSIONS)
+        logger.info(f"Модель успешно сохранена в '{filepath}' (версия {version}).")
 
-    def load_model(self, filepath):
+    def load_model(self, filepath, lazy=True):
         """
         Загрузка обученной модели из файла.
         
+        Если в артефакте есть упакованный лес, его массивы отображаются в
+        память и предсказания вычисляются по ним: загрузка не зависит от
+        размера леса, а процессы, загрузившие одну версию, разделяют ее
+        страницы в кэше ОС. Файлы моделей sklearn открываются сразу, а
+        читаются при первом обращении к self.models (дообучение, важность
+        признаков), поэтому удаление версии после загрузки ей не мешает.
+        
         Args:
-            filepath (str): Путь к файлу с сохраненной моделью.
+            filepath (str): Путь к директории артефакта или к файлу .pkl
+                старого формата.
+            lazy (bool): Не читать модели sklearn, если есть упакованный лес.
+                Без упакованного леса (другие бэкенды) модели читаются сразу.
         """
         if not os.path.exists(filepath):
             raise FileNotFoundError(f"Файл модели '{filepath}' не найден.")
             
         try:
-            model_data = joblib.load(filepath)
-            self.models = model_data['models']
-            self.is_trained = model_data['is_trained']
-            self.feature_columns = model_data['feature_columns']
-            self.training_stats = model_data['training_stats']
-            logger.info(f"Модель успешно загружена из '{filepath}'.")
+            if os.path.isfile(filepath):
+                # Старый формат: один joblib-файл со всеми моделями
+                model_data = joblib.load(filepath)
+                self.models = model_data['models']
+                self.is_trained = model_data['is_trained']
+                self.feature_columns = model_data['feature_columns']
+                self.training_stats = model_data['training_stats']
+                self._stats = None
+                self.engine = model_data.get('engine', 'separate')
+                self.backend = model_data.get('backend', 'random_forest')
+                self.target_scaling = model_data.get('target_scaling')
+                self.model_version = model_data.get('model_version') or f'legacy-{os.path.getmtime(filepath)}'
+                logger.info(f"Модель успешно загружена из '{filepath}'.")
+                return
+                
+            meta, files, forest = _open_artifact(filepath)
+            self.is_trained = meta['is_trained']
+            self.feature_columns = meta['feature_columns']
+            self.training_stats = meta['training_stats']
+            self._stats = None
+            self.engine = meta['engine']
+            self.backend = meta['backend']
+            self.target_scaling = meta['target_scaling']
+            self.model_version = meta.get('model_version') or meta['version']
+            self.models = None
+            self._artifact_files = files
+            self._compiled = (self.model_version, forest)
+            if not lazy or forest is None:
+                self.models
+            logger.info(f"Модель успешно загружена из '{filepath}' (версия {meta['version']}).")
         except Exception as e:
             raise RuntimeError(f"Ошибка при загрузке модели из '{filepath}': {e}")
 
+def read_model_metadata(filepath):
+    """
+    Чтение метаданных артефакта модели без загрузки самих моделей.
+    
+    Args:
+        filepath (str): Путь к директории артефакта.
+        
+    Returns:
+        dict: Содержимое meta.json текущей версии, дополненное полями
+            'version' и 'artifact_dir'.
+    """
+    with open(os.path.join(filepath, ARTIFACT_CURRENT_FILE), 'r', encoding='utf-8') as f:
+        version = f.read().strip()
+    version_dir = os.path.join(filepath, version)
+    with open(os.path.join(version_dir, ARTIFACT_META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('schema_version', 0) > ARTIFACT_SCHEMA_VERSION:
+        raise ValueError(f"Неподдерживаемая версия схемы артефакта: {meta.get('schema_version')}.")
+    meta['version'] = version
+    meta['artifact_dir'] = version_dir
+    return meta
+
+def get_artifact_size(filepath):
+    """
+    Размер текущей версии артефакта модели на диске в байтах.
+    
+    Args:
+        filepath (str): Путь к директории артефакта или к файлу .pkl старого формата.
+    """
+    if os.path.isfile(filepath):
+        return os.path.getsize(filepath)
+    version_dir = read_model_metadata(filepath)['artifact_dir']
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(version_dir) for name in names)
+
+def get_artifact_stamp(filepath):
+    """
+    Отметка текущей версии артефакта: (inode, время изменения) файла CURRENT,
+    который заменяется атомарно при каждом сохранении, или None, если модели нет.
+    
+    Args:
+        filepath (str): Путь к директории артефакта.
+    """
+    try:
+        stat = os.stat(os.path.join(filepath, ARTIFACT_CURRENT_FILE))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def _open_artifact(filepath):
+    """
+    Метаданные текущей версии артефакта, открытые файлы ее моделей и
+    упакованный лес, отображенный в память.
+    
+    Returns:
+        tuple: (meta, [(ключ модели, файл)], CompiledForest | None).
+    """
+    for attempt in range(ARTIFACT_LOAD_ATTEMPTS):
+        files = []
+        try:
+            meta = read_model_metadata(filepath)
+            version_dir = meta['artifact_dir']
+            for key, name in meta['model_files'].items():
+                files.append((key, open(os.path.join(version_dir, name), 'rb')))
+            forest = None
+            if meta.get('packed_forest'):
+                forest = CompiledForest.load(os.path.join(version_dir, meta['packed_forest']), mmap_mode='r')
+            return meta, files, forest
+        except FileNotFoundError:
+            _close_artifact_files(files)
+            # Версию удалило сохранение новой модели: читаем CURRENT заново
+            if attempt == ARTIFACT_LOAD_ATTEMPTS - 1:
+                raise
+            logger.info(f"Версия артефакта '{filepath}' удалена во время загрузки, повтор.")
+        except Exception:
+            _close_artifact_files(files)
+            raise
+
+def _read_artifact_models(files):
+    """Чтение моделей из открытых файлов артефакта (см. _open_artifact)."""
+    start = time.perf_counter()
+    models = {}
+    for key, f in files:
+        f.seek(0)
+        models[key] = joblib.load(f)
+    logger.info(f"Модели прочитаны из артефакта за {time.perf_counter() - start:.3f} с.")
+    return models
+
+def _close_artifact_files(files):
+    for _, f in files:
+        f.close()
+
+def _prune_artifact_versions(filepath, keep):
+    """
+    Удаляет старые версии артефакта, оставляя keep последних. Процессы,
+    загрузившие удаляемую версию, продолжают работать: ее файлы уже открыты
+    или отображены в память (см. load_model).
+    """
+    versions = sorted(
+        name for name in os.listdir(filepath)
+        if os.path.isfile(os.path.join(filepath, name, ARTIFACT_META_FILE))
+    )
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(filepath, name), ignore_errors=True)
+
 # - НАЧАЛО: Улучшенная функция генерации исторических данных -
 def generate_historical_data(days=365, save_to_file=True, filepath='historical_data.json'):
     """
@@ -354,60 +1788,44 @@ def generate_historical_data(days=365, save_to_file=True, filepath='historical_d
     return data
 # - КОНЕЦ: Улучшенная функция генерации исторических данных -
 
-def get_model_stats():
+def open_history_storage(historical_data_filepath):
     """
-    Возвращает словарь со статистикой модели.
-    В реальной системе эта информация может храниться в отдельном файле
-    или в базе данных после обучения.
-    """
-    # Это симуляция. В реальном приложении здесь будет логика получения
-    # реальной статистики из обученной модели или логов обучения.
-    import random
-    random.seed(42) # Для воспроизводимости симуляции
+    Хранилище истории (см. history_storage.HistoryStorage) для пути к данным.
+
+    Директория хранилища открывается напрямую. Для пути к JSON-файлу рядом
+    используется директория '<имя>.store': при первом обращении (или если
+    файл был перезаписан в обход хранилища) в нее импортируется JSON, а сам
+    файл дальше атомарно обновляется только при сжатии хранилища.
     
-    return {
-        'model_trained': True, # Предположим, модель обучена
-        'last_trained': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'accuracy': {
-            'ctr_mae': round(random.uniform(0.001, 0.01), 4),
-            'cr_mae': round(random.uniform(0.0005, 0.005), 4),
-            'cpc_mae': round(random.uniform(0.5, 3.0), 2),
-            'spend_mae': round(random.uniform(1000, 5000), 2)
-        },
-        'feature_importance': {
-            'day_of_week': round(random.uniform(0.15, 0.3), 2),
-            'ctr_moving_avg': round(random.uniform(0.15, 0.3), 2),
-            'seasonality': round(random.uniform(0.1, 0.25), 2),
-            'past_spend': round(random.uniform(0.15, 0.3), 2),
-            'conversion_rate': round(random.uniform(0.1, 0.2), 2)
-        }
-    }
+    Args:
+        historical_data_filepath (str): Путь к historical_data.json или к директории хранилища.
+        
+    Returns:
+        HistoryStorage: Хранилище истории.
+    """
+    if not historical_data_filepath.endswith('.json'):
+        return HistoryStorage(historical_data_filepath)
+    store_dir = os.path.splitext(historical_data_filepath)[0] + '.store'
+    storage = HistoryStorage(store_dir, json_export_path=historical_data_filepath)
+    if storage.json_is_stale(historical_data_filepath):
+        storage.reset()
+        imported = storage.import_json(historical_data_filepath)
+        logger.info(f"Файл {historical_data_filepath} импортирован в хранилище {store_dir}: {imported} записей.")
+    return storage
 
 def append_predictions_to_historical_data(historical_data_filepath, predictions):
     """
-    Добавляет предсказания в файл исторических данных.
+    Добавляет предсказания в хранилище исторических данных.
     
     Args:
-        historical_data_filepath (str): Путь к файлу historical_data.json.
+        historical_data_filepath (str): Путь к historical_data.json или к директории хранилища.
         predictions (list): Список словарей с предсказаниями.
         
     Returns:
         bool: True, если данные успешно добавлены, False в противном случае.
     """
-    import json
-    import os
-    
     try:
-        # Проверяем, существует ли файл
-        if not os.path.exists(historical_data_filepath):
-            logger.warning(f"Файл {historical_data_filepath} не найден. Создаем новый.")
-            # Если файла нет, создаем его с пустым массивом
-            with open(historical_data_filepath, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-        
-        # Загружаем существующие данные
-        with open(historical_data_filepath, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
+        storage = open_history_storage(historical_data_filepath)
         
         # Преобразуем предсказания в формат исторических данных
         # Предполагаем, что predictions содержит словари с ключами: date, ctr, cr, cpc, spend
@@ -442,12 +1860,8 @@ def append_predictions_to_historical_data(historical_data_filepath, predictions)
             }
             augmented_predictions.append(augmented_pred)
         
-        # Добавляем предсказания в конец существующих данных
-        existing_data.extend(augmented_predictions)
-        
-        # Сохраняем обновленные данные обратно в файл
-        with open(historical_data_filepath, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+        # Дописываем предсказания в журнал хранилища без перезаписи всей истории
+        storage.append(augmented_predictions)
         
         logger.info(f"Успешно добавлено {len(augmented_predictions)} предсказаний в {historical_data_filepath}")
         return True
@@ -459,37 +1873,25 @@ def append_predictions_to_historical_data(historical_data_filepath, predictions)
 # Улучшенная версия функции, которая использует последние данные из файла для более точных расчетов
 def append_predictions_to_historical_data_v2(historical_data_filepath, predictions):
     """
-    Добавляет предсказания в файл исторических данных, используя последние
-    данные из файла для более точных расчетов производных метрик.
+    Добавляет предсказания в хранилище исторических данных, используя последние
+    данные хранилища для более точных расчетов производных метрик.
     
     Args:
-        historical_data_filepath (str): Путь к файлу historical_data.json.
+        historical_data_filepath (str): Путь к historical_data.json или к директории хранилища.
         predictions (list): Список словарей с предсказаниями.
         
     Returns:
         bool: True, если данные успешно добавлены, False в противном случае.
     """
-    import json
-    import os
     import statistics
     
     try:
-        # Проверяем, существует ли файл
-        if not os.path.exists(historical_data_filepath):
-            logger.warning(f"Файл {historical_data_filepath} не найден. Создаем новый.")
-            with open(historical_data_filepath, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-            existing_data = []
-        else:
-            # Загружаем существующие данные
-            with open(historical_data_filepath, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
+        storage = open_history_storage(historical_data_filepath)
+        # Берем последние 30 записей для расчета средних (читается только хвост истории)
+        recent_data = storage.tail(30)
         
         # Если есть исторические данные, рассчитываем средние значения
-        if existing_data:
-            # Берем последние 30 записей для расчета средних
-            recent_data = existing_data[-30:]
-            
+        if recent_data:
             # Рассчитываем средние коэффициенты
             ctrs = [d['clicks'] / d['impressions'] for d in recent_data if d['impressions'] > 0]
             crs = [d['conversions'] / d['clicks'] for d in recent_data if d['clicks'] > 0]
@@ -532,12 +1934,8 @@ def append_predictions_to_historical_data_v2(historical_data_filepath, predictio
             }
             augmented_predictions.append(augmented_pred)
         
-        # Добавляем предсказания в конец существующих данных
-        existing_data.extend(augmented_predictions)
-        
-        # Сохраняем обновленные данные обратно в файл
-        with open(historical_data_filepath, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+        # Дописываем предсказания в журнал хранилища без перезаписи всей истории
+        storage.append(augmented_predictions)
         
         logger.info(f"Успешно добавлено {len(augmented_predictions)} предсказаний в {historical_data_filepath}")
         return True
@@ -586,8 +1984,6 @@ if __name__ == "__main__":
         print("Не удалось добавить предсказания в файл исторических данных.")
     
     # Сохраняем модель
-    model_path = './data/model_weights/ad_metrics_model.pkl'
-    import os
-    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    model_path = './data/model_weights/ad_metrics_model'
     predictor.save_model(model_path)
     print(f"Модель сохранена в {model_path}")
\ No newline at end of file
@@ -0,0 +1,176 @@
+# model_registry.py
+"""
+Реестр моделей для нескольких магазинов/кампаний в одном процессе API.
+
+У каждого магазина свой артефакт AdMetricsPredictor в поддиректории реестра.
+Модели загружаются при первом обращении и держатся в LRU-кэше,
+ограниченном числом моделей и суммарным объемом памяти. Модель из кэша
+перезагружается, если другой процесс сервиса сохранил новую версию
+артефакта (изменилась отметка файла CURRENT).
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+from ml_model import AdMetricsPredictor, get_artifact_size, get_artifact_stamp
+from dataset_store import DATASET_ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotFoundError(KeyError):
+    """Для магазина нет обученной модели."""
+
+
+def estimate_model_bytes(predictor, artifact_path=None):
+    """
+    Оценка объема памяти модели: сумма размеров файлов моделей из
+    training_stats (см. AdMetricsPredictor.save_model), а при их отсутствии -
+    размер артефакта на диске.
+    """
+    sizes = predictor.training_stats.get('model_size_bytes')
+    if sizes:
+        return int(sum(sizes.values()))
+    if artifact_path and os.path.exists(artifact_path):
+        return get_artifact_size(artifact_path)
+    return 0
+
+
+class ModelRegistry:
+    """LRU-кэш моделей AdMetricsPredictor, ключом которого является ID магазина/кампании."""
+
+    def __init__(self, root_dir, max_models=32, max_bytes=2 * 1024 ** 3, predictor_options=None):
+        """
+        Args:
+            root_dir (str): Директория с артефактами моделей магазинов.
+            max_models (int): Максимальное число моделей в памяти.
+            max_bytes (int): Максимальный суммарный объем моделей в памяти.
+            predictor_options (dict, optional): Параметры AdMetricsPredictor
+                для загружаемых моделей (например, inference).
+        """
+        self.root_dir = root_dir
+        self.predictor_options = dict(predictor_options or {})
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        os.makedirs(root_dir, exist_ok=True)
+        self._entries = OrderedDict()  # tenant_id -> (predictor, bytes, отметка артефакта)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Блокировки загрузки магазинов; запись удаляется после загрузки
+        self._load_locks = {}
+        self.counters = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0}
+
+    def _validate_id(self, tenant_id):
+        if not isinstance(tenant_id, str) or not DATASET_ID_PATTERN.match(tenant_id):
+            raise ValueError(f"Некорректный идентификатор магазина: '{tenant_id}'.")
+
+    def artifact_path(self, tenant_id):
+        """Путь к артефакту модели магазина."""
+        self._validate_id(tenant_id)
+        return os.path.join(self.root_dir, tenant_id)
+
+    def exists(self, tenant_id):
+        """Есть ли у магазина сохраненная или загруженная модель."""
+        with self._lock:
+            if tenant_id in self._entries:
+                return True
+        return os.path.exists(self.artifact_path(tenant_id))
+
+    def get(self, tenant_id):
+        """
+        Модель магазина; при промахе или устаревшей версии загружается
+        из артефакта.
+
+        Raises:
+            ModelNotFoundError: Если для магазина нет сохраненной модели.
+        """
+        path = self.artifact_path(tenant_id)
+        stamp = get_artifact_stamp(path)
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry is not None and entry[2] == stamp:
+                self._entries.move_to_end(tenant_id)
+                self.counters['hits'] += 1
+                return entry[0]
+            self.counters['misses'] += 1
+            load_lock = self._load_locks.setdefault(tenant_id, threading.Lock())
+
+        # Загрузка вне общей блокировки, чтобы не задерживать другие магазины
+        try:
+            with load_lock:
+                stamp = get_artifact_stamp(path)
+                with self._lock:
+                    entry = self._entries.get(tenant_id)
+                    if entry is not None and entry[2] == stamp:
+                        return entry[0]
+                if stamp is None:
+                    raise ModelNotFoundError(tenant_id)
+                predictor = AdMetricsPredictor(**self.predictor_options)
+                predictor.load_model(path)
+                with self._lock:
+                    self.counters['loads'] += 1
+                self._insert(tenant_id, predictor, estimate_model_bytes(predictor, path), stamp)
+                logger.info(f"Модель магазина '{tenant_id}' загружена в реестр.")
+                return predictor
+        finally:
+            # Ожидающие потоки уже держат ссылку на блокировку и после нее
+            # найдут модель в кэше; новые запросы получат ее без блокировки
+            with self._lock:
+                if self._load_locks.get(tenant_id) is load_lock:
+                    del self._load_locks[tenant_id]
+
+    def put(self, tenant_id, predictor, save=True, compress=0):
+        """
+        Регистрация обученной модели магазина (заменяет текущую).
+
+        Args:
+            tenant_id (str): Идентификатор магазина/кампании.
+            predictor (AdMetricsPredictor): Обученная модель.
+            save (bool): Сохранить ли артефакт на диск.
+            compress (int | tuple): Сжатие артефакта (см. AdMetricsPredictor.save_model).
+        """
+        path = self.artifact_path(tenant_id)
+        if save:
+            predictor.save_model(path, compress=compress)
+        self._insert(tenant_id, predictor, estimate_model_bytes(predictor, path), get_artifact_stamp(path))
+
+    def _insert(self, tenant_id, predictor, size, stamp):
+        with self._lock:
+            previous = self._entries.pop(tenant_id, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._entries[tenant_id] = (predictor, size, stamp)
+            self._total_bytes += size
+            # Вытесняем давно не использованные модели; только что добавленную оставляем всегда
+            while len(self._entries) > 1 and (len(self._entries) > self.max_models
+                                              or self._total_bytes > self.max_bytes):
+                evicted_id, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.counters['evictions'] += 1
+                logger.info(f"Модель магазина '{evicted_id}' вытеснена из реестра.")
+
+    def evict(self, tenant_id):
+        """Выгрузка модели магазина из памяти (артефакт на диске остается)."""
+        self._validate_id(tenant_id)
+        with self._lock:
+            entry = self._entries.pop(tenant_id, None)
+            if entry is None:
+                return False
+            self._total_bytes -= entry[1]
+            self.counters['evictions'] += 1
+            return True
+
+    def stats(self):
+        """Счетчики попаданий/промахов/вытеснений и текущая загрузка реестра."""
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': round(self.counters['hits'] / lookups, 4) if lookups else None,
+                'resident_models': len(self._entries),
+                'resident_bytes': self._total_bytes,
+                'max_models': self.max_models,
+                'max_bytes': self.max_bytes,
+                'tenants': list(self._entries)
+            }
@@ -0,0 +1,114 @@
+# prediction_cache.py
+"""
+Кэш результатов predict_next_days для /api/predict и /api/recommendations.
+
+Ключ - хэш содержимого хвоста истории (признаки последнего дня зависят
+только от последних max(MA_WINDOWS) строк), горизонта предсказания и версии
+модели. Записи живут ограниченное время и вытесняются по LRU.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from ml_model import MA_WINDOWS
+
+# Сколько последних строк истории определяет предсказание:
+# окно скользящих средних плюс предыдущий день для процентных изменений
+HISTORY_TAIL_ROWS = max(MA_WINDOWS) + 1
+
+
+def history_fingerprint(historical_data):
+    """
+    Хэш той части истории, от которой зависят предсказания.
+
+    Если хвост списка отсортирован по дате и идет после предшествующей ему
+    строки, история считается хронологической и хэшируются только хвост и
+    длина истории - O(HISTORY_TAIL_ROWS) независимо от размера истории;
+    иначе (неотсортированная история) - вся история.
+    """
+    tail = historical_data[-HISTORY_TAIL_ROWS:]
+    tail_dates = [str(row.get('date')) for row in tail]
+    is_chronological = tail_dates == sorted(tail_dates) and (
+        len(historical_data) <= HISTORY_TAIL_ROWS
+        or str(historical_data[-HISTORY_TAIL_ROWS - 1].get('date')) < tail_dates[0]
+    )
+    payload = tail if is_chronological else historical_data
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(str(len(historical_data)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_prediction_key(historical_data, days_ahead, model_version, **options):
+    """
+    Ключ кэша для предсказания.
+
+    Args:
+        historical_data (list): История, переданная в запросе или взятая из хранилища.
+        days_ahead (int): Горизонт предсказания.
+        model_version (str): Версия модели (AdMetricsPredictor.model_version).
+        **options: Прочие параметры, влияющие на результат (например, recursive).
+    """
+    parts = [history_fingerprint(historical_data), str(days_ahead), str(model_version)]
+    parts.extend(f'{name}={options[name]}' for name in sorted(options))
+    return '|'.join(parts)
+
+
+class PredictionCache:
+    """Потокобезопасный LRU-кэш предсказаний с ограничением по времени жизни."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        """
+        Args:
+            max_entries (int): Максимальное число записей.
+            ttl_seconds (float): Время жизни записи в секундах.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """Значение по ключу или None, если записи нет или она устарела."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Сохранение значения; самые старые записи вытесняются сверх лимита."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def get_or_compute(self, key, compute):
+        """Значение из кэша или результат compute(), который сохраняется в кэш."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Инвалидация всех записей (например, после подмены модели)."""
+        with self._lock:
+            self._entries.clear()
+            self.counters['invalidations'] += 1
+
+    def stats(self):
+        """Счетчики и текущий размер кэша."""
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries),
+                        max_entries=self.max_entries, ttl_seconds=self.ttl_seconds)
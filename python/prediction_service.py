@@ -0,0 +1,183 @@
+# prediction_service.py
+"""
+Асинхронный сервис предсказаний для /api/predict и /api/recommendations.
+
+Цикл asyncio работает в отдельном фоновом потоке, а вызовы pandas и
+sklearn выполняются в ограниченном пуле потоков (обход деревьев в sklearn
+отпускает GIL, поэтому потоки действительно работают параллельно).
+Поверх пула сервис:
+- объединяет одинаковые запросы, которые выполняются одновременно:
+  вычисление идет один раз, результат получают все ожидающие;
+- собирает матрицы признаков запросов к одной модели, пришедших в течение
+  короткого окна, в один пакет и вызывает predict каждой модели один раз
+  для всего пакета (например, для разных магазинов с общей моделью).
+
+Обработчики Flask синхронные, поэтому для них есть блокирующий вызов
+predict(); из кода, работающего в цикле сервиса, можно вызывать predict_async().
+"""
+import asyncio
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """Матрицы признаков запросов к одной модели, ожидающие общего вызова predict."""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.matrices = []
+        self.futures = []
+        self.rows = 0
+        self.flushed = False
+
+    def add(self, X, future):
+        self.matrices.append(X)
+        self.futures.append(future)
+        self.rows += len(X)
+
+
+class PredictionService:
+    """Фоновый цикл asyncio с пулом потоков, объединением запросов и пакетированием."""
+
+    def __init__(self, max_workers=None, batch_window=0.002, max_batch_rows=4096, timeout=60.0):
+        """
+        Args:
+            max_workers (int, optional): Размер пула потоков для pandas/sklearn
+                (по умолчанию - min(4, число ядер)).
+            batch_window (float): Сколько секунд ждать другие запросы к той же
+                модели перед вызовом predict.
+            max_batch_rows (int): Пакет отправляется сразу, набрав столько строк.
+            timeout (float): Максимальное время ожидания результата в predict().
+        """
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.batch_window = batch_window
+        self.max_batch_rows = max_batch_rows
+        self.timeout = timeout
+        self._loop = None
+        self._executor = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        # Состояние ниже изменяется только из потока цикла
+        self._inflight = {}  # ключ запроса -> asyncio.Future
+        self._batches = {}  # предиктор -> _Batch
+        self.counters = {'requests': 0, 'coalesced': 0, 'batches': 0, 'batched_requests': 0,
+                         'max_batch_requests': 0}
+
+    def _ensure_started(self):
+        """
+        Запуск цикла при первом обращении. Цикл запускается заново в дочернем
+        процессе (после fork потоки родителя не существуют).
+        """
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._start_lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='predict')
+                self._inflight = {}
+                self._batches = {}
+                threading.Thread(target=loop.run_forever, name='prediction-service', daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                logger.info(f"Сервис предсказаний запущен: {self.max_workers} потоков.")
+        return self._loop
+
+    def predict(self, key, predictor, historical_data, days_ahead=7):
+        """
+        Блокирующее предсказание (для синхронных обработчиков).
+
+        Args:
+            key (str): Ключ запроса; одновременные запросы с одинаковым ключом
+                объединяются (см. prediction_cache.make_prediction_key).
+            predictor (AdMetricsPredictor): Обученная модель.
+            historical_data (list | dict | pd.DataFrame): История (см. predict_next_days).
+            days_ahead (int): Количество дней для предсказания.
+
+        Returns:
+            list: Предсказания в формате predict_next_days.
+        """
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(
+            self.predict_async(key, predictor, historical_data, days_ahead), loop
+        )
+        return future.result(self.timeout)
+
+    async def predict_async(self, key, predictor, historical_data, days_ahead=7):
+        """Предсказание в цикле сервиса (параметры - как у predict)."""
+        self.counters['requests'] += 1
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(pending)
+        pending = self._loop.create_future()
+        self._inflight[key] = pending
+        try:
+            result = await self._compute(predictor, historical_data, days_ahead)
+        except Exception as e:
+            pending.set_exception(e)
+            # Ошибка уже передана вызывающему коду; ожидающих может не быть
+            pending.exception()
+            raise
+        else:
+            pending.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    async def _compute(self, predictor, historical_data, days_ahead):
+        # Признаки и матрица горизонта строятся в пуле, а не в потоке цикла
+        X, future_dates = await self._loop.run_in_executor(
+            self._executor, predictor.prepare_forecast_matrix, historical_data, days_ahead
+        )
+        if len(future_dates) == 0:
+            return []
+        pred_values = await self._enqueue(predictor, X)
+        return predictor.format_forecast(future_dates, pred_values)
+
+    def _enqueue(self, predictor, X):
+        """Добавление матрицы в пакет модели; возвращает Future с предсказаниями этой матрицы."""
+        batch = self._batches.get(predictor)
+        if batch is None:
+            batch = self._batches[predictor] = _Batch(predictor)
+            self._loop.call_later(self.batch_window, self._flush, batch)
+        future = self._loop.create_future()
+        batch.add(X, future)
+        if batch.rows >= self.max_batch_rows:
+            self._flush(batch)
+        return future
+
+    def _flush(self, batch):
+        if batch.flushed:
+            return
+        batch.flushed = True
+        if self._batches.get(batch.predictor) is batch:
+            del self._batches[batch.predictor]
+        self.counters['batches'] += 1
+        self.counters['batched_requests'] += len(batch.futures)
+        self.counters['max_batch_requests'] = max(self.counters['max_batch_requests'], len(batch.futures))
+        self._loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        try:
+            values = await self._loop.run_in_executor(
+                self._executor, batch.predictor.predict_matrix, np.vstack(batch.matrices)
+            )
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        offset = 0
+        for X, future in zip(batch.matrices, batch.futures):
+            future.set_result({target: array[offset:offset + len(X)] for target, array in values.items()})
+            offset += len(X)
+
+    def stats(self):
+        """Счетчики объединенных запросов и пакетов."""
+        return dict(self.counters, max_workers=self.max_workers,
+                    batch_window_ms=self.batch_window * 1000, max_batch_rows=self.max_batch_rows)
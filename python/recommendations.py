@@ -0,0 +1,368 @@
+# recommendations.py
+"""
+Движок рекомендаций по рекламным кампаниям.
+
+Правила описываются декларативно (RECOMMENDATION_RULES): условие - выражение
+над сигналами кампании, тип, приоритет и шаблон сообщения. Выражения
+разбираются и компилируются один раз при создании движка, а вычисляются
+векторно - над массивами NumPy, где каждый элемент соответствует одной
+кампании. Поэтому одна проверка правил обслуживает как одну кампанию,
+так и тысячи кампаний портфеля за один проход.
+
+Сигналы строятся по DataFrame с признаками (последний день и суммы за
+последние HISTORY_WINDOW дней) и по прогнозу модели на горизонт.
+В условиях используются операторы сравнения, арифметика, & | ~ и функции
+из RULE_FUNCTIONS; and/or/not не поддерживаются, так как не работают
+с массивами.
+"""
+import ast
+import string
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних дней истории суммируется для сигналов *_14
+HISTORY_WINDOW = 14
+# Порядок приоритетов в ответе
+PRIORITY_ORDER = ('high', 'medium', 'low')
+RECOMMENDATION_TYPES = ('positive', 'warning', 'negative', 'info')
+
+# Функции, доступные в условиях правил
+RULE_FUNCTIONS = {
+    'abs': np.abs,
+    'min': np.minimum,
+    'max': np.maximum,
+    'isnan': np.isnan
+}
+
+# Сигналы, доступные в условиях и шаблонах сообщений
+SIGNALS = {
+    'ctr': "CTR последнего дня",
+    'cr': "CR последнего дня",
+    'cpc': "CPC последнего дня",
+    'spend': "Расход последнего дня",
+    'roas': "ROAS последнего дня",
+    'ctr_ma_7': "Скользящее среднее CTR за 7 дней",
+    'ctr_ma_14': "Скользящее среднее CTR за 14 дней",
+    'cr_ma_7': "Скользящее среднее CR за 7 дней",
+    'cr_ma_14': "Скользящее среднее CR за 14 дней",
+    'spend_ma_7': "Скользящее среднее расхода за 7 дней",
+    'spend_ma_14': "Скользящее среднее расхода за 14 дней",
+    'spend_pct_change': "Изменение расхода к предыдущему дню",
+    'spend_14': "Расход за последние 14 дней",
+    'revenue_14': "Выручка за последние 14 дней",
+    'roas_14': "ROAS за последние 14 дней",
+    'cpc_14': "CPC за последние 14 дней",
+    'history_days': "Число дней истории",
+    'days_ahead': "Горизонт прогноза",
+    'has_forecast': "Есть ли прогноз модели",
+    'pred_ctr': "Средний прогнозный CTR",
+    'pred_cr': "Средний прогнозный CR",
+    'pred_cpc': "Средний прогнозный CPC",
+    'pred_spend': "Средний прогнозный дневной расход",
+    'pred_spend_total': "Прогнозный расход за горизонт",
+    'pred_ctr_change': "Изменение прогнозного CTR к среднему за 7 дней",
+    'pred_cr_change': "Изменение прогнозного CR к среднему за 7 дней",
+    'pred_cpc_change': "Изменение прогнозного CPC к CPC за 14 дней",
+    'pred_spend_change': "Изменение прогнозного расхода к среднему за 7 дней"
+}
+
+RECOMMENDATION_RULES = [
+    {
+        'id': 'ctr_above_average',
+        'when': "ctr > ctr_ma_14 * 1.1",
+        'type': 'positive',
+        'priority': 'high',
+        'message': "Высокий CTR наблюдается в последнее время. Рассмотрите увеличение бюджета "
+                   "для масштабирования успешных кампаний."
+    },
+    {
+        'id': 'spend_spike',
+        'when': "spend > spend_ma_14 * 1.5",
+        'type': 'warning',
+        'priority': 'medium',
+        'message': "Значительный рост расходов. Проверьте эффективность новых кампаний."
+    },
+    {
+        'id': 'cpc_above_average',
+        'when': "cpc > cpc_14 * 1.25",
+        'type': 'negative',
+        'priority': 'high',
+        'message': "Высокая стоимость клика ({cpc:.2f} при среднем {cpc_14:.2f} за 14 дней). "
+                   "Рассмотрите оптимизацию таргетинга или креативов."
+    },
+    {
+        'id': 'low_roas',
+        'when': "(spend_14 > 0) & (roas_14 < 1)",
+        'type': 'negative',
+        'priority': 'high',
+        'message': "Расходы за последние 14 дней превышают выручку (ROAS {roas_14:.2f}). "
+                   "Пересмотрите ставки и отключите неэффективные объявления."
+    },
+    {
+        'id': 'forecast_ctr_drop',
+        'when': "has_forecast & (pred_ctr_change < -0.1)",
+        'type': 'warning',
+        'priority': 'high',
+        'message': "Модель прогнозирует изменение CTR на {pred_ctr_change:+.0%} в ближайшие "
+                   "{days_ahead:.0f} дней. Обновите креативы заранее."
+    },
+    {
+        'id': 'forecast_cpc_growth',
+        'when': "has_forecast & (pred_cpc_change > 0.15)",
+        'type': 'warning',
+        'priority': 'medium',
+        'message': "Ожидается рост стоимости клика на {pred_cpc_change:.0%}. Проверьте ставки и конкуренцию."
+    },
+    {
+        'id': 'forecast_spend_growth',
+        'when': "has_forecast & (pred_spend_change > 0.2)",
+        'type': 'warning',
+        'priority': 'medium',
+        'message': "Прогнозный расход за {days_ahead:.0f} дней - {pred_spend_total:,.0f}, "
+                   "на {pred_spend_change:.0%} выше текущего уровня. Проверьте дневные лимиты."
+    },
+    {
+        'id': 'forecast_cr_growth',
+        'when': "has_forecast & (pred_cr_change > 0.1)",
+        'type': 'positive',
+        'priority': 'medium',
+        'message': "Модель прогнозирует рост конверсии на {pred_cr_change:.0%}. "
+                   "Хороший момент для увеличения бюджета."
+    },
+    {
+        'id': 'forecast_ready',
+        'when': "has_forecast",
+        'type': 'info',
+        'priority': 'low',
+        'message': "Прогноз на {days_ahead:.0f} дней готов. Следите за предсказанными трендами."
+    },
+    {
+        'id': 'retrain_reminder',
+        'when': "history_days > 0",
+        'type': 'info',
+        'priority': 'medium',
+        'message': "Рекомендуется регулярное обучение модели для повышения точности предсказаний."
+    }
+]
+
+# Узлы AST, допустимые в условиях правил
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.USub, ast.UAdd, ast.Invert,
+    ast.BitAnd, ast.BitOr, ast.BitXor,
+    ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq
+)
+
+
+class CompiledRule:
+    """Правило с откомпилированным условием и разобранным шаблоном сообщения."""
+
+    def __init__(self, rule):
+        self.id = rule['id']
+        self.type = rule['type']
+        self.priority = rule['priority']
+        self.message = rule['message']
+        self.when = rule['when']
+        if self.type not in RECOMMENDATION_TYPES:
+            raise ValueError(f"Правило '{self.id}': неизвестный тип '{self.type}'.")
+        if self.priority not in PRIORITY_ORDER:
+            raise ValueError(f"Правило '{self.id}': неизвестный приоритет '{self.priority}'.")
+        try:
+            tree = ast.parse(self.when, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Правило '{self.id}': синтаксическая ошибка в условии: {e.msg}.")
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ValueError(f"Правило '{self.id}': недопустимая конструкция {type(node).__name__}.")
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name)
+                                                   and node.func.id in RULE_FUNCTIONS):
+                raise ValueError(f"Правило '{self.id}': недопустимый вызов функции.")
+            if isinstance(node, ast.Name) and node.id not in SIGNALS and node.id not in RULE_FUNCTIONS:
+                raise ValueError(f"Правило '{self.id}': неизвестный сигнал '{node.id}'.")
+        self.code = compile(tree, f'<правило {self.id}>', 'eval')
+        self.message_fields = {field for _, field, _, _ in string.Formatter().parse(self.message) if field}
+        unknown = self.message_fields - set(SIGNALS)
+        if unknown:
+            raise ValueError(f"Правило '{self.id}': неизвестные поля сообщения {sorted(unknown)}.")
+
+    def evaluate(self, signals, size):
+        """Маска кампаний, для которых условие выполнено."""
+        namespace = dict(RULE_FUNCTIONS, **signals)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = eval(self.code, {'__builtins__': {}}, namespace)
+        return np.broadcast_to(np.asarray(result, dtype=bool), (size,))
+
+    def format_message(self, signals, index):
+        """Сообщение для одной кампании."""
+        if not self.message_fields:
+            return self.message
+        return self.message.format(**{field: float(signals[field][index]) for field in self.message_fields})
+
+
+def _ratio(numerator, denominator):
+    """Поэлементное отношение; при нулевом знаменателе - NaN (условия с ним ложны)."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.full(np.broadcast(numerator, denominator).shape, np.nan),
+                     where=denominator != 0)
+
+
+def _column(frame, name):
+    if name in frame.columns:
+        return frame[name].to_numpy(dtype=float)
+    return np.full(len(frame), np.nan)
+
+
+def history_signals(features, key=None):
+    """
+    Сигналы истории для каждой кампании.
+
+    Args:
+        features (pd.DataFrame): Признаки (см. AdMetricsPredictor.create_features),
+            отсортированные по дате внутри каждой кампании.
+        key (str, optional): Колонка с идентификатором кампании; без нее
+            весь DataFrame - одна кампания.
+
+    Returns:
+        tuple: (идентификаторы кампаний, словарь {сигнал: np.ndarray}).
+    """
+    if key is None:
+        features = features.assign(_campaign=0)
+        key = '_campaign'
+    grouped = features.groupby(key, sort=False)
+    last = grouped.tail(1)
+    totals = grouped.tail(HISTORY_WINDOW).groupby(key, sort=False)[['spend', 'revenue', 'clicks']].sum()
+    totals = totals.reindex(last[key].to_numpy())
+    signals = {
+        name: _column(last, name)
+        for name in ('ctr', 'cr', 'cpc', 'spend', 'roas', 'ctr_ma_7', 'ctr_ma_14', 'cr_ma_7', 'cr_ma_14',
+                     'spend_ma_7', 'spend_ma_14', 'spend_pct_change')
+    }
+    signals['spend_14'] = totals['spend'].to_numpy(dtype=float)
+    signals['revenue_14'] = totals['revenue'].to_numpy(dtype=float)
+    signals['roas_14'] = _ratio(signals['revenue_14'], signals['spend_14'])
+    signals['cpc_14'] = _ratio(signals['spend_14'], totals['clicks'].to_numpy(dtype=float))
+    signals['history_days'] = grouped.size().reindex(last[key].to_numpy()).to_numpy(dtype=float)
+    return last[key].tolist(), signals
+
+
+def forecast_signals(signals, forecast, days_ahead):
+    """
+    Добавление сигналов прогноза к сигналам истории.
+
+    Args:
+        signals (dict): Сигналы истории (см. history_signals).
+        forecast (dict | None): {метрика: np.ndarray (кампании x дни)} или None,
+            если прогноза нет.
+        days_ahead (int): Горизонт прогноза.
+
+    Returns:
+        dict: Те же сигналы, дополненные сигналами прогноза.
+    """
+    size = len(signals['ctr'])
+    has_forecast = forecast is not None and days_ahead > 0
+    signals = dict(signals, days_ahead=np.full(size, float(days_ahead)), has_forecast=np.full(size, has_forecast))
+    if not has_forecast:
+        for name in ('pred_ctr', 'pred_cr', 'pred_cpc', 'pred_spend', 'pred_spend_total', 'pred_ctr_change',
+                     'pred_cr_change', 'pred_cpc_change', 'pred_spend_change'):
+            signals[name] = np.full(size, np.nan)
+        return signals
+    for target in ('ctr', 'cr', 'cpc', 'spend'):
+        signals[f'pred_{target}'] = np.asarray(forecast[target], dtype=float).reshape(size, -1).mean(axis=1)
+    signals['pred_spend_total'] = np.asarray(forecast['spend'], dtype=float).reshape(size, -1).sum(axis=1)
+    signals['pred_ctr_change'] = _ratio(signals['pred_ctr'], signals['ctr_ma_7']) - 1
+    signals['pred_cr_change'] = _ratio(signals['pred_cr'], signals['cr_ma_7']) - 1
+    signals['pred_cpc_change'] = _ratio(signals['pred_cpc'], signals['cpc_14']) - 1
+    signals['pred_spend_change'] = _ratio(signals['pred_spend'], signals['spend_ma_7']) - 1
+    return signals
+
+
+def predictions_to_forecast(predictions):
+    """Список предсказаний predict_next_days одной кампании -> {метрика: массив (1 x дни)}."""
+    if not predictions:
+        return None
+    return {target: np.array([[row[target] for row in predictions]], dtype=float)
+            for target in ('ctr', 'cr', 'cpc', 'spend')}
+
+
+class RecommendationEngine:
+    """Набор откомпилированных правил и их векторное применение к кампаниям."""
+
+    def __init__(self, rules=None):
+        """
+        Args:
+            rules (list, optional): Описания правил (по умолчанию RECOMMENDATION_RULES).
+
+        Raises:
+            ValueError: Если правило некорректно (неизвестный сигнал, тип, конструкция).
+        """
+        self.rules = [CompiledRule(rule) for rule in (rules if rules is not None else RECOMMENDATION_RULES)]
+        ids = [rule.id for rule in self.rules]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Идентификаторы правил должны быть уникальными.")
+        # Порядок вывода: по приоритету, внутри приоритета - в порядке объявления
+        self._order = sorted(range(len(self.rules)), key=lambda i: PRIORITY_ORDER.index(self.rules[i].priority))
+
+    def evaluate(self, signals):
+        """
+        Проверка всех правил для всех кампаний.
+
+        Returns:
+            np.ndarray: Матрица (правила x кампании) сработавших условий.
+        """
+        size = len(signals['ctr'])
+        if not self.rules:
+            return np.zeros((0, size), dtype=bool)
+        return np.vstack([rule.evaluate(signals, size) for rule in self.rules])
+
+    def recommend_many(self, campaign_ids, signals):
+        """
+        Рекомендации для нескольких кампаний.
+
+        Args:
+            campaign_ids (list): Идентификаторы кампаний в порядке сигналов.
+            signals (dict): Сигналы истории и прогноза (см. forecast_signals).
+
+        Returns:
+            dict: {кампания: список рекомендаций}; рекомендация - словарь
+                с полями rule, type, priority, message.
+        """
+        fired = self.evaluate(signals)
+        result = {campaign_id: [] for campaign_id in campaign_ids}
+        for rule_index in self._order:
+            rule = self.rules[rule_index]
+            for campaign_index in np.flatnonzero(fired[rule_index]):
+                result[campaign_ids[campaign_index]].append({
+                    'rule': rule.id,
+                    'type': rule.type,
+                    'priority': rule.priority,
+                    'message': rule.format_message(signals, campaign_index)
+                })
+        return result
+
+    def recommend(self, features, predictions, days_ahead):
+        """
+        Рекомендации для одной кампании.
+
+        Args:
+            features (pd.DataFrame): Признаки истории кампании.
+            predictions (list): Предсказания predict_next_days (может быть пустым).
+            days_ahead (int): Горизонт прогноза.
+
+        Returns:
+            list: Рекомендации в порядке приоритета.
+        """
+        campaign_ids, signals = history_signals(features)
+        signals = forecast_signals(signals, predictions_to_forecast(predictions), days_ahead)
+        return self.recommend_many(campaign_ids, signals)[campaign_ids[0]]
+
+    def summarize(self, recommendations):
+        """Сколько кампаний получило рекомендацию каждого правила."""
+        counts = {rule.id: 0 for rule in self.rules}
+        for items in recommendations.values():
+            for item in items:
+                counts[item['rule']] += 1
+        return counts
@@ -0,0 +1,298 @@
+# streaming_ingest.py
+"""
+Потоковый прием исторических данных для обучения.
+
+Тело запроса (JSON-массив записей или JSON Lines) читается из потока
+кусками и разбирается по одной записи, а значения сразу складываются в
+типизированные колоночные буферы NumPy. Список словарей всей истории не
+создается, поэтому пиковая память при приеме близка к размеру итоговых
+колонок. Некорректные записи отбрасываются и подсчитываются.
+"""
+import codecs
+import json
+import math
+import operator
+import re
+import logging
+
+import numpy as np
+
+from history_storage import METRIC_COLUMNS, DATE_DTYPE
+
+logger = logging.getLogger(__name__)
+
+# Размер куска, читаемого из потока
+READ_CHUNK_SIZE = 64 * 1024
+# Максимальный размер одной записи; защищает от бесконечного накопления буфера
+MAX_RECORD_CHARS = 1024 * 1024
+# Грубая оценка размера одной записи в байтах для предварительного выделения буферов
+ESTIMATED_RECORD_BYTES = 120
+# Сколько примеров отброшенных записей возвращать клиенту
+MAX_REJECTED_SAMPLES = 10
+# Сколько разобранных записей накапливать перед переносом в буферы NumPy
+FLUSH_ROWS = 4096
+
+# Пробелы между записями JSON Lines и разделители элементов JSON-массива
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_ARRAY_SEPARATORS = re.compile(r'[ \t\r\n,]*')
+# Извлечение полей записи в порядке date, METRIC_COLUMNS
+_ROW_FIELDS = operator.itemgetter('date', *METRIC_COLUMNS)
+
+
+class IngestError(ValueError):
+    """Тело запроса не удается разобрать как JSON-массив или JSON Lines."""
+
+
+class ColumnBuffers:
+    """Растущие типизированные буферы колонок date и метрик."""
+
+    def __init__(self, capacity=1024):
+        capacity = max(16, int(capacity))
+        self.size = 0
+        self.arrays = {'date': np.empty(capacity, dtype=DATE_DTYPE)}
+        self.arrays.update({col: np.empty(capacity, dtype=float) for col in METRIC_COLUMNS})
+
+    def extend(self, dates, values):
+        """
+        Добавление пачки строк.
+
+        Args:
+            dates (np.ndarray): Даты пачки (datetime64[D]).
+            values (dict): Словарь {метрика: список значений}.
+        """
+        count = len(dates)
+        capacity = len(self.arrays['date'])
+        if self.size + count > capacity:
+            capacity = max(2 * capacity, self.size + count)
+            for array in self.arrays.values():
+                array.resize(capacity, refcheck=False)
+        end = self.size + count
+        self.arrays['date'][self.size:end] = dates
+        for col in METRIC_COLUMNS:
+            self.arrays[col][self.size:end] = values[col]
+        self.size = end
+
+    def finish(self):
+        """
+        Колонки фактического размера. Буферы ужимаются на месте,
+        без копирования данных в новые массивы.
+        """
+        for array in self.arrays.values():
+            array.resize(self.size, refcheck=False)
+        return self.arrays
+
+
+def iter_json_records(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    Последовательный разбор записей из потока байтов.
+
+    Формат определяется по первому значимому символу: '[' - JSON-массив,
+    иначе - JSON Lines (объекты, разделенные переводами строк).
+
+    Args:
+        stream: Файлоподобный объект с методом read(size).
+        chunk_size (int): Размер читаемого куска в байтах.
+
+    Yields:
+        tuple: (номер записи, объект или None, текст ошибки или None).
+            Синтаксически некорректные строки JSON Lines пропускаются с ошибкой;
+            в JSON-массиве такая ошибка прерывает разбор.
+
+    Raises:
+        IngestError: Если массив синтаксически некорректен или запись слишком велика.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    is_array = None
+    array_closed = False
+    index = 0
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            buffer = buffer[pos:] + decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + decoder.decode(chunk)
+        pos = 0
+
+    while True:
+        # Пропускаем пробелы и разделители между записями
+        while True:
+            pos = (_ARRAY_SEPARATORS if is_array else _WHITESPACE).match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                break
+            fill()
+        if pos >= len(buffer):
+            break
+        if is_array is None:
+            is_array = buffer[pos] == '['
+            if is_array:
+                pos += 1
+                continue
+        if is_array and buffer[pos] == ']':
+            array_closed = True
+            pos += 1
+            break
+
+        try:
+            record, end = json_decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            line_end = buffer.find('\n', pos)
+            if not eof and (is_array or line_end == -1):
+                # Запись могла оборваться на границе куска - дочитываем поток
+                if len(buffer) - pos > MAX_RECORD_CHARS:
+                    raise IngestError(f"Запись {index} превышает {MAX_RECORD_CHARS} символов.")
+                fill()
+                continue
+            if is_array:
+                raise IngestError(f"Некорректный JSON в записи {index}: {e.msg}.")
+            # Некорректная строка JSON Lines: отбрасываем до конца строки
+            pos = line_end + 1 if line_end != -1 else len(buffer)
+            yield index, None, f"некорректный JSON: {e.msg}"
+            index += 1
+            continue
+        if end == len(buffer) and not eof and not isinstance(record, (dict, list)):
+            # Число или литерал на границе куска могли быть обрезаны
+            fill()
+            continue
+        pos = end
+        yield index, record, None
+        index += 1
+
+    if is_array and not array_closed:
+        raise IngestError("JSON-массив не закрыт.")
+
+
+def _row_error(row):
+    """Причина, по которой значения записи нельзя принять (разбор по одной записи)."""
+    try:
+        np.datetime64(str(row[0])[:10], 'D')
+    except ValueError:
+        return f"некорректная дата '{row[0]}'"
+    for col, value in zip(METRIC_COLUMNS, row[1:]):
+        try:
+            if not math.isfinite(float(value)):
+                raise ValueError
+        except (TypeError, ValueError):
+            return f"нечисловое значение поля '{col}'"
+    return None
+
+
+class _PendingRows:
+    """
+    Записи, ожидающие переноса в ColumnBuffers. Даты и числа разбираются
+    и проверяются сразу для всей пачки средствами NumPy.
+    """
+
+    def __init__(self):
+        self.indices = []
+        self.rows = []
+
+    def add(self, index, record):
+        """Добавление записи; ValueError, если это не объект или нет обязательного поля."""
+        if not isinstance(record, dict):
+            raise ValueError("запись должна быть объектом")
+        try:
+            row = _ROW_FIELDS(record)
+        except KeyError as e:
+            raise ValueError(f"нет поля {e}")
+        self.indices.append(index)
+        self.rows.append(row)
+
+    def flush(self, buffers, reject):
+        """Перенос пачки в буферы; некорректные записи передаются в reject(index, error)."""
+        if not self.rows:
+            return
+        rows = self.rows
+        try:
+            dates = np.array([str(row[0])[:10] for row in rows], dtype=DATE_DTYPE)
+            values = np.array([row[1:] for row in rows], dtype=float)
+            valid = np.isfinite(values).all(axis=1).all()
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            # В пачке есть некорректные записи - проверяем их по одной
+            keep = []
+            for index, row in zip(self.indices, rows):
+                error = _row_error(row)
+                if error is None:
+                    keep.append(row)
+                else:
+                    reject(index, error)
+            rows = keep
+            dates = np.array([str(row[0])[:10] for row in rows], dtype=DATE_DTYPE)
+            values = np.array([row[1:] for row in rows], dtype=float).reshape(-1, len(METRIC_COLUMNS))
+        buffers.extend(dates, {col: values[:, i] for i, col in enumerate(METRIC_COLUMNS)})
+        self.__init__()
+
+
+class IngestResult:
+    """Результат потокового приема: колонки и статистика отброшенных записей."""
+
+    def __init__(self, columns, rows, rejected, rejected_samples):
+        self.columns = columns
+        self.rows = rows
+        self.rejected = rejected
+        self.rejected_samples = rejected_samples
+
+    def to_dict(self):
+        """Статистика приема для ответа API."""
+        return {
+            'rows': self.rows,
+            'rejected_rows': self.rejected,
+            'rejected_samples': self.rejected_samples
+        }
+
+
+def ingest_stream(stream, content_length=None, max_rows=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    Прием исторических данных из потока в колонки.
+
+    Args:
+        stream: Файлоподобный объект (например, request.stream).
+        content_length (int, optional): Размер тела для предварительного выделения буферов.
+        max_rows (int, optional): Максимальное число принимаемых записей.
+        chunk_size (int): Размер читаемого куска в байтах.
+
+    Returns:
+        IngestResult: Колонки для AdMetricsPredictor.create_features_from_arrays
+            и статистика отброшенных записей.
+
+    Raises:
+        IngestError: Если тело не разбирается или превышен max_rows.
+    """
+    capacity = content_length // ESTIMATED_RECORD_BYTES if content_length else 1024
+    buffers = ColumnBuffers(capacity)
+    pending = _PendingRows()
+    rejected = 0
+    rejected_samples = []
+
+    def reject(index, error):
+        nonlocal rejected
+        rejected += 1
+        if len(rejected_samples) < MAX_REJECTED_SAMPLES:
+            rejected_samples.append({'index': index, 'error': error})
+
+    for index, record, error in iter_json_records(stream, chunk_size):
+        if error is None:
+            try:
+                pending.add(index, record)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            reject(index, error)
+            continue
+        if len(pending.rows) >= FLUSH_ROWS:
+            pending.flush(buffers, reject)
+        if max_rows is not None and buffers.size + len(pending.rows) > max_rows:
+            raise IngestError(f"Превышено максимальное число записей: {max_rows}.")
+    pending.flush(buffers, reject)
+    rejected_samples.sort(key=lambda sample: sample['index'])
+    if rejected:
+        logger.warning(f"При потоковом приеме отброшено {rejected} некорректных записей.")
+    return IngestResult(buffers.finish(), buffers.size, rejected, rejected_samples)
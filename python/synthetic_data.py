@@ -0,0 +1,205 @@
+# synthetic_data.py
+"""
+Векторизованная генерация синтетических рекламных метрик для нагрузочного
+тестирования: N магазинов x M дней одним проходом по массивам NumPy.
+
+Уровень каждой метрики - случайное блуждание (кумулятивная сумма шума) с
+трендом, поверх которого накладываются дневной шум, недельная сезонность и
+ограничение разумными пределами - те же составляющие, что и в
+ml_model.generate_historical_data, но без цикла по дням. Тренд и шаг
+блуждания заданы относительно базового уровня и подобраны так, чтобы ряды
+не упирались в пределы на историях длиной в годы. У каждого магазина
+свой независимый np.random.Generator (SeedSequence.spawn), поэтому данные
+магазина не зависят ни от числа магазинов, ни от размера пачек генерации.
+
+Запуск:
+    python python/synthetic_data.py --shops 1000 --days 3650 --out data/synthetic
+"""
+import argparse
+import os
+import sys
+import time
+import logging
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from history_storage import HistoryStorage, METRIC_COLUMNS, DATE_DTYPE
+
+logger = logging.getLogger(__name__)
+
+# Метрики: (имя, диапазон базового уровня, тренд в день, СКО шага блуждания,
+# СКО дневного шума, пределы). Тренд и СКО - доли базового уровня.
+WALKS = [
+    ('ctr', (0.015, 0.04), 0.0001, 0.004, 0.02, (0.005, 0.08)),
+    ('cr', (0.01, 0.03), 0.00005, 0.004, 0.01, (0.005, 0.05)),
+    ('cpc', (8.0, 25.0), 0.0002, 0.003, 0.03, (5.0, 50.0)),
+    ('spend', (10000.0, 50000.0), 0.0001, 0.005, 0.08, (5000.0, 100000.0)),
+]
+# Амплитуда недельной сезонности CTR и расходов
+SEASONAL_AMPLITUDE = 0.1
+# Диапазон среднего чека для расчета дохода
+REVENUE_PER_CONVERSION = (1000.0, 3000.0)
+
+
+class _ShopStreams:
+    """
+    Независимые генераторы одного магазина: базовые уровни, шаги блужданий,
+    дневной шум и средний чек. Отдельный поток на каждую величину делает
+    результат независимым от размера пачки дней.
+    """
+
+    def __init__(self, seed_sequence):
+        children = seed_sequence.spawn(2 * len(WALKS) + 2)
+        params_rng = np.random.default_rng(children[0])
+        self.base = np.array([params_rng.uniform(*walk[1]) for walk in WALKS])
+        self.steps = [np.random.default_rng(child) for child in children[1:len(WALKS) + 1]]
+        self.daily = [np.random.default_rng(child) for child in children[len(WALKS) + 1:-1]]
+        self.revenue = np.random.default_rng(children[-1])
+
+
+def iter_synthetic_chunks(n_shops=1, days=365, seed=42, start_date='2023-01-01',
+                          chunk_shops=256, chunk_days=None):
+    """
+    Генерация данных пачками ограниченного размера.
+
+    Args:
+        n_shops (int): Число магазинов.
+        days (int): Число дней истории каждого магазина.
+        seed (int): Зерно генерации.
+        start_date (str): Дата первого дня (YYYY-MM-DD).
+        chunk_shops (int): Сколько магазинов генерировать за один проход.
+        chunk_days (int, optional): Сколько дней генерировать за один проход
+            (по умолчанию - все дни сразу).
+
+    Yields:
+        tuple: (индексы магазинов, словарь колонок). Дата - одномерный массив
+            дней пачки, метрики - массивы формы (число магазинов, число дней).
+    """
+    chunk_days = chunk_days or days
+    dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(start_date, 'D') + days)
+    # День недели: 1970-01-01 - четверг (3)
+    weekday = (dates.astype(np.int64) + 3) % 7
+    seasonal = 1 + SEASONAL_AMPLITUDE * np.sin(2 * np.pi * weekday / 7)
+    shop_sequences = np.random.SeedSequence(seed).spawn(n_shops)
+    trends = np.array([walk[2] for walk in WALKS])[None, :, None]
+    step_scales = np.array([walk[3] for walk in WALKS])[None, :, None]
+    daily_scales = np.array([walk[4] for walk in WALKS])[None, :, None]
+
+    for shop_start in range(0, n_shops, chunk_shops):
+        shop_indices = np.arange(shop_start, min(shop_start + chunk_shops, n_shops))
+        streams = [_ShopStreams(shop_sequences[i]) for i in shop_indices]
+        base = np.array([shop.base for shop in streams])[:, :, None]
+        # Накопленное блуждание (доля базового уровня) на конец предыдущей пачки: (магазины, метрики)
+        walk_end = np.zeros(base.shape[:2])
+        for day_start in range(0, days, chunk_days):
+            day_slice = slice(day_start, min(day_start + chunk_days, days))
+            length = day_slice.stop - day_slice.start
+            # Случайные величины пачки: (магазины, метрики, дни)
+            steps = np.array([[rng.standard_normal(length) for rng in shop.steps] for shop in streams])
+            daily = np.array([[rng.standard_normal(length) for rng in shop.daily] for shop in streams])
+            walk = walk_end[:, :, None] + np.cumsum(steps * step_scales, axis=2)
+            walk_end = walk[:, :, -1]
+            day_number = np.arange(day_slice.start, day_slice.stop)[None, None, :]
+            values = base * (1 + trends * day_number + walk) * (1 + daily_scales * daily)
+
+            ctr, cr, cpc, spend = (values[:, i, :] for i in range(len(WALKS)))
+            ctr = ctr * seasonal[day_slice]
+            spend = spend * seasonal[day_slice]
+            ctr, cr, cpc, spend = (
+                np.clip(metric, *walk_params[5]) for metric, walk_params in zip((ctr, cr, cpc, spend), WALKS)
+            )
+
+            impressions = spend / cpc
+            clicks = impressions * ctr
+            conversions = np.floor(clicks * cr)
+            check = np.array([shop.revenue.uniform(*REVENUE_PER_CONVERSION, length) for shop in streams])
+            yield shop_indices, {
+                'date': dates[day_slice],
+                'spend': np.round(spend, 2),
+                'impressions': np.floor(impressions),
+                'clicks': np.floor(clicks),
+                'conversions': conversions,
+                'revenue': np.round(conversions * check, 2)
+            }
+
+
+def generate_historical_data_vectorized(n_shops=1, days=365, seed=42, start_date='2023-01-01'):
+    """
+    Синтетическая история всех магазинов в памяти.
+
+    Args:
+        n_shops (int): Число магазинов.
+        days (int): Число дней истории каждого магазина.
+        seed (int): Зерно генерации.
+        start_date (str): Дата первого дня (YYYY-MM-DD).
+
+    Returns:
+        dict: Плоские колонки date, метрик и shop_id (номер магазина) длиной
+            n_shops * days, упорядоченные по магазину и дате. Для одного
+            магазина подходит для AdMetricsPredictor.create_features_from_arrays.
+    """
+    parts = list(iter_synthetic_chunks(n_shops, days, seed, start_date, chunk_shops=n_shops))
+    shop_indices, columns = parts[0]
+    result = {
+        'shop_id': np.repeat(shop_indices.astype(np.int32), days),
+        'date': np.tile(columns['date'].astype(DATE_DTYPE), n_shops)
+    }
+    result.update({col: columns[col].ravel() for col in METRIC_COLUMNS})
+    return result
+
+
+def shop_dataset_id(shop_index):
+    """Идентификатор набора данных магазина в сгенерированной директории."""
+    return f'shop-{shop_index:06d}'
+
+
+def write_synthetic_dataset(root_dir, n_shops=1, days=365, seed=42, start_date='2023-01-01',
+                            chunk_shops=256, chunk_days=None):
+    """
+    Генерация с записью прямо в формат HistoryStorage (директория на магазин),
+    пачками: в памяти одновременно находится не больше chunk_shops x chunk_days строк.
+
+    Returns:
+        int: Общее число записанных строк.
+    """
+    os.makedirs(root_dir, exist_ok=True)
+    total_rows = 0
+    for shop_indices, columns in iter_synthetic_chunks(n_shops, days, seed, start_date,
+                                                       chunk_shops, chunk_days):
+        for row, shop_index in enumerate(shop_indices):
+            storage = HistoryStorage(os.path.join(root_dir, shop_dataset_id(shop_index)))
+            storage.append_columns({
+                'date': columns['date'],
+                **{col: columns[col][row] for col in METRIC_COLUMNS}
+            })
+            total_rows += len(columns['date'])
+    if chunk_days and chunk_days < days:
+        # Несколько пачек по дням сжимаются в один сегмент на магазин
+        for shop_index in range(n_shops):
+            HistoryStorage(os.path.join(root_dir, shop_dataset_id(shop_index))).compact()
+    return total_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетических данных для нагрузочного тестирования.")
+    parser.add_argument('--shops', type=int, default=100, help="Число магазинов.")
+    parser.add_argument('--days', type=int, default=3650, help="Число дней истории каждого магазина.")
+    parser.add_argument('--seed', type=int, default=42, help="Зерно генерации.")
+    parser.add_argument('--start-date', default='2015-01-01', help="Дата первого дня.")
+    parser.add_argument('--chunk-shops', type=int, default=256, help="Магазинов в одной пачке.")
+    parser.add_argument('--chunk-days', type=int, help="Дней в одной пачке.")
+    parser.add_argument('--out', required=True, help="Директория для записи данных.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = write_synthetic_dataset(args.out, args.shops, args.days, args.seed, args.start_date,
+                                   args.chunk_shops, args.chunk_days)
+    elapsed = time.perf_counter() - start
+    print(f"Сгенерировано {rows} строк ({args.shops} магазинов x {args.days} дней) "
+          f"за {elapsed:.2f} с ({rows / elapsed:,.0f} строк/с) в {args.out}")
+
+
+if __name__ == '__main__':
+    main()
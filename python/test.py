@@ -2,6 +2,7 @@
 import sys
 import os
 import numpy as np
+import pandas as pd
 from sklearn.metrics import r2_score, root_mean_squared_error, mean_absolute_error
 
 # Добавляем путь к папке python
@@ -10,6 +11,7 @@ sys.path.append('./python')
 # Импортируем модель и генератор данных
 try:
     from ml_model import AdMetricsPredictor, generate_historical_data
+    from compiled_forest import CompiledForest
     print("Модуль ml_model загружен.")
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
@@ -66,11 +68,12 @@ except Exception as e:
     exit(1)
 
 # 5. Подготовка данных для сравнения
-# Извлекаем истинные значения из тестовых данных
-y_true_ctr = np.array([d['ctr'] for d in test_data])
-y_true_cr = np.array([d['cr'] for d in test_data])
-y_true_cpc = np.array([d['cpc'] for d in test_data])
-y_true_spend = np.array([d['spend'] for d in test_data])
+# Извлекаем истинные значения из тестовых данных (ctr, cr и cpc вычисляются из сырых метрик)
+test_features = model.create_features(test_data)
+y_true_ctr = test_features['ctr'].to_numpy(dtype=float)
+y_true_cr = test_features['cr'].to_numpy(dtype=float)
+y_true_cpc = test_features['cpc'].to_numpy(dtype=float)
+y_true_spend = test_features['spend'].to_numpy(dtype=float)
 
 # Извлекаем предсказанные значения
 y_pred_ctr = np.array([d['ctr'] for d in predictions])
@@ -107,4 +110,34 @@ if examples_count > 0:
         print(f"  S:   {y_true_spend[i]:.0f} -> {y_pred_spend[i]:.0f}")
         print("-" * 25)
 else:
-    print("Недостаточно данных для отображения примеров.")
\ No newline at end of file
+    print("Недостаточно данных для отображения примеров.")
+# 8. Упакованный лес должен давать те же предсказания, что и sklearn
+print("\n=== Проверка упакованного леса ===")
+X_test = test_features[model.feature_columns]
+compiled = CompiledForest(model.models)
+X_missing = pd.DataFrame(X_test.to_numpy(dtype=float), columns=model.feature_columns)
+X_missing.iloc[::3, 0] = np.nan
+for name, X_check in (("одна строка", X_test.iloc[:1]), ("тестовый период", X_test),
+                      ("пропуски", X_missing)):
+    expected = {target: m.predict(X_check) for target, m in model.models.items()}
+    actual = compiled.predict(X_check.to_numpy(dtype=float))
+    for target in expected:
+        assert np.array_equal(expected[target], actual[target]), f"{target} ({name}): предсказания не совпадают"
+    print(f"{name}: предсказания совпадают ({len(X_check)} строк)")
+
+compiled_model = AdMetricsPredictor(inference='compiled')
+compiled_model.models = model.models
+compiled_model.feature_columns = model.feature_columns
+compiled_model.is_trained = True
+compiled_model.model_version = model.model_version
+assert compiled_model.predict_next_days(train_data, days_ahead=7) == model.predict_next_days(train_data, days_ahead=7), \
+    "predict_next_days: предсказания упакованного леса не совпадают"
+print("predict_next_days: предсказания совпадают")
+
+multioutput = AdMetricsPredictor(engine='multioutput', backend_params={'n_estimators': 20})
+multioutput.train(train_data)
+multioutput_compiled = CompiledForest(multioutput.models)
+assert np.array_equal(multioutput.models['multioutput'].predict(X_test),
+                      multioutput_compiled.predict(X_test.to_numpy())['multioutput']), \
+    "multioutput: предсказания не совпадают"
+print("multioutput: предсказания совпадают")
@@ -0,0 +1,220 @@
+# training_charts.py
+"""
+Готовые данные графиков обучения для /api/training-charts.
+
+Графики строятся один раз по training_stats обученной модели (важность
+признаков, MAE и R2 метрик, кривая обучения ансамбля) и хранятся как готовое
+JSON-тело ответа вместе с ETag и временем создания. Plotly импортируется
+лениво - только при построении графиков, а не при запуске сервиса.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Подписи и цвета метрик на графиках
+TARGET_LABELS = {'ctr': 'CTR', 'cr': 'CR', 'cpc': 'CPC', 'spend': 'Spend'}
+TARGET_COLORS = {'ctr': '#2563eb', 'cr': '#10b981', 'cpc': '#8b5cf6', 'spend': '#dc2626'}
+# Сколько самых важных признаков показывать
+MAX_FEATURES = 15
+CHART_TEMPLATE = 'plotly_white'
+
+
+def build_training_charts(training_stats):
+    """
+    Построение графиков обучения по статистике модели.
+
+    Args:
+        training_stats (dict): AdMetricsPredictor.training_stats.
+
+    Returns:
+        dict: {имя графика: {'data': [...], 'layout': {...}}} из обычных
+            JSON-совместимых значений, как ожидает фронтенд. Графики, для
+            которых в статистике нет данных, пропускаются.
+    """
+    import plotly.graph_objects as go
+
+    figures = {}
+
+    importance = list(training_stats.get('feature_importance', {}).items())[:MAX_FEATURES]
+    if importance:
+        names = [name for name, _ in importance][::-1]
+        values = [value for _, value in importance][::-1]
+        fig_importance = go.Figure(data=go.Bar(
+            x=values,
+            y=names,
+            orientation='h',
+            marker=dict(color=values, colorscale='Blues', showscale=False),
+            text=[f"{value:.2f}" for value in values],
+            textposition='auto',
+        ))
+        fig_importance.update_layout(
+            title="Важность признаков в модели",
+            xaxis_title="Важность",
+            yaxis_title="Признаки",
+            template=CHART_TEMPLATE,
+            height=400,
+            margin=dict(l=150, r=20, t=40, b=40)
+        )
+        figures['feature_importance'] = fig_importance
+
+    accuracy = training_stats.get('accuracy', {})
+    targets = [target for target in TARGET_LABELS if target in accuracy]
+    if targets:
+        fig_mae = go.Figure(data=go.Bar(
+            x=[accuracy[target] for target in targets],
+            y=[TARGET_LABELS[target] for target in targets],
+            orientation='h',
+            marker_color=[TARGET_COLORS[target] for target in targets],
+            text=[f"{accuracy[target]:.4f}" if accuracy[target] < 1 else f"{accuracy[target]:,.0f}"
+                  for target in targets],
+            textposition='auto',
+        ))
+        fig_mae.update_layout(
+            title="Средняя абсолютная ошибка (MAE) предсказаний",
+            xaxis_title="MAE",
+            yaxis_title="Метрики",
+            template=CHART_TEMPLATE,
+            height=300,
+            margin=dict(l=100, r=20, t=40, b=40)
+        )
+        figures['prediction_mae'] = fig_mae
+
+    r2 = training_stats.get('r2', {})
+    targets = [target for target in TARGET_LABELS if r2.get(target) is not None]
+    if targets:
+        fig_r2 = go.Figure(data=go.Bar(
+            x=[TARGET_LABELS[target] for target in targets],
+            y=[r2[target] for target in targets],
+            marker_color=[TARGET_COLORS[target] for target in targets],
+            text=[f"{r2[target]:.2f}" for target in targets],
+            textposition='auto',
+        ))
+        fig_r2.update_layout(
+            title="Коэффициент детерминации (R²) на проверочной выборке",
+            xaxis_title="Метрики",
+            yaxis_title="R²",
+            template=CHART_TEMPLATE,
+            height=300,
+            margin=dict(l=60, r=20, t=40, b=40)
+        )
+        figures['model_r2'] = fig_r2
+
+    # Метрики имеют разный масштаб, поэтому MAE каждой кривой делится на MAE первой стадии
+    loss_curve = training_stats.get('loss_curve', {})
+    if loss_curve:
+        fig_loss = go.Figure()
+        for target, curve in loss_curve.items():
+            first = curve['mae'][0] or 1.0
+            fig_loss.add_trace(go.Scatter(
+                x=curve['stages'],
+                y=[value / first for value in curve['mae']],
+                customdata=curve['mae'],
+                mode='lines+markers',
+                name=TARGET_LABELS.get(target, target),
+                line=dict(color=TARGET_COLORS.get(target), width=2),
+                marker=dict(size=4),
+                hovertemplate="%{x}: MAE %{customdata:.4g}<extra>%{fullData.name}</extra>"
+            ))
+        fig_loss.update_layout(
+            title="История обучения (MAE на проверочной выборке)",
+            xaxis_title="Число деревьев / итераций",
+            yaxis_title="MAE относительно первой стадии",
+            template=CHART_TEMPLATE,
+            height=300,
+            margin=dict(l=60, r=30, t=40, b=60)
+        )
+        figures['training_loss'] = fig_loss
+
+    # to_json сериализует массивы NumPy и шаблон оформления в обычный JSON
+    return {name: json.loads(fig.to_json()) for name, fig in figures.items()}
+
+
+class ChartPayload:
+    """Готовое тело ответа с графиками и его валидаторы для условных запросов."""
+
+    def __init__(self, model_version, body, last_modified):
+        self.model_version = model_version
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = last_modified
+
+
+class TrainingChartsCache:
+    """
+    Графики текущей модели: в памяти и в JSON-файле рядом с артефактом модели,
+    чтобы после перезапуска сервиса не строить их заново.
+    """
+
+    def __init__(self, filepath):
+        """
+        Args:
+            filepath (str): Путь к файлу с сохраненными графиками.
+        """
+        self.filepath = filepath
+        self._payload = None
+        self._lock = threading.Lock()
+
+    def get(self, model_version, training_stats):
+        """
+        Графики для версии модели; строятся, только если сохраненные
+        относятся к другой версии.
+
+        Args:
+            model_version (str): Версия модели (AdMetricsPredictor.model_version).
+            training_stats (dict): Статистика обучения этой версии.
+
+        Returns:
+            ChartPayload: Тело ответа, ETag и время создания.
+        """
+        payload = self._payload
+        if payload is not None and payload.model_version == model_version:
+            return payload
+        with self._lock:
+            if self._payload is None or self._payload.model_version != model_version:
+                self._payload = self._load(model_version) or self._build(model_version, training_stats)
+            return self._payload
+
+    def update(self, model_version, training_stats):
+        """Построение графиков новой модели после обучения."""
+        with self._lock:
+            self._payload = self._build(model_version, training_stats)
+            return self._payload
+
+    def _build(self, model_version, training_stats):
+        start = time.perf_counter()
+        charts = build_training_charts(training_stats)
+        payload = ChartPayload(model_version, json.dumps(charts, ensure_ascii=False).encode('utf-8'), time.time())
+        try:
+            self._save(payload, charts)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить графики обучения в '{self.filepath}': {e}")
+        logger.info(f"Графики обучения для модели {model_version} построены за {time.perf_counter() - start:.2f} с.")
+        return payload
+
+    def _save(self, payload, charts):
+        os.makedirs(os.path.dirname(self.filepath) or '.', exist_ok=True)
+        tmp_path = f'{self.filepath}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'model_version': payload.model_version,
+                'last_modified': payload.last_modified,
+                'charts': charts
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.filepath)
+
+    def _load(self, model_version):
+        """Сохраненные графики, если они построены для этой же версии модели."""
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('model_version') != model_version:
+            return None
+        body = json.dumps(saved['charts'], ensure_ascii=False).encode('utf-8')
+        return ChartPayload(model_version, body, saved['last_modified'])
@@ -0,0 +1,340 @@
+# training_jobs.py
+"""
+Фоновые задачи обучения модели с прогрессом и отменой.
+
+Задача получает функцию обучения, которая вызывается в отдельном потоке
+с колбэком прогресса и событием отмены. Обученная модель возвращается
+функцией как результат; подмена рабочей модели выполняется вызывающим
+кодом (см. api/ml_api.py), поэтому предсказания продолжают обслуживаться
+старой моделью до завершения обучения.
+
+Если задана директория задач, состояние каждой задачи записывается в
+<job_id>.json, поэтому статус и прогресс доступны из любого процесса
+сервиса. Отмена из другого процесса создает файл <job_id>.cancel, который
+процесс, выполняющий задачу, проверяет в точках отмены.
+"""
+import json
+import os
+import re
+import threading
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ml_model import TrainingCancelled
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи обучения
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+# Отмена запрошена, задача остановится в ближайшей точке проверки
+JOB_CANCELLING = 'cancelling'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+# Идентификаторы задач (uuid4().hex), допустимые в имени файла
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _pid_alive(pid):
+    """Существует ли процесс с указанным pid."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class CancelFlag:
+    """
+    Событие отмены задачи (интерфейс is_set/set, как у threading.Event).
+    При заданном файле-маркере отмена, запрошенная другим процессом,
+    видна через is_set, а set создает маркер.
+    """
+
+    def __init__(self, marker_path=None):
+        self._event = threading.Event()
+        self.marker_path = marker_path
+
+    def set(self):
+        self._event.set()
+        if self.marker_path is not None:
+            open(self.marker_path, 'a').close()
+
+    def is_set(self):
+        if not self._event.is_set() and self.marker_path is not None and os.path.exists(self.marker_path):
+            self._event.set()
+        return self._event.is_set()
+
+
+class TrainingJob:
+    """Состояние одной задачи обучения."""
+
+    def __init__(self, job_id, description=None, path=None):
+        """
+        Args:
+            job_id (str): Идентификатор задачи.
+            description (dict, optional): Описание задачи для API.
+            path (str, optional): Файл, в который записывается состояние
+                задачи (см. TrainingJobManager).
+        """
+        self.job_id = job_id
+        self.description = description or {}
+        self.status = JOB_QUEUED
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+        self.pid = os.getpid()
+        self.path = path
+        self.cancel_event = CancelFlag(f'{os.path.splitext(path)[0]}.cancel' if path else None)
+        self.progress = {
+            'completed': 0,
+            'total': None,
+            'fraction': 0.0,
+            'completed_targets': [],
+            'last_target': None
+        }
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Задача, прочитанная из файла состояния. Незавершенная задача,
+        процесс которой уже не существует, получает статус failed.
+
+        Returns:
+            TrainingJob | None: None, если файла нет или он поврежден.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(state['job_id'], state.get('description'), path)
+        for field in ('status', 'created_at', 'started_at', 'finished_at', 'error', 'result', 'progress', 'pid'):
+            setattr(job, field, state.get(field))
+        if job.status not in FINISHED_STATES and job.pid is not None and not _pid_alive(job.pid):
+            job.status = JOB_FAILED
+            job.error = "Процесс, выполнявший задачу, завершился до ее окончания."
+        return job
+
+    def save(self):
+        """Атомарная запись состояния задачи в файл (вызывается под блокировкой задачи)."""
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(self._state(), pid=self.pid), f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.path)
+
+    def update_progress(self, target, completed, total):
+        """Колбэк прогресса для AdMetricsPredictor.train()."""
+        with self._lock:
+            self.progress = {
+                'completed': completed,
+                'total': total,
+                'fraction': round(completed / total, 4) if total else 0.0,
+                'completed_targets': self.progress['completed_targets'] + [target],
+                'last_target': target
+            }
+            self.save()
+
+    def _status(self):
+        """Статус для API: отмена, запрошенная другим процессом, видна сразу."""
+        if self.status in (JOB_QUEUED, JOB_RUNNING) and self.cancel_event.is_set():
+            return JOB_CANCELLING
+        return self.status
+
+    def _state(self):
+        return {
+            'job_id': self.job_id,
+            'status': self._status(),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'result': self.result,
+            'progress': dict(self.progress),
+            'description': self.description
+        }
+
+    def progress_dict(self):
+        """Прогресс задачи."""
+        with self._lock:
+            return dict(self.progress, job_id=self.job_id, status=self._status())
+
+    def to_dict(self):
+        """Полное состояние задачи для API."""
+        with self._lock:
+            return self._state()
+
+
+class TrainingJobManager:
+    """Очередь фоновых задач обучения."""
+
+    def __init__(self, max_workers=1, max_finished_jobs=100, jobs_dir=None):
+        """
+        Args:
+            max_workers (int): Число одновременно выполняемых задач обучения.
+            max_finished_jobs (int): Сколько завершенных задач хранить для запросов статуса.
+            jobs_dir (str, optional): Директория файлов состояния задач, общая
+                для процессов сервиса. Без нее задачи хранятся только в памяти.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='training')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs_dir = jobs_dir
+        if jobs_dir is not None:
+            os.makedirs(jobs_dir, exist_ok=True)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{job_id}.json') if self.jobs_dir is not None else None
+
+    def submit(self, train_fn, description=None):
+        """
+        Постановка задачи обучения в очередь.
+
+        Args:
+            train_fn (callable): Функция train_fn(progress_callback, cancel_event),
+                возвращающая JSON-совместимый результат обучения.
+            description (dict, optional): Описание задачи для API.
+
+        Returns:
+            TrainingJob: Созданная задача.
+        """
+        job_id = uuid.uuid4().hex
+        job = TrainingJob(job_id, description, self._job_path(job_id))
+        with job._lock:
+            job.save()
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job, train_fn)
+        logger.info(f"Задача обучения {job.job_id} поставлена в очередь.")
+        return job
+
+    def _run(self, job, train_fn):
+        with job._lock:
+            if job.cancel_event.is_set():
+                job.status = JOB_CANCELLED
+                job.error = "Задача отменена до запуска."
+                job.finished_at = _now()
+                job.save()
+                return
+            job.status = JOB_RUNNING
+            job.started_at = _now()
+            job.save()
+        try:
+            result = train_fn(job.update_progress, job.cancel_event)
+            status, error = JOB_COMPLETED, None
+            logger.info(f"Задача обучения {job.job_id} завершена.")
+        except TrainingCancelled as e:
+            result, status, error = None, JOB_CANCELLED, str(e)
+            logger.info(f"Задача обучения {job.job_id} отменена.")
+        except Exception as e:
+            result, status, error = None, JOB_FAILED, str(e)
+            logger.error(f"Ошибка в задаче обучения {job.job_id}: {e}", exc_info=True)
+        with job._lock:
+            job.result = result
+            job.status = status
+            job.error = error
+            job.finished_at = _now()
+            job.save()
+        if job.cancel_event.marker_path is not None and os.path.exists(job.cancel_event.marker_path):
+            os.remove(job.cancel_event.marker_path)
+
+    def _prune(self):
+        """Удаляет самые старые завершенные задачи сверх лимита (под блокировкой)."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+        if self.jobs_dir is None:
+            return
+        stored = [job for job in self._stored_jobs() if job.status in FINISHED_STATES]
+        stored.sort(key=lambda job: job.finished_at or job.created_at or '')
+        for job in stored[:max(0, len(stored) - self.max_finished_jobs)]:
+            for path in (job.path, job.cancel_event.marker_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _stored_jobs(self):
+        """Задачи из директории состояний (включая задачи других процессов)."""
+        jobs = []
+        for name in sorted(os.listdir(self.jobs_dir)):
+            job_id, extension = os.path.splitext(name)
+            if extension == '.json' and JOB_ID_PATTERN.match(job_id):
+                job = TrainingJob.from_file(os.path.join(self.jobs_dir, name))
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def get(self, job_id):
+        """
+        Задача по идентификатору или None. Задача другого процесса
+        читается из директории состояний (снимок без возможности
+        обновления, кроме отмены).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.jobs_dir is None or not isinstance(job_id, str) \
+                or not JOB_ID_PATTERN.match(job_id):
+            return job
+        return TrainingJob.from_file(self._job_path(job_id))
+
+    def list(self):
+        """Состояния всех известных задач."""
+        with self._lock:
+            jobs = dict(self._jobs)
+        if self.jobs_dir is not None:
+            for job in self._stored_jobs():
+                jobs.setdefault(job.job_id, job)
+        return [job.to_dict() for job in sorted(jobs.values(), key=lambda job: job.created_at or '')]
+
+    def cancel(self, job_id):
+        """
+        Запрос отмены задачи. Задача в очереди сразу получает статус cancelled,
+        выполняющаяся - статус cancelling до остановки перед обучением модели
+        для следующей метрики или после обучения, до сохранения и подмены модели.
+        Задача другого процесса отменяется файлом-маркером и показывается
+        со статусом cancelling, пока процесс-владелец не остановит ее.
+
+        Returns:
+            TrainingJob | None: Задача или None, если она не найдена.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            job = self.get(job_id)
+            if job is not None and job.status not in FINISHED_STATES:
+                job.cancel_event.set()
+                logger.info(f"Запрошена отмена задачи обучения {job_id} другого процесса.")
+            return job
+        with job._lock:
+            if job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status == JOB_QUEUED:
+                job.status = JOB_CANCELLED
+                job.error = "Задача отменена до запуска."
+                job.finished_at = _now()
+                job.save()
+            else:
+                job.status = JOB_CANCELLING
+                job.save()
+        logger.info(f"Запрошена отмена задачи обучения {job_id}.")
+        return job